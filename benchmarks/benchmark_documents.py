@@ -0,0 +1,96 @@
+"""Benchmark of the document representations for postbox listings:
+validated pydantic Documents vs. CompactDocuments.
+Reports parse throughput, retained memory of the parsed listing
+and the time to classify, sort and name all documents.
+
+Run from the project directory, e.g.:
+    python -m benchmarks.benchmark_documents --documents 100000
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+import typing
+
+from benchmarks.benchmark_sync import create_settings
+from benchmarks.mock_server import MockServerConfig, create_postbox
+from comdirect_api.data.CompactDocument import CompactDocument
+from comdirect_api.data.Document import Document
+from comdirect_api.data.DocumentClassifier import DocumentClassifier
+
+DOCUMENT_TYPES: typing.Dict[str, typing.Any] = {
+    "Document": Document,
+    "CompactDocument": CompactDocument,
+}
+
+
+def run_benchmark(
+    document_type: typing.Any, payload: str
+) -> typing.Dict[str, typing.Any]:
+    """Parse the listing into a set of documents like the handlers do,
+    then classify, sort and name them like the ComdirectAPI does."""
+    listing = json.loads(payload)
+    gc.collect()
+    start = time.perf_counter()
+    documents = set(document_type.from_dict(entry) for entry in listing)
+    parse_duration = time.perf_counter() - start
+
+    # memory retained by the parsed documents (including the strings of the payload
+    # they reference), measured separately as tracing slows down the parsing
+    del documents, listing
+    gc.collect()
+    tracemalloc.start()
+    listing = json.loads(payload)
+    documents = set(document_type.from_dict(entry) for entry in listing)
+    del listing
+    gc.collect()
+    retained_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    document_classifier = DocumentClassifier.for_config(
+        create_settings("http://127.0.0.1", "/tmp", 1).document_classification_config
+    )
+    start = time.perf_counter()
+    for doc in sorted(documents, key=lambda doc: (doc.date_creation, doc.document_id)):
+        classification = document_classifier.classify(doc.name)
+        if not (doc.advertisement or classification.ignored):
+            doc.get_document_path("/tmp", classification.wkn, classification.file_class)
+    process_duration = time.perf_counter() - start
+
+    return {
+        "documents": len(documents),
+        "parse_duration": round(parse_duration, 3),
+        "documents_per_second": round(len(documents) / parse_duration),
+        "retained_memory_mb": round(retained_memory / 2**20, 2),
+        "bytes_per_document": round(retained_memory / max(1, len(documents))),
+        "process_duration": round(process_duration, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--json", help="write the results to this json file")
+    args = parser.parse_args()
+
+    # the documents are parsed from the JSON payload like in the handlers
+    payload = json.dumps(create_postbox(MockServerConfig(documents=args.documents)))
+
+    results = {
+        name: run_benchmark(document_type, payload)
+        for name, document_type in DOCUMENT_TYPES.items()
+    }
+
+    for key in results["Document"]:
+        print(
+            f"{key:>22}: "
+            + "  ".join(f"{name}={result[key]}" for name, result in results.items())
+        )
+    if args.json is not None:
+        with open(args.json, "w", encoding="UTF-8") as json_file:
+            json_file.write(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark of the startup: import of the package, loading the config and creating handlers.
+Reports the import time of ComdirectAPI (fresh interpreter per run), whether the config
+file is opened on import, the time of Settings.from_config and of a DocumentHandler
+construction with given settings.
+
+Run from the project directory, e.g.:
+    python -m benchmarks.benchmark_startup --repeats 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import typing
+
+from comdirect_api import http_utils
+from comdirect_api.data.config_types import Credentials, Settings
+from comdirect_api.handler.AuthenticationHandler import AuthenticationHandler
+from comdirect_api.handler.DocumentHandler import DocumentHandler
+
+# measures the import in a fresh interpreter and records the opened config files
+IMPORT_SCRIPT = """
+import json, sys, time
+opened = []
+sys.addaudithook(
+    lambda event, args: opened.append(str(args[0]))
+    if event == "open" and str(args[0]).endswith("config.json")
+    else None
+)
+start = time.perf_counter()
+import comdirect_api.ComdirectAPI
+print(json.dumps({"duration": time.perf_counter() - start, "opened": opened}))
+"""
+
+
+def measure_import(imports: int) -> typing.Dict[str, typing.Any]:
+    """Import ComdirectAPI in fresh interpreters, the median is reported"""
+    durations = []
+    opened_files: typing.Set[str] = set()
+    for _ in range(imports):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        durations.append(result["duration"])
+        opened_files.update(result["opened"])
+    return {
+        "import_ms": round(statistics.median(durations) * 1000, 1),
+        "config_opened_on_import": sorted(opened_files),
+    }
+
+
+def measure_calls(
+    function: typing.Callable[[], typing.Any], repeats: int
+) -> typing.Tuple[float, typing.Any]:
+    """Mean duration of the calls in milliseconds and the result of the last call"""
+    result = None
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return round((time.perf_counter() - start) / repeats * 1000, 4), result
+
+
+def run_benchmark(
+    config_path: typing.Optional[str], imports: int, repeats: int
+) -> typing.Dict[str, typing.Any]:
+    """Collect the startup measurements"""
+    results = measure_import(imports)
+
+    from_config_ms, settings = measure_calls(
+        lambda: Settings.from_config(config_path), repeats
+    )
+    results["from_config_ms"] = from_config_ms
+
+    # the HTTP session and the authentication are shared by all handlers
+    http_session = http_utils.create_session(settings.transport_config)
+    auth_handler = AuthenticationHandler(
+        settings=settings,
+        http_session=http_session,
+        credentials=Credentials(
+            client_id="benchmark",
+            client_secret="benchmark",
+            username="12345678",
+            password="benchmark",
+            grant_type="password",
+        ),
+        session_cache=None,
+    )
+    results["document_handler_ms"], _ = measure_calls(
+        lambda: DocumentHandler(
+            settings=settings, http_session=http_session, auth_handler=auth_handler
+        ),
+        repeats,
+    )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--config",
+        help="config file to load, defaults to config.json in the project directory",
+    )
+    parser.add_argument(
+        "--imports", type=int, default=5, help="number of fresh interpreters"
+    )
+    parser.add_argument("--repeats", type=int, default=1000)
+    parser.add_argument("--json", help="write the results to this json file")
+    args = parser.parse_args()
+
+    config_path = None if args.config is None else os.path.abspath(args.config)
+    results = run_benchmark(config_path, args.imports, args.repeats)
+
+    for key, value in results.items():
+        print(f"{key:>24}: {value}")
+    if args.json is not None:
+        with open(args.json, "w", encoding="UTF-8") as json_file:
+            json_file.write(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Offline benchmark of ComdirectAPI.process_postbox_documents against the mock server.
+Reports documents per second, listing time, peak memory and request counts.
+
+Run from the project directory, e.g.:
+    python -m benchmarks.benchmark_sync --documents 5000 --latency 0.02 --workers 8
+"""
+import argparse
+import json
+import requests
+import resource
+import tempfile
+import time
+import tracemalloc
+import typing
+
+from benchmarks.mock_server import MockServerConfig, start_server_process
+from comdirect_api.ComdirectAPI import ComdirectAPI
+from comdirect_api.HttpMetrics import HttpMetrics
+from comdirect_api.data.config_types import (
+    ApiConfig,
+    Credentials,
+    DocumentClassificationConfig,
+    Settings,
+    TransportConfig,
+)
+from comdirect_api.handler.AuthenticationHandler import AuthenticationHandler
+from comdirect_api.handler.DocumentHandler import DocumentHandler
+
+
+class TimedDocumentHandler(DocumentHandler):
+    """Document handler which measures the postbox listing and the first download"""
+
+    listing_started: typing.Optional[float] = None
+    listing_finished: typing.Optional[float] = None
+    first_download_finished: typing.Optional[float] = None
+
+    def get_postbox_page(self, *args: typing.Any, **kwargs: typing.Any):
+        if self.listing_started is None:
+            self.listing_started = time.perf_counter()
+        page = super().get_postbox_page(*args, **kwargs)
+        self.listing_finished = time.perf_counter()
+        return page
+
+    def download_document(self, *args: typing.Any, **kwargs: typing.Any):
+        result = super().download_document(*args, **kwargs)
+        if self.first_download_finished is None:
+            self.first_download_finished = time.perf_counter()
+        return result
+
+    def get_listing_duration(self) -> typing.Optional[float]:
+        if self.listing_started is None or self.listing_finished is None:
+            return None
+        return round(self.listing_finished - self.listing_started, 3)
+
+
+def create_settings(
+    base_url: str, output_dir: str, max_download_workers: int
+) -> Settings:
+    """Settings pointing to the mock server"""
+    return Settings(
+        api_config=ApiConfig(api_url=f"{base_url}/api", oauth_url=base_url),
+        transport_config=TransportConfig(pool_maxsize=max(8, max_download_workers)),
+        document_classification_config=DocumentClassificationConfig(
+            known_file_classes={
+                "Kauf",
+                "Ertragsgutschrift",
+                "Kosteninformation",
+                "Steuermitteilung",
+            },
+            ignored_file_classes={"Finanzreport"},
+            unknown_classification="Sonstiges",
+            known_depot_positions={"A0RPWH", "A1JX52", "A2PKXG", "ETF110"},
+        ),
+        credentials_path="",
+        output_dir=output_dir,
+        time_format="%Y-%m-%d %H:%M:%S",
+        max_download_workers=max_download_workers,
+    )
+
+
+def authenticate(auth_handler: AuthenticationHandler) -> None:
+    """Authenticate against the mock server, the mock approves the TAN challenge
+    right away and its status is polled, i.e. no prompt"""
+    auth_handler.authenticate()
+
+
+def run_benchmark(
+    server_config: MockServerConfig,
+    max_download_workers: int,
+    page_size: int,
+    trace_memory: bool = False,
+    metrics_path: typing.Optional[str] = None,
+) -> typing.Dict[str, typing.Any]:
+    """Sync the mock postbox into a temporary directory and collect the measurements.
+    Tracing the memory allocations (tracemalloc) slows down the sync considerably,
+    i.e. don't compare the throughput of runs with and without tracing."""
+    server_process, base_url = start_server_process(server_config)
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            settings = create_settings(base_url, output_dir, max_download_workers)
+            auth_handler = AuthenticationHandler(
+                settings=settings,
+                credentials=Credentials(
+                    client_id="benchmark",
+                    client_secret="benchmark",
+                    username="12345678",
+                    password="benchmark",
+                    grant_type="password",
+                ),
+                session_cache=None,
+            )
+            authenticate(auth_handler)
+            auth_request_counts = requests.get(f"{base_url}/_stats").json()
+
+            document_handler = TimedDocumentHandler(
+                settings=settings,
+                http_session=auth_handler.http_session,
+                auth_handler=auth_handler,
+                page_size=page_size,
+            )
+            comdirect_api = ComdirectAPI(
+                settings=settings,
+                http_session=auth_handler.http_session,
+                document_handler=document_handler,
+                manifest=None,
+                http_metrics=None if metrics_path is None else HttpMetrics(),
+                metrics_path=metrics_path,
+            )
+
+            if trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            sync_report = comdirect_api.process_postbox_documents()
+            duration = time.perf_counter() - start
+            peak_memory: typing.Optional[int] = None
+            if trace_memory:
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+            request_counts = requests.get(f"{base_url}/_stats").json()
+    finally:
+        server_process.terminate()
+
+    if sync_report.processed_documents != server_config.documents:
+        raise RuntimeError(
+            f"The progress bar counted {sync_report.processed_documents} "
+            + f"of {server_config.documents} processed documents"
+        )
+
+    # the document requests include the throttled and failed (5xx) ones
+    downloaded = request_counts.get("document_ok", 0)
+    return {
+        "documents_in_postbox": server_config.documents,
+        "documents_processed": sync_report.processed_documents,
+        "documents_downloaded": downloaded,
+        "document_size": server_config.document_size,
+        "max_download_workers": max_download_workers,
+        "latency": server_config.latency,
+        "duration": round(duration, 3),
+        "listing_duration": document_handler.get_listing_duration(),
+        "time_to_first_download": None
+        if document_handler.first_download_finished is None
+        else round(document_handler.first_download_finished - start, 3),
+        "documents_per_second": round(downloaded / duration, 1)
+        if duration > 0
+        else None,
+        "final_concurrency_limit": comdirect_api.concurrency_limiter.limit,
+        "peak_traced_memory_mb": None
+        if peak_memory is None
+        else round(peak_memory / 2**20, 2),
+        "max_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 1
+        ),
+        "auth_request_counts": auth_request_counts,
+        "request_counts": {
+            endpoint: count - auth_request_counts.get(endpoint, 0)
+            for endpoint, count in request_counts.items()
+            if count - auth_request_counts.get(endpoint, 0) > 0
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--document-size", type=int, default=100 * 1024)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per request"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--max-concurrent-downloads",
+        type=int,
+        default=None,
+        help="throttle (HTTP 429) document requests beyond this concurrency",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=1.0,
+        help="Retry-After of throttled requests",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="trace the peak memory of the allocations (slows down the sync)",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="export the HTTP metrics of the sync (.json or Prometheus text file)",
+    )
+    parser.add_argument("--json", help="write the results to this json file")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        MockServerConfig(
+            documents=args.documents,
+            document_size=args.document_size,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            max_concurrent_downloads=args.max_concurrent_downloads,
+            retry_after=args.retry_after,
+        ),
+        max_download_workers=args.workers,
+        page_size=args.page_size,
+        trace_memory=args.trace_memory,
+        metrics_path=args.metrics,
+    )
+
+    for key, value in results.items():
+        print(f"{key:>24}: {value}")
+    if args.json is not None:
+        with open(args.json, "w", encoding="UTF-8") as json_file:
+            json_file.write(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
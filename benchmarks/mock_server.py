@@ -0,0 +1,503 @@
+"""Local stand-in for the comdirect REST API, used by the benchmarks.
+Implements the endpoints called by this package with a synthetic postbox
+of configurable size, document size, latency and error rate."""
+from pydantic import BaseModel, Field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import collections
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import typing
+import uuid
+import multiprocessing
+
+
+class MockServerConfig(BaseModel):
+    """Config of the mock comdirect API"""
+
+    # number of documents in the postbox
+    documents: int = Field(default=1000, ge=0)
+    # size of each document in bytes
+    document_size: int = Field(default=100 * 1024, ge=0)
+    # serve small valid PDFs with text (see create_pdf) instead of filler bytes
+    pdf_documents: bool = False
+    # latency added to each request in seconds
+    latency: float = Field(default=0.0, ge=0)
+    # share of document/listing requests answered with a transient error
+    error_rate: float = Field(default=0.0, ge=0, le=1)
+    # document requests beyond this number in flight are throttled (HTTP 429)
+    max_concurrent_downloads: typing.Optional[int] = Field(default=None, ge=1)
+    # delay in seconds sent via the Retry-After header of throttled requests
+    retry_after: float = Field(default=1.0, ge=0)
+    # seconds until a TAN challenge is reported as approved
+    tan_approval_delay: float = Field(default=0.0, ge=0)
+    # lifetime of the access tokens in seconds
+    token_lifetime: int = Field(default=599, ge=1)
+    # names used for the documents, formatted with the document index and a WKN
+    document_names: typing.List[str] = Field(
+        default=[
+            "Wertpapierabrechnung Kauf {wkn} iShares Core MSCI World {index}",
+            "Ertragsgutschrift {wkn} Vanguard FTSE All-World {index}",
+            "Kosteninformation {wkn} Sparplan {index}",
+            "Finanzreport Nr. {index}",
+            "Steuermitteilung {wkn} {index}",
+            "Information zu Ihrem Konto {index}",
+        ]
+    )
+    wkns: typing.List[str] = Field(default=["A0RPWH", "A1JX52", "A2PKXG", "ETF110"])
+    # WKN's held in the depot, defaults to the WKN's of the documents
+    depot_wkns: typing.Optional[typing.List[str]] = None
+    seed: int = 0
+
+
+def create_postbox(
+    config: MockServerConfig,
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Synthetic postbox listing, newest documents first"""
+    rng = random.Random(config.seed)
+    today = datetime.date(2023, 1, 1)
+    postbox = []
+    for index in range(config.documents):
+        name_template = config.document_names[index % len(config.document_names)]
+        postbox.append(
+            {
+                "documentId": str(uuid.UUID(int=rng.getrandbits(128))).upper(),
+                "name": name_template.format(index=index, wkn=rng.choice(config.wkns)),
+                "dateCreation": (
+                    today
+                    - datetime.timedelta(days=index * 3650 // max(1, config.documents))
+                ).isoformat(),
+                "mimeType": "application/pdf",
+                "deletable": True,
+                "advertisement": index % 50 == 49,
+                "documentMetaData": {
+                    "archived": False,
+                    "alreadyRead": True,
+                    "dateRead": today.isoformat(),
+                    "predocumentExists": False,
+                },
+                "categoryId": index % 7,
+            }
+        )
+    return postbox
+
+
+def create_pdf(lines: typing.List[str]) -> bytes:
+    """Minimal single page PDF with the given (ASCII) lines of text"""
+    text = " 0 -14 Td ".join(
+        "("
+        + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        + ") Tj"
+        for line in lines
+    )
+    content = f"BT /F1 12 Tf 50 800 Td {text} ET".encode("ascii")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+        + b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref_offset,
+    )
+    return pdf
+
+
+def create_document_text(
+    config: MockServerConfig, document: typing.Dict[str, typing.Any]
+) -> typing.List[str]:
+    """Text of a document: the name, a file class and the (German) ISIN
+    of one of the WKN's, i.e. also documents without WKN in their name
+    can be classified by their text"""
+    index = int(document["documentId"][:8], 16)
+    wkn = config.wkns[index % len(config.wkns)]
+    return [
+        document["name"],
+        "Ertragsgutschrift",
+        f"WKN/ISIN {wkn}/DE000{wkn}0",
+    ]
+
+
+def response_info(key: str, message: str) -> str:
+    """x-http-response-info header as sent by comdirect"""
+    return json.dumps(
+        {
+            "messages": [
+                {"severity": "ERROR", "key": key, "message": message, "args": {}}
+            ]
+        }
+    )
+
+
+class MockComdirectServer(ThreadingHTTPServer):
+    """HTTP server with the state of the mock comdirect API"""
+
+    daemon_threads = True
+
+    def __init__(self, config: MockServerConfig, port: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), MockComdirectRequestHandler)
+        self.config = config
+        self.postbox = create_postbox(config)
+        self.documents_by_id = {doc["documentId"]: doc for doc in self.postbox}
+        self.request_counts: typing.Counter[str] = collections.Counter()
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.seed)
+        self.valid_tokens: typing.Set[str] = set()
+        self.downloads_in_flight = 0
+        # time of the request per TAN challenge
+        self.challenges: typing.Dict[str, float] = {}
+        self.thread: typing.Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "MockComdirectServer":
+        """Serve requests in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def count(self, endpoint: str) -> None:
+        with self.lock:
+            self.request_counts[endpoint] += 1
+
+    def issue_tokens(self) -> typing.Dict[str, typing.Any]:
+        access_token = uuid.uuid4().hex
+        with self.lock:
+            self.valid_tokens.add(access_token)
+        return {
+            "access_token": access_token,
+            "refresh_token": uuid.uuid4().hex,
+            "token_type": "bearer",
+            "expires_in": self.config.token_lifetime,
+            "scope": "TWO_FACTOR",
+        }
+
+    def start_download(self) -> bool:
+        """Register a document request, False if it has to be throttled"""
+        with self.lock:
+            limit = self.config.max_concurrent_downloads
+            if limit is not None and self.downloads_in_flight >= limit:
+                return False
+            self.downloads_in_flight += 1
+            return True
+
+    def finish_download(self) -> None:
+        with self.lock:
+            self.downloads_in_flight -= 1
+
+    def is_error(self) -> bool:
+        with self.lock:
+            return self.rng.random() < self.config.error_rate
+
+
+class MockComdirectRequestHandler(BaseHTTPRequestHandler):
+    """Request handler implementing the comdirect endpoints"""
+
+    server: MockComdirectServer
+    protocol_version = "HTTP/1.1"
+    # headers and body are sent separately, avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        """Don't log every request"""
+
+    def send_json(
+        self,
+        status: int,
+        body: typing.Any,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> None:
+        data = json.dumps(body).encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_info(self, status: int, key: str, message: str) -> None:
+        headers = {"x-http-response-info": response_info(key, message)}
+        if status == 429:
+            headers["Retry-After"] = f"{self.server.config.retry_after:g}"
+        self.send_json(status, {"code": key, "messages": []}, headers)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def is_authorized(self) -> bool:
+        token = self.headers.get("Authorization", "").replace("Bearer ", "")
+        with self.server.lock:
+            return token in self.server.valid_tokens
+
+    def handle_request(self, method: str) -> None:
+        # document requests are in flight including the latency
+        is_download = method == "GET" and self.path.startswith(
+            "/api/messages/v2/documents/"
+        )
+        if is_download and not self.server.start_download():
+            self.read_body()
+            self.server.count("throttled")
+            self.send_error_info(429, "too.many.requests", "Rate limit exceeded")
+            return
+        try:
+            self.dispatch_request(method)
+        finally:
+            if is_download:
+                self.server.finish_download()
+
+    def dispatch_request(self, method: str) -> None:
+        if self.server.config.latency > 0:
+            time.sleep(self.server.config.latency)
+
+        url = urlparse(self.path)
+        path = url.path
+        if method == "GET" and path == "/_stats":
+            # request counts for the benchmarks, not part of the comdirect API
+            with self.server.lock:
+                self.send_json(200, dict(self.server.request_counts))
+            return
+
+        if method == "POST" and path == "/oauth/token":
+            self.server.count("oauth_token")
+            self.read_body()
+            self.send_json(200, self.server.issue_tokens())
+            return
+
+        self.read_body()
+        if not self.is_authorized():
+            self.server.count("unauthorized")
+            self.send_error_info(401, "unauthorized", "Invalid access token")
+            return
+
+        if method == "GET" and path == "/api/session/clients/user/v1/sessions":
+            self.server.count("session")
+            self.send_json(
+                200, [{"identifier": uuid.uuid4().hex, "sessionTanActive": False}]
+            )
+        elif method == "POST" and re.fullmatch(
+            r"/api/session/clients/user/v1/sessions/[^/]+/validate", path
+        ):
+            self.server.count("validate")
+            challenge_id = str(self.server.rng.randint(10**8, 10**9))
+            with self.server.lock:
+                self.server.challenges[challenge_id] = time.monotonic()
+            self.send_json(
+                201,
+                {},
+                {
+                    "x-once-authentication-info": json.dumps(
+                        {
+                            "id": challenge_id,
+                            "typ": "P_TAN_PUSH",
+                            "availableTypes": ["P_TAN_PUSH"],
+                            "link": {
+                                "href": f"/api/session/v1/authentications/{challenge_id}",
+                                "rel": "self",
+                                "method": "GET",
+                                "type": "application/json",
+                            },
+                        }
+                    )
+                },
+            )
+        elif method == "GET" and re.fullmatch(
+            r"/api/session/v1/authentications/[^/]+", path
+        ):
+            self.server.count("authentication_status")
+            with self.server.lock:
+                requested = self.server.challenges.get(path.split("/")[-1])
+            if requested is None:
+                self.send_error_info(404, "unknown_challenge", "Unknown TAN challenge")
+            elif time.monotonic() - requested < self.server.config.tan_approval_delay:
+                self.send_json(200, {"status": "PENDING"})
+            else:
+                self.send_json(200, {"status": "AUTHENTICATED"})
+        elif method == "PATCH" and re.fullmatch(
+            r"/api/session/clients/user/v1/sessions/[^/]+", path
+        ):
+            self.server.count("activate")
+            self.send_json(
+                200, {"identifier": path.split("/")[-1], "sessionTanActive": True}
+            )
+        elif (
+            method == "GET"
+            and path.rstrip("/") == "/api/messages/clients/user/v2/documents"
+        ):
+            self.server.count("documents")
+            if self.server.is_error():
+                self.send_error_info(503, "service.unavailable", "Try again later")
+                return
+            query = parse_qs(url.query)
+            paging_first = int(query.get("paging-first", ["0"])[0])
+            paging_count = int(query.get("paging-count", ["20"])[0])
+            self.send_json(
+                200,
+                {
+                    "paging": {
+                        "index": paging_first,
+                        "matches": len(self.server.postbox),
+                    },
+                    "values": self.server.postbox[
+                        paging_first : paging_first + paging_count
+                    ],
+                },
+            )
+        elif method == "GET" and path.startswith("/api/messages/v2/documents/"):
+            self.server.count("document")
+            if self.server.is_error():
+                self.send_error_info(503, "service.unavailable", "Try again later")
+                return
+            document_id = path.split("/")[-1]
+            if document_id not in self.server.documents_by_id:
+                self.send_error_info(404, "document.not.found", "Unknown document")
+                return
+            self.send_document(document_id)
+        elif method == "GET" and path == "/api/brokerage/clientId/user/v3/depots":
+            self.server.count("depots")
+            self.send_json(
+                200,
+                {"paging": {"index": 0, "matches": 1}, "values": [{"depotId": "D1"}]},
+            )
+        elif method == "GET" and re.fullmatch(
+            r"/api/brokerage/v3/depots/[^/]+/positions", path
+        ):
+            self.server.count("depot_positions")
+            depot_wkns = self.server.config.depot_wkns
+            if depot_wkns is None:
+                depot_wkns = self.server.config.wkns
+            values = [
+                {
+                    "depotId": path.split("/")[-2],
+                    "wkn": wkn,
+                    "instrument": {
+                        "wkn": wkn,
+                        "isin": f"DE000{wkn}0",
+                        "name": f"Security {wkn}",
+                    },
+                }
+                for wkn in depot_wkns
+            ]
+            self.send_json(
+                200,
+                {"paging": {"index": 0, "matches": len(values)}, "values": values},
+            )
+        else:
+            self.server.count("not_found")
+            self.send_error_info(404, "not.found", f"{method} {path}")
+
+    def send_document(self, document_id: str) -> None:
+        if self.server.config.pdf_documents:
+            pdf = create_pdf(
+                create_document_text(
+                    self.server.config, self.server.documents_by_id[document_id]
+                )
+            )
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(pdf)))
+            self.end_headers()
+            self.wfile.write(pdf)
+            # successful downloads, excl. throttled and failed document requests
+            self.server.count("document_ok")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(self.server.config.document_size))
+        self.end_headers()
+        # deterministic content per document
+        block = (b"%PDF-1.4 " + document_id.encode("ascii") + b"\n") * 1024
+        remaining = self.server.config.document_size
+        while remaining > 0:
+            chunk = block[:remaining]
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+        self.server.count("document_ok")
+
+    def do_GET(self) -> None:
+        self.handle_request("GET")
+
+    def do_POST(self) -> None:
+        self.handle_request("POST")
+
+    def do_PATCH(self) -> None:
+        self.handle_request("PATCH")
+
+
+def serve(
+    config: MockServerConfig, base_url_queue: "multiprocessing.Queue[str]"
+) -> None:
+    """Serve the mock API until the process is terminated,
+    the base URL is put into the queue once the server is listening.
+    Target for a separate process, so the server doesn't compete with the client for the GIL."""
+    server = MockComdirectServer(config)
+    base_url_queue.put(server.base_url)
+    server.serve_forever()
+
+
+def start_server_process(
+    config: MockServerConfig,
+) -> typing.Tuple[multiprocessing.Process, str]:
+    """Start the mock API in a separate process
+    Returns:
+        Tuple[multiprocessing.Process, str]: server process, base URL of the mock API
+    """
+    base_url_queue: "multiprocessing.Queue[str]" = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve, args=(config, base_url_queue), daemon=True
+    )
+    process.start()
+    return process, base_url_queue.get(timeout=30)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock of the comdirect REST API")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--document-size", type=int, default=100 * 1024)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per request"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrent-downloads", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockComdirectServer(
+        MockServerConfig(
+            documents=args.documents,
+            document_size=args.document_size,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            max_concurrent_downloads=args.max_concurrent_downloads,
+        ),
+        port=args.port,
+    )
+    print(f"Serving mock comdirect API on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
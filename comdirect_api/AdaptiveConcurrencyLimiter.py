@@ -0,0 +1,91 @@
+from pydantic import BaseModel, Field, PrivateAttr, root_validator
+import contextlib
+import logging
+import threading
+import typing
+
+
+class AdaptiveConcurrencyLimiter(BaseModel):
+    """Limits the number of concurrent requests (e.g. downloads) and adapts the limit
+    to the throttling of the comdirect API (AIMD): the limit increases additively
+    by `increase` per `limit` successful requests, i.e. per round of requests,
+    every throttled request (HTTP 429) decreases it multiplicatively.
+    Throttled requests which were in flight at the last decrease already
+    don't decrease the limit again."""
+
+    max_limit: int = Field(ge=1)
+    min_limit: int = Field(default=1, ge=1)
+    # limit at the start, defaults to max_limit
+    initial_limit: typing.Optional[int] = None
+    # increase of the limit per round of successful requests
+    increase: float = Field(default=1.0, gt=0)
+    # factor applied to the limit per throttled request
+    decrease_factor: float = Field(default=0.5, gt=0, lt=1)
+
+    _limit: float = PrivateAttr()
+    _in_flight: int = PrivateAttr(default=0)
+    # number of responses to requests in flight at the last decrease
+    _pending_responses: int = PrivateAttr(default=0)
+    _condition: threading.Condition = PrivateAttr(default_factory=threading.Condition)
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    @root_validator(skip_on_failure=True)
+    def check_limits(
+        cls, values: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        """Ensure min_limit <= initial_limit <= max_limit"""
+        if values["min_limit"] > values["max_limit"]:
+            raise ValueError("min_limit must not be greater than max_limit")
+        if values["initial_limit"] is None:
+            values["initial_limit"] = values["max_limit"]
+        values["initial_limit"] = min(
+            max(values["initial_limit"], values["min_limit"]), values["max_limit"]
+        )
+        return values
+
+    def __init__(self, **data: typing.Any) -> None:
+        super().__init__(**data)
+        self._limit = float(self.initial_limit)
+
+    @property
+    def limit(self) -> int:
+        """Current number of allowed concurrent requests"""
+        return int(self._limit)
+
+    @contextlib.contextmanager
+    def slot(self) -> typing.Iterator[None]:
+        """Wait until the number of requests in flight is below the limit,
+        the slot is released when the context is left."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def on_success(self) -> None:
+        """Additive increase after a successful request"""
+        with self._condition:
+            self._pending_responses = max(0, self._pending_responses - 1)
+            previous_limit = self.limit
+            self._limit = min(
+                float(self.max_limit), self._limit + self.increase / self._limit
+            )
+            if self.limit > previous_limit:
+                self._condition.notify()
+
+    def on_throttle(self) -> None:
+        """Multiplicative decrease after a throttled request"""
+        with self._condition:
+            if self._pending_responses > 0:
+                self._pending_responses -= 1
+                return
+            # all other requests in flight were sent with the previous limit
+            self._pending_responses = max(0, self._in_flight - 1)
+            self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+            logging.debug(f"Throttled by the API, reduced concurrency to {self.limit}")
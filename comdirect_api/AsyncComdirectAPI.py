@@ -0,0 +1,201 @@
+from pydantic import BaseModel, Field, root_validator, validator
+import asyncio
+import typing
+import aiohttp
+from tqdm import tqdm
+
+from src.handler.AsyncDocumentHandler import AsyncDocumentHandler
+from src.data.CompactDocument import AnyDocument
+from src.data.DocumentClassifier import DocumentClassifier
+from src.ContentStore import ContentStore
+from src.StorageBackend import StorageBackend
+from src.data.config_types import (
+    DocumentClassificationConfig,
+    Settings,
+    StorageConfig,
+    TransportConfig,
+    apply_settings,
+)
+from src.ComdirectAPI import log_sync_report
+
+
+class AsyncComdirectAPI(BaseModel):
+    """Asyncio counterpart of the ComdirectAPI.
+    Downloads are bounded by a semaphore with max_download_workers slots,
+    file system access is performed in the default executor."""
+
+    # settings missing values are taken from, defaults to get_settings()
+    settings: typing.Optional[Settings] = Field(default=None)
+    document_classification_config: DocumentClassificationConfig
+    document_handler: AsyncDocumentHandler = Field(default=None)
+    transport_config: TransportConfig
+    output_dir: str
+    max_download_workers: int = Field(ge=1)
+    # optional content-addressed store, identical documents are saved once
+    content_store: typing.Optional[ContentStore]
+    # where the documents are saved, defaults to the configured backend
+    storage_config: StorageConfig
+    storage: StorageBackend = Field(default=None)
+
+    @root_validator(pre=True)
+    def defaults_from_settings(
+        cls, values: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        """Take missing values from the settings"""
+        return apply_settings(
+            values,
+            {
+                "document_classification_config": lambda settings: (
+                    settings.document_classification_config
+                ),
+                "transport_config": lambda settings: settings.transport_config,
+                "output_dir": lambda settings: settings.get_output_dir(),
+                "max_download_workers": lambda settings: settings.max_download_workers,
+                "content_store": ContentStore.from_settings,
+                "storage_config": lambda settings: settings.storage_config,
+            },
+        )
+
+    @validator("storage", pre=True, always=True)
+    def default_storage(
+        cls,
+        storage: typing.Optional[StorageBackend],
+        values: typing.Dict[str, typing.Any],
+    ) -> StorageBackend:
+        """Create the configured storage backend for the output directory
+        if none is given"""
+        if storage is None:
+            storage = StorageBackend.from_config(
+                values["storage_config"],
+                values["output_dir"],
+                values.get("content_store"),
+            )
+        return storage
+
+    @validator("document_handler", pre=True, always=True)
+    def default_document_handler(
+        cls,
+        document_handler: typing.Optional[AsyncDocumentHandler],
+        values: typing.Dict[str, typing.Any],
+    ) -> AsyncDocumentHandler:
+        """Create a document handler sharing the settings if none is given"""
+        if document_handler is None:
+            settings = values.get("settings")
+            document_handler = (
+                AsyncDocumentHandler()
+                if settings is None
+                else AsyncDocumentHandler(settings=settings)
+            )
+        return document_handler
+
+    def create_client_session(self) -> aiohttp.ClientSession:
+        """Create the aiohttp session used for all requests of a postbox sync"""
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.transport_config.pool_maxsize),
+            timeout=aiohttp.ClientTimeout(
+                connect=self.transport_config.connect_timeout,
+                sock_read=self.transport_config.read_timeout,
+            ),
+        )
+
+    async def process_postbox_documents(self) -> None:
+        """Process all documents in the postbox, see ComdirectAPI.process_postbox_documents()"""
+        # authenticate once before any request is sent
+        await self.document_handler.get_general_headers_async()
+
+        # existing documents are looked up in memory, the index is built in the executor
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.storage.open)
+        try:
+            results, documents = await self.process_documents()
+        finally:
+            # e.g. complete the archive
+            await loop.run_in_executor(None, self.storage.close)
+
+        unmatched_file_names: typing.List[str] = []
+        saved_files: typing.List[str] = []
+        for doc, (doc_path, unmatched) in zip(documents, results):
+            if doc_path is not None:
+                saved_files.append(doc_path)
+            if unmatched:
+                unmatched_file_names.append(doc.name)
+
+        log_sync_report(saved_files, unmatched_file_names)
+
+    async def process_documents(
+        self,
+    ) -> typing.Tuple[
+        typing.List[typing.Tuple[typing.Optional[str], bool]], typing.List[AnyDocument]
+    ]:
+        """List the postbox and process the documents concurrently.
+        Returns:
+            Tuple[List[Tuple[Optional[str], bool]], List[Document]]:
+                saved path and unmatched flag per document, documents
+        """
+        async with self.create_client_session() as session:
+            documents = sorted(
+                await self.document_handler.get_all_postbox_contents(
+                    session, max_concurrency=self.max_download_workers
+                ),
+                key=lambda doc: (doc.date_creation, doc.document_id),
+            )
+
+            semaphore = asyncio.Semaphore(self.max_download_workers)
+            tasks = [
+                self.process_document(session, semaphore, doc) for doc in documents
+            ]
+            progress_bar = tqdm(total=len(tasks), desc="Process documents in postbox")
+
+            async def track(
+                task: typing.Awaitable[typing.Tuple[typing.Optional[str], bool]]
+            ) -> typing.Tuple[typing.Optional[str], bool]:
+                result = await task
+                progress_bar.update()
+                return result
+
+            # gather keeps the order of the documents
+            results = await asyncio.gather(*[track(task) for task in tasks])
+            progress_bar.close()
+
+        return results, documents
+
+    def get_document_classifier(self) -> DocumentClassifier:
+        """Compiled classifier for the document classification config"""
+        return DocumentClassifier.for_config(self.document_classification_config)
+
+    async def process_document(
+        self,
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        document: AnyDocument,
+    ) -> typing.Tuple[typing.Optional[str], bool]:
+        """Download document from the postbox if it's new and no ad.
+        Skip documents which have been saved in the storage already."""
+        # WKN, file class and ignored status in a single pass
+        classification = self.get_document_classifier().classify(document.name)
+        if document.advertisement or classification.ignored:
+            return None, False
+
+        matched_wkn, matched_file_class = classification.wkn, classification.file_class
+        doc_path = document.get_document_path(
+            self.output_dir, matched_wkn, matched_file_class
+        )
+
+        if self.storage.contains(doc_path):
+            # skip files which already have been downloaded
+            return None, False
+
+        async with semaphore:
+            _, document_content = await self.document_handler.get_document(
+                session=session,
+                document_id=document.document_id,
+                document_mime_type=document.mime_type,
+            )
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.storage.save_stream, [document_content], doc_path
+        )
+
+        return doc_path, self.document_classification_config.unknown_classification in [
+            matched_wkn,
+            matched_file_class,
+        ]
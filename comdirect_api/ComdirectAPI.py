@@ -1,86 +1,671 @@
-from pydantic import BaseModel, Field
-import os
+from pydantic import BaseModel, Field, root_validator, validator
+import requests
+import collections
+import contextlib
+import datetime
+import functools
+import json
+import sys
+import threading
 from tqdm import tqdm
 import logging
 import typing
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from src.handler.DocumentHandler import DocumentHandler
-from src.data.Document import Document
-from src import file_utils
-from src.data.config_types import DocumentClassificationConfig
+from src.handler.DepotHandler import DepotHandler
+from src.handler.DocumentHandler import DocumentHandler, PostboxPage
+from src.data.CompactDocument import AnyDocument
+from src.data.DocumentClassifier import ClassificationResult, DocumentClassifier
+from src import http_utils
+from src.SyncManifest import SyncManifest
+from src.ContentClassifier import ContentClassifier, Reclassification
+from src.ContentStore import ContentStore
+from src.DepotPositionCache import DepotPositionCache
+from src.DocumentCatalog import DocumentCatalog
+from src.HttpMetrics import HttpMetrics
+from src.StageProfiler import StageProfiler, profile_stage
+from src.StorageBackend import DirectoryStorage, StorageBackend
+from src.AdaptiveConcurrencyLimiter import AdaptiveConcurrencyLimiter
+from src.data.config_types import (
+    DocumentClassificationConfig,
+    Settings,
+    StorageConfig,
+    apply_settings,
+)
+
+
+def log_sync_report(
+    saved_files: typing.List[str], unmatched_file_names: typing.List[str]
+) -> None:
+    """Log the saved and unmatched files of a postbox sync"""
+    if len(saved_files) > 0:
+        # print all unmatched files in case of new names or similar cases
+        print("\n\n\n")
+        print("#########################################################")
+        logging.info("Saved files:")
+        for saved_file in saved_files:
+            logging.info(saved_file)
+
+    if len(unmatched_file_names) > 0:
+        # print all unmatched files in case of new names or similar cases
+        print("\n\n\n")
+        print("#########################################################")
+        logging.info("Unmatched files:\n")
+        for saved_file in unmatched_file_names:
+            logging.info(saved_file)
+
+
+class SyncReport(typing.NamedTuple):
+    """Result of a postbox sync"""
+
+    # paths of the saved files
+    saved_files: typing.List[str]
+    # names of the saved documents which couldn't be classified completely
+    unmatched_file_names: typing.List[str]
+    # documents counted by the progress bar, i.e. processed (saved or skipped)
+    processed_documents: int = 0
+
+
+# actions of the sync plan
+PLAN_DOWNLOAD = "download"
+PLAN_SKIP = "skip"
+# reasons to skip a document
+SKIP_KNOWN = "known"
+SKIP_ADVERTISEMENT = "advertisement"
+SKIP_IGNORED = "ignored"
+SKIP_EXISTS = "exists"
+
+
+class SyncPlanEntry(typing.NamedTuple):
+    """What the sync does with a document, see ComdirectAPI.plan_postbox_documents()"""
+
+    document_id: str
+    name: str
+    date_creation: datetime.date
+    mime_type: str
+    # PLAN_DOWNLOAD or PLAN_SKIP
+    action: str
+    # reason to skip the document (SKIP_*), None for downloads
+    reason: typing.Optional[str]
+    # None if the document isn't classified (known from the manifest)
+    wkn: typing.Optional[str]
+    file_class: typing.Optional[str]
+    # path the document is (or was) saved to, None if it isn't saved
+    path: typing.Optional[str]
+    # the WKN or file class couldn't be matched
+    unmatched: bool
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        """Entry with JSON compatible values"""
+        return {**self._asdict(), "date_creation": self.date_creation.isoformat()}
+
+    def to_json(self) -> str:
+        """Entry as JSON object (one line of the JSON Lines plan)"""
+        return json.dumps(self.to_dict(), ensure_ascii=False)
 
 
 class ComdirectAPI(BaseModel):
     """Takes care of all the interaction with the Comdirect handlers."""
 
-    document_classification_config: DocumentClassificationConfig = Field(
-        default_factory=DocumentClassificationConfig.from_config
-    )
-    document_handler: DocumentHandler = Field(default_factory=DocumentHandler)
-    output_dir: str = Field(default_factory=file_utils.get_output_dir)
-
-    def process_postbox_documents(self) -> None:
-        """Process all documents in the postbox"""
-        documents = self.document_handler.get_all_postbox_contents()
-
-        unmatched_file_names: typing.List[str] = []
-        saved_files: typing.List[str] = []
-        for doc in tqdm(documents, desc="Process documents in postbox"):
-            doc_path, unmatched = self.process_document(doc)
-            if doc_path is not None:
-                saved_files.append(doc_path)
-            if unmatched:
-                unmatched_file_names.append(doc.name)
-
-        if len(saved_files) > 0:
-            # print all unmatched files in case of new names or similar cases
-            print("\n\n\n")
-            print("#########################################################")
-            logging.info("Saved files:")
-            for saved_file in saved_files:
-                logging.info(saved_file)
-
-        if len(unmatched_file_names) > 0:
-            # print all unmatched files in case of new names or similar cases
-            print("\n\n\n")
-            print("#########################################################")
-            logging.info("Unmatched files:\n")
-            for saved_file in unmatched_file_names:
-                logging.info(saved_file)
+    # settings missing values are taken from, defaults to get_settings()
+    settings: typing.Optional[Settings] = Field(default=None)
+    document_classification_config: DocumentClassificationConfig
+    # pooled HTTP session shared by all handlers
+    http_session: requests.Session
+    output_dir: str
+    max_download_workers: int = Field(ge=1)
+    # maximum number of listed documents waiting for the download workers
+    max_pending_documents: int = Field(default=256, ge=1)
+    # adapts the number of concurrent downloads to the throttling of the API
+    concurrency_limiter: AdaptiveConcurrencyLimiter = Field(default=None)
+    document_handler: DocumentHandler = Field(default=None)
+    # optional record of the synced documents for incremental runs
+    manifest: typing.Optional[SyncManifest]
+    # optional content-addressed store, identical documents are saved once
+    content_store: typing.Optional[ContentStore]
+    # optional catalog of the metadata of all listed documents
+    catalog: typing.Optional[DocumentCatalog]
+    # optional classification of unmatched documents by their text
+    content_classifier: typing.Optional[ContentClassifier]
+    # optional depot positions retrieved from the API, complement the known positions
+    depot_position_cache: typing.Optional[DepotPositionCache]
+    # where the documents are saved, defaults to the configured backend
+    storage_config: StorageConfig
+    storage: StorageBackend = Field(default=None)
+    # optional measurements of all requests, exported to metrics_path after a sync
+    http_metrics: typing.Optional[HttpMetrics]
+    metrics_path: typing.Optional[str]
+    # optional profiling of the stages of a sync, written to the profile path
+    profiler: typing.Optional[StageProfiler]
+    # description of the progress bar
+    progress_description: str = "Process documents in postbox"
+    # log the saved and unmatched files after the sync
+    log_report: bool = True
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @root_validator(pre=True)
+    def defaults_from_settings(
+        cls, values: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        """Take missing values from the settings"""
+        return apply_settings(
+            values,
+            {
+                "document_classification_config": lambda settings: (
+                    settings.document_classification_config
+                ),
+                "http_session": lambda settings: http_utils.create_session(
+                    settings.transport_config
+                ),
+                "output_dir": lambda settings: settings.get_output_dir(),
+                "max_download_workers": lambda settings: settings.max_download_workers,
+                "manifest": SyncManifest.from_settings,
+                "content_store": ContentStore.from_settings,
+                "catalog": DocumentCatalog.from_settings,
+                "content_classifier": ContentClassifier.from_settings,
+                "depot_position_cache": DepotPositionCache.from_settings,
+                "storage_config": lambda settings: settings.storage_config,
+                "http_metrics": lambda settings: None
+                if settings.metrics_path is None
+                else HttpMetrics(),
+                "metrics_path": lambda settings: settings.metrics_path,
+                "profiler": StageProfiler.from_settings,
+            },
+        )
+
+    @validator("http_metrics")
+    def install_http_metrics(
+        cls,
+        http_metrics: typing.Optional[HttpMetrics],
+        values: typing.Dict[str, typing.Any],
+    ) -> typing.Optional[HttpMetrics]:
+        """Record all requests sent via the shared HTTP session"""
+        if http_metrics is not None and values.get("http_session") is not None:
+            http_metrics.install(values["http_session"])
+        return http_metrics
+
+    @validator("storage", pre=True, always=True)
+    def default_storage(
+        cls,
+        storage: typing.Optional[StorageBackend],
+        values: typing.Dict[str, typing.Any],
+    ) -> StorageBackend:
+        """Create the configured storage backend for the output directory
+        if none is given"""
+        if storage is None:
+            storage = StorageBackend.from_config(
+                values["storage_config"],
+                values["output_dir"],
+                values.get("content_store"),
+            )
+        if values.get("content_classifier") is not None and not isinstance(
+            storage, DirectoryStorage
+        ):
+            # the texts are extracted from the saved files
+            raise ValueError(
+                "The content classification requires the directory storage backend"
+            )
+        return storage
+
+    @validator("concurrency_limiter", pre=True, always=True)
+    def default_concurrency_limiter(
+        cls,
+        concurrency_limiter: typing.Optional[AdaptiveConcurrencyLimiter],
+        values: typing.Dict[str, typing.Any],
+    ) -> AdaptiveConcurrencyLimiter:
+        """Start with max_download_workers concurrent downloads if no limiter is given"""
+        if concurrency_limiter is None:
+            concurrency_limiter = AdaptiveConcurrencyLimiter(
+                max_limit=values.get("max_download_workers", 1)
+            )
+        return concurrency_limiter
+
+    @validator("document_handler", pre=True, always=True)
+    def default_document_handler(
+        cls,
+        document_handler: typing.Optional[DocumentHandler],
+        values: typing.Dict[str, typing.Any],
+    ) -> DocumentHandler:
+        """Create a document handler sharing the settings, the HTTP session
+        and the concurrency limiter if none is given"""
+        if document_handler is None:
+            document_handler = DocumentHandler(
+                **{
+                    field: values[field]
+                    for field in ["settings", "http_session", "concurrency_limiter"]
+                    if values.get(field) is not None
+                }
+            )
+        elif document_handler.concurrency_limiter is None:
+            # the limiter needs the feedback of the handler
+            document_handler.concurrency_limiter = values.get("concurrency_limiter")
+        return document_handler
+
+    def process_postbox_documents(
+        self, pages: typing.Optional[typing.Iterable[PostboxPage]] = None
+    ) -> SyncReport:
+        """Process all documents in the postbox (or the documents of the given pages).
+        The listing is pipelined into the downloads, i.e. documents are processed
+        while later pages are still listed. Documents are downloaded concurrently
+        by up to max_download_workers workers, at most max_pending_documents
+        documents are queued (backpressure on the listing).
+        The reporting keeps a deterministic order (creation date, document id).
+        If a manifest is configured, the listing stops at the first page
+        which only contains known documents older than the last sync.
+        Existing documents are looked up in an index of the storage,
+        which is built once when the first lookup is required
+        (the index of a directory is kept for later syncs,
+        see StorageBackend.invalidate()).
+
+        If a depot position cache is configured, the depot positions are updated first.
+        If a profiler is configured, the stages of the sync are profiled.
+
+        Args:
+            pages (Iterable[PostboxPage], optional): process these documents
+                instead of listing the postbox, e.g. new documents. Defaults to None.
+
+        Returns:
+            SyncReport: saved files and unmatched file names
+        """
+        with contextlib.nullcontext() if self.profiler is None else (
+            self.profiler.profile()
+        ):
+            self.update_depot_positions()
+            try:
+                return self.process_pages(pages)
+            finally:
+                # e.g. complete the archive, the index of a directory is kept
+                self.storage.close()
+                if self.content_classifier is not None:
+                    # the pool isn't kept alive between the syncs
+                    self.content_classifier.stop_workers()
+
+    def close(self) -> None:
+        """Close the storage and release the databases and the process pool
+        of the manifest, catalog and content classifier"""
+        self.storage.close()
+        for resource in [self.content_classifier, self.manifest, self.catalog]:
+            if resource is not None:
+                resource.close()
+
+    def __enter__(self) -> "ComdirectAPI":
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
+
+    def process_pages(
+        self, pages: typing.Optional[typing.Iterable[PostboxPage]] = None
+    ) -> SyncReport:
+        """Process the documents of the pages, see process_postbox_documents().
+        Lists the postbox if no pages are given."""
+        if pages is None:
+            pages = self.document_handler.iter_postbox_pages(
+                max_workers=self.max_download_workers,
+                # without a previous sync all pages are fetched concurrently
+                stop_condition=None
+                if self.manifest is None or self.manifest.get_watermark() is None
+                else self.is_page_synced,
+            )
+
+        pending_documents = threading.BoundedSemaphore(self.max_pending_documents)
+        results_lock = threading.Lock()
+        # (creation date, document id) of the documents to sort the report
+        saved_files: typing.List[typing.Tuple[typing.Any, str]] = []
+        unmatched_file_names: typing.List[typing.Tuple[typing.Any, str]] = []
+        errors: typing.List[BaseException] = []
+        newest_date_creation: typing.Optional[datetime.date] = None
+
+        def on_document_processed(
+            sort_key: typing.Any, name: str, progress: tqdm, future: Future
+        ) -> None:
+            """Collect the result of a document, the futures aren't kept"""
+            try:
+                exception = future.exception()
+                with results_lock:
+                    if exception is not None:
+                        errors.append(exception)
+                        return
+                    doc_path, unmatched = future.result()
+                    if doc_path is not None:
+                        saved_files.append((sort_key, doc_path))
+                    if unmatched:
+                        unmatched_file_names.append((sort_key, name))
+            finally:
+                pending_documents.release()
+                progress.update()
+
+        # the executor waits for the downloads before the progress bar is closed
+        with tqdm(desc=self.progress_description) as progress, ThreadPoolExecutor(
+            max_workers=self.max_download_workers
+        ) as executor:
+            for page in pages:
+                progress.total = page.matches
+                progress.refresh()
+                if self.catalog is not None:
+                    self.catalog.add_documents(
+                        page.documents, self.get_document_classifier()
+                    )
+                for doc in page.documents:
+                    if len(errors) > 0:
+                        break
+                    if (
+                        newest_date_creation is None
+                        or newest_date_creation < doc.date_creation
+                    ):
+                        newest_date_creation = doc.date_creation
+
+                    pending_documents.acquire()
+                    executor.submit(self.process_document, doc).add_done_callback(
+                        functools.partial(
+                            on_document_processed,
+                            (doc.date_creation, doc.document_id),
+                            doc.name,
+                            progress,
+                        )
+                    )
+                if len(errors) > 0:
+                    break
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        if self.content_classifier is not None:
+            # the texts have been extracted while downloading
+            for reclassification in self.content_classifier.complete():
+                doc_path = self.move_document(reclassification)
+                if doc_path is None:
+                    continue
+                document = reclassification.document
+                sort_key = (document.date_creation, document.document_id)
+                saved_files = [
+                    (key, doc_path if key == sort_key else path)
+                    for key, path in saved_files
+                ]
+                if not self.is_unmatched(reclassification.classification):
+                    unmatched_file_names = [
+                        (key, name)
+                        for key, name in unmatched_file_names
+                        if key != sort_key
+                    ]
+
+        if self.manifest is not None and newest_date_creation is not None:
+            # all documents have been processed, i.e. move the watermark
+            watermark = self.manifest.get_watermark()
+            if watermark is None or watermark < newest_date_creation:
+                self.manifest.set_watermark(newest_date_creation)
+
+        saved_files.sort()
+        unmatched_file_names.sort()
+        sync_report = SyncReport(
+            saved_files=[doc_path for _, doc_path in saved_files],
+            unmatched_file_names=[name for _, name in unmatched_file_names],
+            processed_documents=progress.n,
+        )
+        if self.log_report:
+            log_sync_report(sync_report.saved_files, sync_report.unmatched_file_names)
+
+        if self.http_metrics is not None and self.metrics_path is not None:
+            self.http_metrics.write(self.metrics_path)
+            logging.info(f"Saved HTTP metrics to {self.metrics_path}")
+
+        return sync_report
+
+    def plan_postbox_documents(
+        self, plan_path: typing.Optional[str] = None
+    ) -> typing.List[SyncPlanEntry]:
+        """Compute what process_postbox_documents() would do (dry run):
+        the postbox is listed like for a sync and every document is classified
+        and checked against the manifest and the output directory,
+        but no document is downloaded and nothing is written to the output
+        directory or the manifest.
+
+        Args:
+            plan_path (str, optional): write the plan as JSON Lines to this path,
+                                       "-" for stdout. Defaults to None.
+
+        Returns:
+            List[SyncPlanEntry]: plan sorted like the report of a sync
+        """
+        self.update_depot_positions()
+        documents = sorted(
+            self.document_handler.iter_postbox_contents(
+                max_workers=self.max_download_workers,
+                stop_condition=None
+                if self.manifest is None or self.manifest.get_watermark() is None
+                else self.is_page_synced,
+            ),
+            key=lambda doc: (doc.date_creation, doc.document_id),
+        )
+        try:
+            plan = [self.plan_document(doc) for doc in documents]
+        finally:
+            self.storage.close()
+        if self.catalog is not None:
+            self.catalog.add_documents(documents, self.get_document_classifier())
+
+        if plan_path == "-":
+            sys.stdout.writelines(f"{entry.to_json()}\n" for entry in plan)
+        elif plan_path is not None:
+            with open(plan_path, "w", encoding="UTF-8") as plan_file:
+                plan_file.writelines(f"{entry.to_json()}\n" for entry in plan)
+            logging.info(f"Saved sync plan to {plan_path}")
+
+        actions = collections.Counter(
+            entry.action if entry.reason is None else f"{entry.action} ({entry.reason})"
+            for entry in plan
+        )
+        logging.info(
+            f"Sync plan of {len(plan)} documents: "
+            + ", ".join(
+                f"{count} {action}" for action, count in sorted(actions.items())
+            )
+            + f", {sum(entry.unmatched for entry in plan)} unmatched"
+        )
+        return plan
+
+    def update_depot_positions(self) -> None:
+        """Add the current and former depot positions retrieved from the API
+        (see DepotPositionCache) to the known depot positions of the classification.
+        Their ISIN's are used by the content classification as well."""
+        if self.depot_position_cache is None:
+            return
+
+        document_handler = self.document_handler
+        positions = self.depot_position_cache.get_positions(
+            DepotHandler(
+                api_config=document_handler.api_config,
+                time_format=document_handler.time_format,
+                retry_policy=document_handler.retry_policy,
+                http_session=document_handler.http_session,
+                auth_handler=document_handler.auth_handler,
+                concurrency_limiter=document_handler.concurrency_limiter,
+            )
+        )
+        known_depot_positions = (
+            self.document_classification_config.known_depot_positions
+        )
+        if not set(positions).issubset(known_depot_positions):
+            # a new config, i.e. the classifier is compiled again
+            self.document_classification_config = (
+                self.document_classification_config.copy(
+                    update={
+                        "known_depot_positions": known_depot_positions | set(positions)
+                    }
+                )
+            )
+        if self.content_classifier is not None:
+            self.content_classifier.document_classification_config = (
+                self.document_classification_config
+            )
+            # the configured ISIN's take precedence
+            self.content_classifier.isin_to_wkn = {
+                **{
+                    position.isin: position.wkn
+                    for position in positions.values()
+                    if position.isin is not None
+                },
+                **self.content_classifier.isin_to_wkn,
+            }
+
+    def is_page_synced(self, documents: typing.List[AnyDocument]) -> bool:
+        """Check if all documents of a postbox page are older than the last sync
+        and have been synced (or skipped) already."""
+        watermark = self.manifest.get_watermark()
+        if watermark is None:
+            return False
+
+        document_classifier = self.get_document_classifier()
+        return all(
+            doc.date_creation <= watermark
+            and (
+                self.manifest.contains(doc.document_id)
+                or doc.advertisement
+                or document_classifier.classify(doc.name).ignored
+            )
+            for doc in documents
+        )
+
+    def get_document_classifier(self) -> DocumentClassifier:
+        """Compiled classifier for the document classification config"""
+        return DocumentClassifier.for_config(self.document_classification_config)
+
+    def plan_document(self, document: AnyDocument) -> SyncPlanEntry:
+        """Decide if the document is downloaded (and where to) or skipped,
+        existing documents are looked up in the storage."""
+        entry = functools.partial(
+            SyncPlanEntry,
+            document_id=document.document_id,
+            name=document.name,
+            date_creation=document.date_creation,
+            mime_type=document.mime_type,
+        )
+        if self.manifest is not None and self.manifest.contains(document.document_id):
+            # known from a previous sync, independent of its (current) path
+            return entry(
+                action=PLAN_SKIP,
+                reason=SKIP_KNOWN,
+                wkn=None,
+                file_class=None,
+                path=None,
+                unmatched=False,
+            )
+
+        with profile_stage("classification"):
+            # WKN, file class and ignored status in a single pass
+            classification = self.get_document_classifier().classify(document.name)
+            if self.content_classifier is not None and self.is_unmatched(
+                classification
+            ):
+                # the text of the document might be known from a previous sync
+                classification = self.content_classifier.lookup(
+                    document.document_id, classification
+                )
+        matched_wkn, matched_file_class = classification.wkn, classification.file_class
+        if document.advertisement or classification.ignored:
+            return entry(
+                action=PLAN_SKIP,
+                reason=SKIP_ADVERTISEMENT if document.advertisement else SKIP_IGNORED,
+                wkn=matched_wkn,
+                file_class=matched_file_class,
+                path=None,
+                unmatched=False,
+            )
+
+        with profile_stage("path"):
+            doc_path = document.get_document_path(
+                self.output_dir, matched_wkn, matched_file_class
+            )
+        exists = self.storage.contains(doc_path)
+        return entry(
+            action=PLAN_SKIP if exists else PLAN_DOWNLOAD,
+            reason=SKIP_EXISTS if exists else None,
+            wkn=matched_wkn,
+            file_class=matched_file_class,
+            path=doc_path,
+            unmatched=self.is_unmatched(classification),
+        )
+
+    def is_unmatched(self, classification: ClassificationResult) -> bool:
+        """Check if the WKN or the file class couldn't be matched"""
+        return self.document_classification_config.unknown_classification in [
+            classification.wkn,
+            classification.file_class,
+        ]
 
     def process_document(
-        self, document: Document
+        self, document: AnyDocument
     ) -> typing.Tuple[typing.Optional[str], bool]:
         """Download document from the postbox if it's new and no ad.
-        Skip documents which have been downloaded already."""
-        if document.skip_download(
-            self.document_classification_config.ignored_file_classes
-        ):
+        Skip documents which have been saved in the storage already."""
+        entry = self.plan_document(document)
+        if entry.action == PLAN_SKIP:
+            if entry.reason == SKIP_EXISTS and self.manifest is not None:
+                # skip files which already have been downloaded
+                self.manifest.add(
+                    document,
+                    entry.wkn,
+                    entry.file_class,
+                    entry.path,
+                    size=self.storage.get_size(entry.path),
+                )
             return None, False
 
-        (
-            matched_wkn,
-            matched_file_class,
-        ) = document.classify(self.document_classification_config)
-        doc_path = file_utils.replace_invalid_chars(
-            os.path.join(
-                self.output_dir,
-                matched_wkn,
-                matched_file_class,
-                document.get_document_file_name(),
+        doc_path = entry.path
+        with self.concurrency_limiter.slot():
+            size, sha256 = self.document_handler.download_document(
+                document_id=document.document_id,
+                document_mime_type=document.mime_type,
+                document_path=doc_path,
+                storage=self.storage,
+            )
+        if self.manifest is not None:
+            self.manifest.add(
+                document,
+                entry.wkn,
+                entry.file_class,
+                doc_path,
+                size=size,
+                sha256=sha256,
             )
-        )
 
-        if os.path.exists(doc_path):
-            # skip files which already have been downloaded
-            return None, False
+        if entry.unmatched and self.content_classifier is not None:
+            self.content_classifier.submit(
+                document,
+                doc_path,
+                sha256,
+                ClassificationResult(
+                    wkn=entry.wkn, file_class=entry.file_class, ignored=False
+                ),
+            )
 
-        _, document_content = self.document_handler.get_document(
-            document_id=document.document_id, document_mime_type=document.mime_type
+        return doc_path, entry.unmatched
+
+    def move_document(self, reclassification: Reclassification) -> typing.Optional[str]:
+        """Move a document to the path of its completed classification.
+        Returns the new path, None if a file exists at the new path already."""
+        classification = reclassification.classification
+        doc_path = reclassification.document.get_document_path(
+            self.output_dir, classification.wkn, classification.file_class
         )
-        file_utils.save_pdf(content=document_content, pdf_path=doc_path)
+        if self.storage.contains(doc_path):
+            logging.warning(
+                f"Can't move {reclassification.path} to {doc_path}, the file exists"
+            )
+            return None
 
-        return doc_path, self.document_classification_config.unknown_classification in [
-            matched_wkn,
-            matched_file_class,
-        ]
+        self.storage.move(reclassification.path, doc_path)
+        if self.manifest is not None:
+            self.manifest.add(
+                reclassification.document,
+                classification.wkn,
+                classification.file_class,
+                doc_path,
+                size=self.storage.get_size(doc_path),
+                sha256=reclassification.sha256,
+            )
+
+        logging.info(f"Classified by its text: {doc_path}")
+        return doc_path
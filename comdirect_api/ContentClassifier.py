@@ -0,0 +1,239 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from concurrent.futures import Future, ProcessPoolExecutor
+import logging
+import multiprocessing
+import sqlite3
+import threading
+import typing
+
+from src.data.CompactDocument import AnyDocument
+from src.data.DocumentClassifier import ClassificationResult, DocumentClassifier
+from src.data.config_types import DocumentClassificationConfig, Settings
+
+try:
+    import pypdf
+except ImportError:  # optional, only required for the content classification
+    pypdf = None
+
+
+def extract_pdf_text(pdf_path: str, max_pages: int) -> str:
+    """Text of the first pages of a PDF, runs in the worker processes"""
+    reader = pypdf.PdfReader(pdf_path)
+    return "\n".join(page.extract_text() or "" for page in reader.pages[:max_pages])
+
+
+class Reclassification(typing.NamedTuple):
+    """Document whose WKN or file class was found in its text"""
+
+    document: AnyDocument
+    # current path of the document
+    path: str
+    sha256: str
+    classification: ClassificationResult
+
+
+class ContentClassifier(BaseModel):
+    """Second classification stage for downloaded documents whose name lacks
+    the WKN or the file class: the text of the PDF is extracted in a process pool
+    (i.e. without stalling the downloads) and matched like the names.
+    The texts are cached by the sha256 of the content, i.e. every PDF is parsed once,
+    the content of every classified document is recorded as well, so later syncs
+    know the classification without downloading the document. Requires pypdf."""
+
+    cache_path: str
+    document_classification_config: DocumentClassificationConfig
+    # number of worker processes, defaults to the number of CPUs
+    max_workers: typing.Optional[int] = Field(default=None, ge=1)
+    max_pages: int = Field(default=2, ge=1)
+    isin_to_wkn: typing.Dict[str, str] = Field(default_factory=dict)
+
+    _connection: sqlite3.Connection = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    # sha256 of the content per document id
+    _document_hashes: typing.Dict[str, str] = PrivateAttr(default_factory=dict)
+    _executor: typing.Optional[ProcessPoolExecutor] = PrivateAttr(default=None)
+    _pending: typing.List[
+        typing.Tuple[AnyDocument, str, str, ClassificationResult, Future]
+    ] = PrivateAttr(default_factory=list)
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    def __init__(self, **data: typing.Any) -> None:
+        super().__init__(**data)
+        if pypdf is None:
+            raise RuntimeError("The content classification requires pypdf")
+
+        # the cache is updated by the download workers and the pool's callbacks
+        self._connection = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS texts (
+                sha256 TEXT PRIMARY KEY,
+                text TEXT NOT NULL
+            )"""
+        )
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                document_id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL
+            )"""
+        )
+        self._connection.commit()
+
+        self._document_hashes = dict(
+            self._connection.execute("SELECT document_id, sha256 FROM documents")
+        )
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> typing.Optional["ContentClassifier"]:
+        """Create the content classifier configured in the settings.
+        Returns None if the content classification isn't configured."""
+        config = settings.content_classification_config
+        if config.cache_path is None:
+            return None
+
+        return ContentClassifier(
+            cache_path=config.cache_path,
+            document_classification_config=settings.document_classification_config,
+            max_workers=config.max_workers,
+            max_pages=config.max_pages,
+            isin_to_wkn=config.isin_to_wkn,
+        )
+
+    def classify_text(self, text: str) -> ClassificationResult:
+        """Classify the text of a document like a document name,
+        the configured ISINs are replaced by their WKN's first.
+        WKN's are matched within German ISINs (e.g. DE000A1JX527) anyway."""
+        for isin, wkn in self.isin_to_wkn.items():
+            text = text.replace(isin, wkn)
+        return DocumentClassifier.for_config(
+            self.document_classification_config
+        ).classify(text)
+
+    def merge(
+        self, classification: ClassificationResult, text: str
+    ) -> ClassificationResult:
+        """Complete the classification of the name with the classification of the text,
+        the matches of the name take precedence"""
+        unknown = self.document_classification_config.unknown_classification
+        text_classification = self.classify_text(text)
+        return ClassificationResult(
+            wkn=text_classification.wkn
+            if classification.wkn == unknown
+            else classification.wkn,
+            file_class=text_classification.file_class
+            if classification.file_class == unknown
+            else classification.file_class,
+            ignored=classification.ignored,
+        )
+
+    def get_text(self, sha256: str) -> typing.Optional[str]:
+        """Cached text of the content, None if it hasn't been extracted"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT text FROM texts WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def lookup(
+        self, document_id: str, classification: ClassificationResult
+    ) -> ClassificationResult:
+        """Classification of a known document (from a previous sync) completed
+        with its text. Returns the given classification if the text is unknown."""
+        sha256 = self._document_hashes.get(document_id)
+        text = None if sha256 is None else self.get_text(sha256)
+        return classification if text is None else self.merge(classification, text)
+
+    def submit(
+        self,
+        document: AnyDocument,
+        path: str,
+        sha256: str,
+        classification: ClassificationResult,
+    ) -> None:
+        """Schedule the text extraction of a downloaded document,
+        the results are collected by complete()."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?)",
+                (document.document_id, sha256),
+            )
+            self._connection.commit()
+            self._document_hashes[document.document_id] = sha256
+
+        text = self.get_text(sha256)
+        if text is not None:
+            future: Future = Future()
+            future.set_result(text)
+        else:
+            future = self.get_executor().submit(extract_pdf_text, path, self.max_pages)
+            future.add_done_callback(
+                lambda future: self.save_text(sha256, path, future)
+            )
+
+        with self._lock:
+            self._pending.append((document, path, sha256, classification, future))
+
+    def save_text(self, sha256: str, path: str, future: Future) -> None:
+        """Cache the extracted text, an empty text if the extraction failed
+        (e.g. no PDF), so the content isn't parsed again"""
+        exception = future.exception()
+        if exception is not None:
+            logging.warning(f"Extracting the text of {path} failed: {exception}")
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO texts VALUES (?, ?)",
+                (sha256, "" if exception is not None else future.result()),
+            )
+            self._connection.commit()
+
+    def complete(self) -> typing.List[Reclassification]:
+        """Wait for the scheduled extractions.
+
+        Returns:
+            List[Reclassification]: documents whose classification was completed
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        reclassifications = []
+        for document, path, sha256, classification, future in pending:
+            if future.exception() is not None:
+                continue
+            merged = self.merge(classification, future.result())
+            if merged != classification:
+                reclassifications.append(
+                    Reclassification(
+                        document=document,
+                        path=path,
+                        sha256=sha256,
+                        classification=merged,
+                    )
+                )
+        return reclassifications
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """Process pool of the extraction, started on first use"""
+        with self._lock:
+            if self._executor is None:
+                # spawn, forking the threads of the download workers isn't safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def stop_workers(self) -> None:
+        """Stop the process pool after the running extractions,
+        it is started again by the next extraction"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def close(self) -> None:
+        """Stop the process pool and close the cache"""
+        self.stop_workers()
+        with self._lock:
+            self._connection.close()
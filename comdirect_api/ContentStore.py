@@ -0,0 +1,130 @@
+from pydantic import BaseModel, Field, PrivateAttr, validator
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import typing
+
+from src import file_utils
+from src.data.config_types import Settings
+
+
+class ContentStore(BaseModel):
+    """Content-addressed store of the downloaded documents.
+    Every distinct content is stored once (named by its sha256 hex digest),
+    the readable paths in the output directory are hardlinks to the stored objects,
+    reflinks or copies if hardlinks aren't supported (e.g. across file systems).
+    The store should be on the same file system as the output directory."""
+
+    store_dir: str
+    # preferred way to create the readable paths, see file_utils.LINK_MODES
+    link_mode: str = "hardlink"
+    # documents up to this size in bytes are buffered in memory while downloading,
+    # i.e. duplicates aren't written to disk at all
+    spool_size: int = Field(default=8 * 1024 * 1024, ge=0)
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    @validator("link_mode")
+    def check_link_mode(cls, link_mode: str) -> str:
+        """Ensure that the link mode is known"""
+        if link_mode not in file_utils.LINK_MODES:
+            raise ValueError(
+                f"link_mode must be one of {', '.join(file_utils.LINK_MODES)}"
+            )
+        return link_mode
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> typing.Optional["ContentStore"]:
+        """Open the content store configured in the settings.
+        Returns None if no content store is configured."""
+        if settings.content_store_dir is None:
+            return None
+
+        return ContentStore(
+            store_dir=settings.content_store_dir, link_mode=settings.link_mode
+        )
+
+    def get_object_path(self, sha256: str) -> str:
+        """Path of the stored object with the given sha256 hex digest"""
+        return os.path.join(self.store_dir, sha256[:2], sha256)
+
+    def contains(self, sha256: str) -> bool:
+        """Check if the content is stored already"""
+        return os.path.exists(self.get_object_path(sha256))
+
+    def _create_tmp_file(self) -> typing.Tuple[typing.BinaryIO, str]:
+        """Create a temporary file in the store, renamed to the object path once
+        the content is complete"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            dir=self.store_dir, prefix=".", suffix=".part"
+        )
+        return os.fdopen(tmp_fd, "wb"), tmp_path
+
+    def save_stream(
+        self, chunks: typing.Iterable[bytes], pdf_path: str, create_dir: bool = True
+    ) -> typing.Tuple[int, str]:
+        """
+        Save a stream of chunks in the store (unless the content is known already)
+        and link it to the given path, see file_utils.save_stream().
+        Args:
+            chunks (Iterable[bytes]): file content as stream of chunks
+            pdf_path (str): readable path of the file
+            create_dir (bool, optional): create the directory of the path if missing.
+                                         Defaults to True.
+        Returns:
+            Tuple[int, str]: size of the file, sha256 hex digest of the content
+        """
+        size = 0
+        sha256 = hashlib.sha256()
+        buffer = io.BytesIO()
+        tmp_path: typing.Optional[str] = None
+        tmp_file: typing.Optional[typing.BinaryIO] = None
+        try:
+            for chunk in chunks:
+                sha256.update(chunk)
+                size += len(chunk)
+                if tmp_file is not None:
+                    tmp_file.write(chunk)
+                    continue
+
+                buffer.write(chunk)
+                if size > self.spool_size:
+                    # too large for the memory, continue on disk
+                    tmp_file, tmp_path = self._create_tmp_file()
+                    tmp_file.write(buffer.getbuffer())
+                    buffer = io.BytesIO()
+
+            digest = sha256.hexdigest()
+            object_path = self.get_object_path(digest)
+            if tmp_file is None and not os.path.exists(object_path):
+                # known contents aren't written at all
+                tmp_file, tmp_path = self._create_tmp_file()
+                tmp_file.write(buffer.getbuffer())
+
+            if tmp_file is not None:
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+                tmp_file.close()
+
+            # the files are written outside of the lock, i.e. parallel downloads
+            # don't wait for each other's disk writes. Concurrent downloads of the
+            # same content must not replace the object, the later one is discarded.
+            with self._lock:
+                if tmp_path is not None and not os.path.exists(object_path):
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    os.replace(tmp_path, object_path)
+                    tmp_path = None
+        finally:
+            if tmp_file is not None:
+                tmp_file.close()
+            if tmp_path is not None:
+                os.remove(tmp_path)
+
+        file_utils.link_file(object_path, pdf_path, self.link_mode, create_dir)
+        return size, digest
@@ -0,0 +1,151 @@
+from pydantic import BaseModel, Field
+import datetime
+import json
+import logging
+import os
+import typing
+
+import requests
+
+from src.data.config_types import Settings
+from src.handler.ApiException import ApiException
+from src.handler.DepotHandler import DepotHandler
+
+
+class CachedDepotPosition(typing.NamedTuple):
+    """Security which is or was held in a depot"""
+
+    wkn: str
+    isin: typing.Optional[str]
+    name: typing.Optional[str]
+    first_seen: datetime.date
+    last_seen: datetime.date
+    # False if the position has been sold since
+    held: bool
+
+
+class DepotPositionCache(BaseModel):
+    """Local cache (JSON) of the depot positions, refreshed via the DepotHandler
+    once the cache is older than ttl seconds. Positions which aren't held anymore
+    are kept (marked as not held), i.e. the documents of sold securities
+    are still classified by their WKN. If the refresh fails, the cached
+    positions are used."""
+
+    cache_path: str
+    ttl: float = Field(default=24 * 60 * 60, ge=0)
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> typing.Optional["DepotPositionCache"]:
+        """Create the depot position cache configured in the settings.
+        Returns None if no cache is configured."""
+        config = settings.depot_cache_config
+        if config.cache_path is None:
+            return None
+
+        return DepotPositionCache(cache_path=config.cache_path, ttl=config.ttl)
+
+    def load(
+        self,
+    ) -> typing.Tuple[
+        typing.Optional[datetime.datetime], typing.Dict[str, CachedDepotPosition]
+    ]:
+        """Load the cached positions.
+        Returns:
+            Tuple[Optional[datetime], Dict[str, CachedDepotPosition]]:
+                time of the last refresh (None if never refreshed), positions per WKN
+        """
+        if not os.path.exists(self.cache_path):
+            return None, {}
+
+        with open(self.cache_path, "r", encoding="UTF-8") as cache_file:
+            cache_json = json.loads(cache_file.read())
+
+        positions = {
+            wkn: CachedDepotPosition(
+                wkn=wkn,
+                isin=position.get("isin"),
+                name=position.get("name"),
+                first_seen=datetime.date.fromisoformat(position["first_seen"]),
+                last_seen=datetime.date.fromisoformat(position["last_seen"]),
+                held=position["held"],
+            )
+            for wkn, position in cache_json["positions"].items()
+        }
+        return datetime.datetime.fromisoformat(cache_json["updated_at"]), positions
+
+    def save(
+        self,
+        updated_at: datetime.datetime,
+        positions: typing.Dict[str, CachedDepotPosition],
+    ) -> None:
+        """Save the positions atomically"""
+        cache_data = json.dumps(
+            {
+                "updated_at": updated_at.isoformat(),
+                "positions": {
+                    wkn: {
+                        "isin": position.isin,
+                        "name": position.name,
+                        "first_seen": position.first_seen.isoformat(),
+                        "last_seen": position.last_seen.isoformat(),
+                        "held": position.held,
+                    }
+                    for wkn, position in sorted(positions.items())
+                },
+            },
+            indent=2,
+            ensure_ascii=False,
+        )
+
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="UTF-8") as cache_file:
+            cache_file.write(cache_data)
+        os.replace(tmp_path, self.cache_path)
+
+    def get_positions(
+        self, depot_handler: DepotHandler
+    ) -> typing.Dict[str, CachedDepotPosition]:
+        """Current and former depot positions per WKN,
+        refreshed via the depot handler if the cache has expired"""
+        updated_at, positions = self.load()
+        now = datetime.datetime.now()
+        if updated_at is not None and now - updated_at < datetime.timedelta(
+            seconds=self.ttl
+        ):
+            return positions
+
+        try:
+            depot_positions = depot_handler.get_all_depot_positions()
+        except (ApiException, requests.RequestException) as exception:
+            logging.warning(
+                f"Retrieving the depot positions failed ({exception}), "
+                + f"using the {len(positions)} cached positions"
+            )
+            return positions
+
+        today = now.date()
+        held_wkns = {position.wkn for position in depot_positions}
+        positions = {
+            wkn: position._replace(held=wkn in held_wkns)
+            for wkn, position in positions.items()
+        }
+        for depot_position in depot_positions:
+            cached = positions.get(depot_position.wkn)
+            positions[depot_position.wkn] = CachedDepotPosition(
+                wkn=depot_position.wkn,
+                isin=depot_position.isin or (None if cached is None else cached.isin),
+                name=depot_position.name or (None if cached is None else cached.name),
+                first_seen=today if cached is None else cached.first_seen,
+                last_seen=today,
+                held=True,
+            )
+
+        self.save(now, positions)
+        logging.info(
+            f"Retrieved {len(held_wkns)} depot positions, "
+            + f"{len(positions) - len(held_wkns)} former positions are kept"
+        )
+        return positions
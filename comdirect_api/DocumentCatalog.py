@@ -0,0 +1,265 @@
+from pydantic import BaseModel, PrivateAttr
+import csv
+import datetime
+import sqlite3
+import threading
+import typing
+
+from src.data.CompactDocument import AnyDocument
+from src.data.DocumentClassifier import DocumentClassifier
+from src.data.config_types import Settings
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, only required for the Parquet export
+    pyarrow = None
+
+# export formats by file extension
+EXPORT_FORMATS = [".csv", ".parquet"]
+
+
+class CatalogEntry(typing.NamedTuple):
+    """Metadata of a document in the postbox as recorded in the catalog"""
+
+    document_id: str
+    name: str
+    date_creation: datetime.date
+    mime_type: str
+    deleteable: bool
+    advertisement: bool
+    category_id: int
+    archived: bool
+    already_read: bool
+    predocument_exists: bool
+    date_read: typing.Optional[datetime.date]
+    wkn: str
+    file_class: str
+    ignored: bool
+    # when the document was listed first / last
+    first_seen: datetime.datetime
+    last_seen: datetime.datetime
+
+
+class DocumentCatalog(BaseModel):
+    """Persistent catalog (SQLite) of the metadata of all listed postbox documents,
+    incl. their classification. Indexed by WKN, file class, creation date
+    and category, i.e. queries and exports don't require the API."""
+
+    catalog_path: str
+
+    _connection: sqlite3.Connection = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    def __init__(self, **data: typing.Any) -> None:
+        super().__init__(**data)
+        # the catalog is updated while the downloads are running
+        self._connection = sqlite3.connect(self.catalog_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                document_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                date_creation TEXT NOT NULL,
+                mime_type TEXT NOT NULL,
+                deleteable INTEGER NOT NULL,
+                advertisement INTEGER NOT NULL,
+                category_id INTEGER NOT NULL,
+                archived INTEGER NOT NULL,
+                already_read INTEGER NOT NULL,
+                predocument_exists INTEGER NOT NULL,
+                date_read TEXT,
+                wkn TEXT NOT NULL,
+                file_class TEXT NOT NULL,
+                ignored INTEGER NOT NULL,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            )"""
+        )
+        for column in ["file_class", "date_creation", "category_id"]:
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS documents_{column} ON documents ({column})"
+            )
+        # e.g. all documents of a WKN and file class within a period,
+        # also used for queries by WKN only
+        self._connection.execute(
+            """CREATE INDEX IF NOT EXISTS documents_wkn_file_class_date
+            ON documents (wkn, file_class, date_creation)"""
+        )
+        self._connection.commit()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> typing.Optional["DocumentCatalog"]:
+        """Open the catalog configured in the settings.
+        Returns None if no catalog is configured."""
+        if settings.catalog_path is None:
+            return None
+
+        return DocumentCatalog(catalog_path=settings.catalog_path)
+
+    def add_documents(
+        self,
+        documents: typing.Iterable[AnyDocument],
+        document_classifier: DocumentClassifier,
+    ) -> None:
+        """Insert or update the listed documents (e.g. a page of the postbox)
+        in a single transaction, the read and archived flags are updated."""
+        now = datetime.datetime.now().isoformat()
+        rows = []
+        for document in documents:
+            classification = document_classifier.classify(document.name)
+            metadata = document.document_metadata
+            rows.append(
+                (
+                    document.document_id,
+                    document.name,
+                    document.date_creation.isoformat(),
+                    document.mime_type,
+                    document.deleteable,
+                    document.advertisement,
+                    document.category_id,
+                    metadata.archived,
+                    metadata.already_read,
+                    metadata.predocument_exists,
+                    None
+                    if metadata.date_read is None
+                    else metadata.date_read.isoformat(),
+                    classification.wkn,
+                    classification.file_class,
+                    classification.ignored,
+                    now,
+                    now,
+                )
+            )
+
+        with self._lock:
+            self._connection.executemany(
+                """INSERT INTO documents VALUES
+                (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (document_id) DO UPDATE SET
+                    name = excluded.name,
+                    deleteable = excluded.deleteable,
+                    category_id = excluded.category_id,
+                    archived = excluded.archived,
+                    already_read = excluded.already_read,
+                    predocument_exists = excluded.predocument_exists,
+                    date_read = excluded.date_read,
+                    wkn = excluded.wkn,
+                    file_class = excluded.file_class,
+                    ignored = excluded.ignored,
+                    last_seen = excluded.last_seen""",
+                rows,
+            )
+            self._connection.commit()
+
+    def query(
+        self,
+        wkn: typing.Optional[str] = None,
+        file_class: typing.Optional[str] = None,
+        date_from: typing.Optional[datetime.date] = None,
+        date_to: typing.Optional[datetime.date] = None,
+        category_id: typing.Optional[int] = None,
+        name_contains: typing.Optional[str] = None,
+        include_ignored: bool = True,
+    ) -> typing.List[CatalogEntry]:
+        """Documents matching all given filters, sorted by creation date.
+        E.g. the dividend notices of a WKN in 2023:
+        query(wkn="A0RPWH", file_class="Ertragsgutschrift",
+              date_from=date(2023, 1, 1), date_to=date(2023, 12, 31))
+
+        Args:
+            wkn (str, optional): classified WKN
+            file_class (str, optional): classified file class
+            date_from (date, optional): earliest creation date (inclusive)
+            date_to (date, optional): latest creation date (inclusive)
+            category_id (int, optional): category of the comdirect API
+            name_contains (str, optional): substring of the document name
+            include_ignored (bool, optional): include documents of ignored
+                file classes and advertisements. Defaults to True.
+
+        Returns:
+            List[CatalogEntry]: matching documents
+        """
+        conditions: typing.List[str] = []
+        parameters: typing.List[typing.Any] = []
+        for condition, value in [
+            ("wkn = ?", wkn),
+            ("file_class = ?", file_class),
+            (
+                "date_creation >= ?",
+                None if date_from is None else date_from.isoformat(),
+            ),
+            ("date_creation <= ?", None if date_to is None else date_to.isoformat()),
+            ("category_id = ?", category_id),
+            ("instr(name, ?) > 0", name_contains),
+        ]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        if not include_ignored:
+            conditions.append("NOT ignored AND NOT advertisement")
+
+        where = "" if len(conditions) == 0 else f"WHERE {' AND '.join(conditions)}"
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT * FROM documents {where} ORDER BY date_creation, document_id",
+                parameters,
+            ).fetchall()
+
+        return [
+            CatalogEntry(
+                document_id=row[0],
+                name=row[1],
+                date_creation=datetime.date.fromisoformat(row[2]),
+                mime_type=row[3],
+                deleteable=bool(row[4]),
+                advertisement=bool(row[5]),
+                category_id=row[6],
+                archived=bool(row[7]),
+                already_read=bool(row[8]),
+                predocument_exists=bool(row[9]),
+                date_read=None
+                if row[10] is None
+                else datetime.date.fromisoformat(row[10]),
+                wkn=row[11],
+                file_class=row[12],
+                ignored=bool(row[13]),
+                first_seen=datetime.datetime.fromisoformat(row[14]),
+                last_seen=datetime.datetime.fromisoformat(row[15]),
+            )
+            for row in rows
+        ]
+
+    def export(self, export_path: str, **filters: typing.Any) -> int:
+        """Export the documents matching the filters (see query()),
+        the format is chosen by the file extension (see EXPORT_FORMATS).
+        Parquet requires pyarrow.
+
+        Returns:
+            int: number of exported documents
+        """
+        entries = self.query(**filters)
+        if export_path.endswith(".csv"):
+            with open(export_path, "w", encoding="UTF-8", newline="") as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(CatalogEntry._fields)
+                writer.writerows(entries)
+        elif export_path.endswith(".parquet"):
+            if pyarrow is None:
+                raise RuntimeError("The Parquet export requires pyarrow")
+            table = pyarrow.Table.from_pylist([entry._asdict() for entry in entries])
+            pyarrow.parquet.write_table(table, export_path)
+        else:
+            raise ValueError(
+                f"Unknown export format, supported: {', '.join(EXPORT_FORMATS)}"
+            )
+
+        return len(entries)
+
+    def close(self) -> None:
+        """Close the connection to the catalog database"""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,86 @@
+from pydantic import BaseModel, PrivateAttr
+import logging
+import os
+import threading
+import time
+import typing
+
+
+def normalize_path(path: str) -> str:
+    """Key of a path in the index"""
+    return os.path.normcase(os.path.normpath(path))
+
+
+class FileIndex(BaseModel):
+    """In-memory index of the files and directories below root_dir.
+    The directory tree is scanned once (one scandir per directory) on first use,
+    afterwards existence checks don't touch the file system. Files written
+    and directories created during the sync have to be recorded via add()
+    and ensure_dir(). Changes by other processes aren't noticed,
+    i.e. use a new index after such changes. Thread-safe."""
+
+    root_dir: str
+
+    _files: typing.Set[str] = PrivateAttr(default_factory=set)
+    _dirs: typing.Set[str] = PrivateAttr(default_factory=set)
+    _scanned: bool = PrivateAttr(default=False)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    def scan(self) -> None:
+        """Index the directory tree, only the first call scans"""
+        with self._lock:
+            if self._scanned:
+                return
+
+            start = time.perf_counter()
+            pending_dirs = [self.root_dir]
+            while len(pending_dirs) > 0:
+                dir_path = pending_dirs.pop()
+                try:
+                    entries = list(os.scandir(dir_path))
+                except FileNotFoundError:
+                    continue
+                self._dirs.add(normalize_path(dir_path))
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                    else:
+                        self._files.add(normalize_path(entry.path))
+
+            self._scanned = True
+            logging.debug(
+                f"Indexed {len(self._files)} files in {len(self._dirs)} directories "
+                + f"in {(time.perf_counter() - start) * 1000:.1f} ms"
+            )
+
+    def contains(self, path: str) -> bool:
+        """Check if the file exists (or has been added)"""
+        self.scan()
+        return normalize_path(path) in self._files
+
+    def add(self, path: str) -> None:
+        """Record a written file"""
+        self.scan()
+        with self._lock:
+            self._files.add(normalize_path(path))
+            self._dirs.add(normalize_path(os.path.dirname(path)))
+
+    def remove(self, path: str) -> None:
+        """Record a moved or deleted file"""
+        self.scan()
+        with self._lock:
+            self._files.discard(normalize_path(path))
+
+    def ensure_dir(self, dir_path: str) -> None:
+        """Create the directory (incl. its parents) unless it is known to exist"""
+        self.scan()
+        key = normalize_path(dir_path)
+        if key in self._dirs:
+            return
+
+        os.makedirs(dir_path, exist_ok=True)
+        with self._lock:
+            self._dirs.add(key)
@@ -0,0 +1,311 @@
+from pydantic import BaseModel, Field, PrivateAttr
+import bisect
+import functools
+import json
+import math
+import os
+import re
+import threading
+import time
+import typing
+import requests
+
+from src import http_utils
+
+
+class RequestRecord(typing.NamedTuple):
+    """Measurements of a single HTTP request"""
+
+    endpoint: str
+    method: str
+    status: int
+    # time until the response was received completely in seconds,
+    # incl. the transfer of streamed bodies
+    duration: float
+    # bytes of the body actually read
+    bytes_received: int
+    retries: int
+    # requestId of the x-http-request-info header, if any
+    request_id: typing.Optional[str]
+
+
+# path segments which are identifiers (document ids, session identifiers, ...)
+ID_SEGMENT_REGEX = re.compile(r"^(?=.*\d)[0-9A-Za-z-]{8,}$")
+REQUEST_ID_REGEX = re.compile(r"""requestId['"]\s*:\s*['"]([^'"]+)['"]""")
+
+
+def get_endpoint(path_url: str) -> str:
+    """Endpoint of a request path, i.e. without query and with identifiers
+    replaced by a placeholder (e.g. /api/messages/v2/documents/{id})"""
+    path = path_url.split("?")[0]
+    return "/".join(
+        "{id}" if ID_SEGMENT_REGEX.match(segment) else segment
+        for segment in path.split("/")
+    )
+
+
+def format_labels(labels: typing.Dict[str, str]) -> str:
+    """Prometheus label set"""
+    escaped = {
+        key: value.replace("\\", "\\\\").replace('"', '\\"')
+        for key, value in labels.items()
+    }
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+
+class EndpointStats(BaseModel):
+    """Aggregated measurements of the requests of an endpoint"""
+
+    requests: int = 0
+    status_counts: typing.Dict[int, int] = Field(default_factory=dict)
+    bytes_received: int = 0
+    retries: int = 0
+    # number of requests per bucket of the histogram, the last one is +Inf
+    bucket_counts: typing.List[int]
+    duration_sum: float = 0.0
+    max_duration: float = 0.0
+    slowest_request_id: typing.Optional[str] = None
+
+    def add(self, request_record: RequestRecord, buckets: typing.List[float]) -> None:
+        """Add the measurements of a request"""
+        self.requests += 1
+        self.status_counts[request_record.status] = (
+            self.status_counts.get(request_record.status, 0) + 1
+        )
+        self.bytes_received += request_record.bytes_received
+        self.retries += request_record.retries
+        self.bucket_counts[bisect.bisect_left(buckets, request_record.duration)] += 1
+        self.duration_sum += request_record.duration
+        if request_record.duration >= self.max_duration:
+            self.max_duration = request_record.duration
+            self.slowest_request_id = request_record.request_id
+
+    def get_percentile(self, quantile: float, buckets: typing.List[float]) -> float:
+        """Percentile estimated from the histogram, i.e. the upper bound
+        of the bucket containing it (the maximum for the +Inf bucket)"""
+        rank = max(1, math.ceil(quantile * self.requests))
+        cumulative_count = 0
+        for bucket, count in zip(buckets, self.bucket_counts):
+            cumulative_count += count
+            if cumulative_count >= rank:
+                return min(bucket, self.max_duration)
+        return self.max_duration
+
+
+class HttpMetrics(BaseModel):
+    """Collects measurements of all requests sent via an instrumented HTTP session
+    and exports them as Prometheus text file or JSON. The measurements are
+    aggregated per endpoint (counters and a histogram of the durations)
+    when a response is complete, i.e. the memory doesn't grow with the requests.
+    Streamed responses are measured when they are closed."""
+
+    # upper bounds of the duration histogram buckets in seconds
+    duration_buckets: typing.List[float] = Field(
+        default=[0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    )
+
+    # measurements per (method, endpoint)
+    _endpoint_stats: typing.Dict[typing.Tuple[str, str], EndpointStats] = PrivateAttr(
+        default_factory=dict
+    )
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    def install(self, http_session: requests.Session) -> None:
+        """Record all responses of the given session (response hook)"""
+        if self.response_hook not in http_session.hooks["response"]:
+            http_session.hooks["response"].append(self.response_hook)
+
+    def response_hook(
+        self, response: requests.Response, *args: typing.Any, **kwargs: typing.Any
+    ) -> requests.Response:
+        """requests response hook, records the measurements of the response"""
+        request = response.request
+
+        # retries by the handlers and by urllib3 (if configured)
+        retries = http_utils.retry_attempt.get()
+        raw_retries = getattr(response.raw, "retries", None)
+        if raw_retries is not None:
+            retries += len(raw_retries.history)
+
+        request_id_match = REQUEST_ID_REGEX.search(
+            request.headers.get("x-http-request-info", "")
+        )
+        create_record = functools.partial(
+            RequestRecord,
+            endpoint=get_endpoint(request.path_url),
+            method=request.method,
+            status=response.status_code,
+            retries=retries,
+            request_id=None if request_id_match is None else request_id_match.group(1),
+        )
+        if not kwargs.get("stream"):
+            self.record(
+                create_record(
+                    duration=response.elapsed.total_seconds(),
+                    bytes_received=len(response.content),
+                )
+            )
+            return response
+
+        # streamed bodies are measured while they are consumed, until closed
+        sent = time.perf_counter() - response.elapsed.total_seconds()
+        bytes_received = 0
+        recorded = False
+        iter_content = response.iter_content
+        close = response.close
+
+        def counting_iter_content(
+            *args: typing.Any, **kwargs: typing.Any
+        ) -> typing.Iterator[bytes]:
+            nonlocal bytes_received
+            for chunk in iter_content(*args, **kwargs):
+                bytes_received += len(chunk)
+                yield chunk
+
+        def recording_close() -> None:
+            nonlocal recorded
+            close()
+            if not recorded:
+                recorded = True
+                self.record(
+                    create_record(
+                        duration=time.perf_counter() - sent,
+                        bytes_received=bytes_received,
+                    )
+                )
+
+        response.iter_content = counting_iter_content  # type: ignore
+        response.close = recording_close  # type: ignore
+        return response
+
+    def record(self, request_record: RequestRecord) -> None:
+        """Add the measurements of a request"""
+        key = (request_record.method, request_record.endpoint)
+        with self._lock:
+            endpoint_stats = self._endpoint_stats.get(key)
+            if endpoint_stats is None:
+                endpoint_stats = EndpointStats(
+                    bucket_counts=[0] * (len(self.duration_buckets) + 1)
+                )
+                self._endpoint_stats[key] = endpoint_stats
+            endpoint_stats.add(request_record, self.duration_buckets)
+
+    def get_endpoint_stats(
+        self,
+    ) -> typing.Dict[typing.Tuple[str, str], EndpointStats]:
+        """Copy of the measurements per (method, endpoint), sorted"""
+        with self._lock:
+            return {
+                key: endpoint_stats.copy(deep=True)
+                for key, endpoint_stats in sorted(self._endpoint_stats.items())
+            }
+
+    def to_json(self) -> typing.Dict[str, typing.Any]:
+        """Summary per endpoint incl. duration percentiles (estimated)"""
+        endpoints = []
+        for (method, endpoint), stats in self.get_endpoint_stats().items():
+            endpoints.append(
+                {
+                    "method": method,
+                    "endpoint": endpoint,
+                    "requests": stats.requests,
+                    "status": {
+                        str(status): count
+                        for status, count in sorted(stats.status_counts.items())
+                    },
+                    "bytes_received": stats.bytes_received,
+                    "retries": stats.retries,
+                    "duration_seconds": {
+                        "mean": stats.duration_sum / stats.requests,
+                        "p50": stats.get_percentile(0.5, self.duration_buckets),
+                        "p95": stats.get_percentile(0.95, self.duration_buckets),
+                        "p99": stats.get_percentile(0.99, self.duration_buckets),
+                        "max": stats.max_duration,
+                    },
+                    "slowest_request_id": stats.slowest_request_id,
+                }
+            )
+        return {"endpoints": endpoints}
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        lines = [
+            "# HELP comdirect_http_requests_total Number of HTTP requests.",
+            "# TYPE comdirect_http_requests_total counter",
+        ]
+        endpoint_stats = self.get_endpoint_stats()
+        for (method, endpoint), stats in endpoint_stats.items():
+            for status, count in sorted(stats.status_counts.items()):
+                labels = {"method": method, "endpoint": endpoint, "status": str(status)}
+                lines.append(
+                    f"comdirect_http_requests_total{format_labels(labels)} {count}"
+                )
+
+        lines += [
+            "# HELP comdirect_http_response_bytes_total Received bytes.",
+            "# TYPE comdirect_http_response_bytes_total counter",
+        ]
+        for (method, endpoint), stats in endpoint_stats.items():
+            labels = {"method": method, "endpoint": endpoint}
+            lines.append(
+                f"comdirect_http_response_bytes_total{format_labels(labels)} "
+                + str(stats.bytes_received)
+            )
+
+        lines += [
+            "# HELP comdirect_http_retries_total Retries of HTTP requests.",
+            "# TYPE comdirect_http_retries_total counter",
+        ]
+        for (method, endpoint), stats in endpoint_stats.items():
+            labels = {"method": method, "endpoint": endpoint}
+            lines.append(
+                f"comdirect_http_retries_total{format_labels(labels)} "
+                + str(stats.retries)
+            )
+
+        lines += [
+            "# HELP comdirect_http_request_duration_seconds Time until the response was received completely.",
+            "# TYPE comdirect_http_request_duration_seconds histogram",
+        ]
+        for (method, endpoint), stats in endpoint_stats.items():
+            labels = {"method": method, "endpoint": endpoint}
+            cumulative_count = 0
+            for bucket, count in zip(
+                [*self.duration_buckets, math.inf], stats.bucket_counts
+            ):
+                cumulative_count += count
+                bucket_labels = {
+                    **labels,
+                    "le": "+Inf" if bucket == math.inf else str(bucket),
+                }
+                lines.append(
+                    "comdirect_http_request_duration_seconds_bucket"
+                    + f"{format_labels(bucket_labels)} {cumulative_count}"
+                )
+            lines.append(
+                f"comdirect_http_request_duration_seconds_sum{format_labels(labels)} "
+                + str(stats.duration_sum)
+            )
+            lines.append(
+                f"comdirect_http_request_duration_seconds_count{format_labels(labels)} "
+                + str(stats.requests)
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, metrics_path: str) -> None:
+        """Export the metrics atomically (a scraper never reads a partial file),
+        as JSON if the path ends with .json, otherwise as Prometheus text file"""
+        if metrics_path.endswith(".json"):
+            content = json.dumps(self.to_json(), indent=2)
+        else:
+            content = self.to_prometheus()
+
+        # in the same directory, e.g. not matched by the textfile collector (*.prom)
+        tmp_path = f"{metrics_path}.tmp"
+        with open(tmp_path, "w", encoding="UTF-8") as metrics_file:
+            metrics_file.write(content)
+        os.replace(tmp_path, metrics_path)
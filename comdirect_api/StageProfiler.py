@@ -0,0 +1,262 @@
+from pydantic import BaseModel, Field, PrivateAttr
+import cProfile
+import contextlib
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+if typing.TYPE_CHECKING:
+    # only for the annotations, the config types import the file utils recording stages
+    from src.data import config_types
+
+# stages of a sync in the order of the report
+STAGES = [
+    "auth",
+    "listing",
+    "parsing",
+    "classification",
+    "path",
+    "download",
+    "write",
+]
+
+# before Python 3.12 cProfile only profiles the thread which enabled it,
+# since then it profiles all threads (sys.monitoring) and only one may be active
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+# profiler recording the stages, set while a profiler is running
+active_profiler: typing.Optional["StageProfiler"] = None
+active_profiler_lock = threading.Lock()
+
+
+class StageStats(typing.NamedTuple):
+    """Measurements of a stage, excl. the stages nested in it"""
+
+    stage: str
+    calls: int
+    wall_seconds: float
+    # CPU time of the threads running the stage
+    cpu_seconds: float
+    # net growth of the traced memory, approximate if stages run concurrently
+    allocated_bytes: int
+
+
+class ThreadState(threading.local):
+    """Stages and cProfile profile of the current thread"""
+
+    def __init__(self) -> None:
+        # measurements of the nested stages per running stage: wall, CPU, memory
+        self.stack: typing.List[typing.List[float]] = []
+        self.profile: typing.Optional[cProfile.Profile] = None
+        self.profiling = False
+
+
+def profile_stage(stage: str) -> typing.ContextManager[None]:
+    """Record the enclosed code as stage of the running profiler, if any.
+    A no-op if no profiler is running."""
+    profiler = active_profiler
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(stage)
+
+
+class StageProfiler(BaseModel):
+    """Records wall time, CPU time and allocations of the stages of a sync
+    (see STAGES). The stages are marked via profile_stage() in the handlers,
+    i.e. they are recorded in every thread while the profiler is running.
+    Writes a cProfile dump (profile_path, e.g. for python -m pstats or snakeviz)
+    and a report of the stages and the top allocations (tracemalloc)
+    next to it (.txt). Only one profiler runs at a time."""
+
+    profile_path: str
+    # number of source lines in the allocation report
+    top_allocations: int = Field(default=20, ge=1)
+    # frames stored by tracemalloc per allocation
+    traceback_frames: int = Field(default=1, ge=1)
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _thread_state: ThreadState = PrivateAttr(default_factory=ThreadState)
+    # calls, wall time, CPU time and memory growth per stage
+    _totals: typing.Dict[str, typing.List[float]] = PrivateAttr(default_factory=dict)
+    _profiles: typing.List[cProfile.Profile] = PrivateAttr(default_factory=list)
+    _elapsed: float = PrivateAttr(default=0.0)
+    _peak_memory: int = PrivateAttr(default=0)
+    _snapshot: typing.Optional[tracemalloc.Snapshot] = PrivateAttr(default=None)
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    @classmethod
+    def from_settings(
+        cls, settings: "config_types.Settings"
+    ) -> typing.Optional["StageProfiler"]:
+        """Create the profiler configured in the settings.
+        Returns None if profiling isn't configured."""
+        if settings.profile_path is None:
+            return None
+
+        return StageProfiler(profile_path=settings.profile_path)
+
+    def get_report_path(self) -> str:
+        """Path of the text report, next to the cProfile dump"""
+        return f"{os.path.splitext(self.profile_path)[0]}.txt"
+
+    @contextlib.contextmanager
+    def profile(self) -> typing.Iterator[None]:
+        """Profile the enclosed code, the results are written when the context is left.
+        Doesn't profile if another profiler is running already."""
+        global active_profiler
+        with active_profiler_lock:
+            running = active_profiler is not None
+            if not running:
+                active_profiler = self
+        if running:
+            logging.warning("Another profiler is running, not profiling")
+            yield
+            return
+
+        # e.g. started via python -X tracemalloc
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self.traceback_frames)
+        thread_state = self._thread_state
+        profile = self.get_thread_profile()
+        thread_state.profiling = True
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            thread_state.profiling = False
+            self._elapsed = time.perf_counter() - start
+            self._peak_memory = tracemalloc.get_traced_memory()[1]
+            self._snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            with active_profiler_lock:
+                active_profiler = None
+            self.write()
+
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> typing.Iterator[None]:
+        """Record the enclosed code as stage, excl. the stages nested in it.
+        The enclosed code is profiled by cProfile in any thread."""
+        thread_state = self._thread_state
+        profile = None
+        if PER_THREAD_PROFILES and not thread_state.profiling:
+            # e.g. a worker of the downloads
+            profile = self.get_thread_profile()
+            thread_state.profiling = True
+            profile.enable()
+
+        nested = [0.0, 0.0, 0.0]
+        thread_state.stack.append(nested)
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+            memory = tracemalloc.get_traced_memory()[0] - start_memory
+            thread_state.stack.pop()
+            if len(thread_state.stack) > 0:
+                parent = thread_state.stack[-1]
+                parent[0] += wall
+                parent[1] += cpu
+                parent[2] += memory
+
+            with self._lock:
+                totals = self._totals.setdefault(stage, [0, 0.0, 0.0, 0])
+                totals[0] += 1
+                totals[1] += wall - nested[0]
+                totals[2] += cpu - nested[1]
+                totals[3] += memory - nested[2]
+
+            if profile is not None:
+                profile.disable()
+                thread_state.profiling = False
+
+    def get_thread_profile(self) -> cProfile.Profile:
+        """cProfile profile of the current thread, created on first use"""
+        thread_state = self._thread_state
+        if thread_state.profile is None:
+            thread_state.profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(thread_state.profile)
+        return thread_state.profile
+
+    def get_stage_stats(self) -> typing.List[StageStats]:
+        """Measurements of the recorded stages, in the order of STAGES"""
+        with self._lock:
+            totals = dict(self._totals)
+        stages = [stage for stage in STAGES if stage in totals] + sorted(
+            stage for stage in totals if stage not in STAGES
+        )
+        return [
+            StageStats(
+                stage=stage,
+                calls=int(totals[stage][0]),
+                wall_seconds=totals[stage][1],
+                cpu_seconds=totals[stage][2],
+                allocated_bytes=int(totals[stage][3]),
+            )
+            for stage in stages
+        ]
+
+    def get_top_allocations(self) -> typing.List[tracemalloc.Statistic]:
+        """Source lines holding the most memory at the end of the profiling"""
+        if self._snapshot is None:
+            return []
+
+        snapshot = self._snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ]
+        )
+        return snapshot.statistics("lineno")[: self.top_allocations]
+
+    def report(self) -> str:
+        """Stages and top allocations as text. The stages of concurrent workers
+        overlap, i.e. their wall times may add up to more than the elapsed time."""
+        lines = [
+            f"Elapsed {self._elapsed:.3f} s, "
+            + f"peak traced memory {self._peak_memory / 1024 / 1024:.1f} MiB",
+            "",
+            f"{'stage':<16}{'calls':>8}{'wall s':>12}{'cpu s':>12}{'alloc MiB':>12}",
+        ]
+        for stage_stats in self.get_stage_stats():
+            lines.append(
+                f"{stage_stats.stage:<16}{stage_stats.calls:>8}"
+                + f"{stage_stats.wall_seconds:>12.3f}{stage_stats.cpu_seconds:>12.3f}"
+                + f"{stage_stats.allocated_bytes / 1024 / 1024:>12.2f}"
+            )
+
+        lines += ["", f"Top {self.top_allocations} allocations:"]
+        for statistic in self.get_top_allocations():
+            lines.append(str(statistic))
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        """Write the cProfile dump and the text report"""
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(self.profile_path)
+
+        report = self.report()
+        with open(self.get_report_path(), "w", encoding="UTF-8") as report_file:
+            report_file.write(report)
+        logging.info(f"Profile of the stages:\n{report}")
+        logging.info(
+            f"Saved the profile to {self.profile_path} and {self.get_report_path()}"
+        )
@@ -0,0 +1,383 @@
+from pydantic import BaseModel, Field, PrivateAttr
+from abc import ABC, abstractmethod
+import datetime
+import hashlib
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import typing
+
+from src import file_utils
+from src.ContentStore import ContentStore
+from src.FileIndex import FileIndex
+from src.StageProfiler import profile_stage
+from src.data.config_types import StorageConfig
+
+# size of the blocks copied from the spool into an archive or database
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def spool_stream(
+    chunks: typing.Iterable[bytes], spool_size: int
+) -> typing.Tuple[typing.BinaryIO, int, str]:
+    """Buffer a stream of chunks, in memory up to spool_size bytes,
+    in a temporary file beyond. The size of a document is required
+    before it can be appended to an archive or database.
+    Returns:
+        Tuple[BinaryIO, int, str]: rewound buffer (to be closed by the caller),
+                                   size, sha256 hex digest of the content
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    size = 0
+    sha256 = hashlib.sha256()
+    try:
+        for chunk in chunks:
+            with profile_stage("write"):
+                spool.write(chunk)
+                sha256.update(chunk)
+            size += len(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+
+    return typing.cast(typing.BinaryIO, spool), size, sha256.hexdigest()
+
+
+class StorageBackend(BaseModel, ABC):
+    """Storage of the downloaded documents. The documents are addressed by their
+    paths below root_dir (the output directory), i.e. archives and databases
+    store them by their relative path. The stored paths are indexed once
+    (on first use), existence checks are lookups in memory.
+    Changes by other processes aren't noticed until invalidate(). Thread-safe."""
+
+    root_dir: str
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    @classmethod
+    def from_config(
+        cls,
+        storage_config: StorageConfig,
+        root_dir: str,
+        content_store: typing.Optional[ContentStore] = None,
+    ) -> "StorageBackend":
+        """Create the configured storage backend for the output directory.
+        The content store is only supported by the directory storage."""
+        if storage_config.backend == "directory":
+            return DirectoryStorage(root_dir=root_dir, content_store=content_store)
+
+        if content_store is not None:
+            raise ValueError("The content store requires the directory storage backend")
+        if storage_config.backend == "tar":
+            return TarStorage(
+                root_dir=root_dir,
+                archive_path=storage_config.path
+                or os.path.join(root_dir, "documents.tar"),
+                spool_size=storage_config.spool_size,
+            )
+        return SqliteStorage(
+            root_dir=root_dir,
+            database_path=storage_config.path
+            or os.path.join(root_dir, "documents.sqlite"),
+            spool_size=storage_config.spool_size,
+        )
+
+    def get_name(self, path: str) -> str:
+        """Name of a path in an archive or database, relative to root_dir"""
+        return os.path.relpath(path, self.root_dir).replace(os.sep, "/")
+
+    def open(self) -> None:
+        """Index the stored documents, called on first use"""
+
+    def close(self) -> None:
+        """Flush the written documents, e.g. complete the archive"""
+
+    def invalidate(self) -> None:
+        """Drop the index, e.g. after changes by other processes,
+        the stored documents are indexed again on the next use"""
+        self.close()
+
+    @abstractmethod
+    def contains(self, path: str) -> bool:
+        """Check if a document is stored at the path"""
+
+    @abstractmethod
+    def get_size(self, path: str) -> int:
+        """Size of the stored document in bytes"""
+
+    @abstractmethod
+    def save_stream(
+        self, chunks: typing.Iterable[bytes], path: str
+    ) -> typing.Tuple[int, str]:
+        """Store a stream of chunks at the path, replacing an existing document.
+        Returns:
+            Tuple[int, str]: size of the document, sha256 hex digest of the content
+        """
+
+    @abstractmethod
+    def move(self, source_path: str, target_path: str) -> None:
+        """Move a stored document to another path.
+        Raises:
+            ValueError: Raised if the backend doesn't support moving documents
+        """
+
+
+class DirectoryStorage(StorageBackend):
+    """One file per document in a directory tree (e.g. WKN/file class/),
+    indexed by a FileIndex. Optionally stores identical documents once
+    (ContentStore)."""
+
+    content_store: typing.Optional[ContentStore] = None
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _file_index: typing.Optional[FileIndex] = PrivateAttr(default=None)
+
+    def get_file_index(self) -> FileIndex:
+        """Index of the directory tree, scanned on first use"""
+        with self._lock:
+            if self._file_index is None:
+                self._file_index = FileIndex(root_dir=self.root_dir)
+            file_index = self._file_index
+        file_index.scan()
+        return file_index
+
+    def open(self) -> None:
+        self.get_file_index()
+
+    def invalidate(self) -> None:
+        # the files are written directly, i.e. close() keeps the index
+        with self._lock:
+            self._file_index = None
+
+    def contains(self, path: str) -> bool:
+        return self.get_file_index().contains(path)
+
+    def get_size(self, path: str) -> int:
+        return os.path.getsize(path)
+
+    def save_stream(
+        self, chunks: typing.Iterable[bytes], path: str
+    ) -> typing.Tuple[int, str]:
+        file_index = self.get_file_index()
+        file_index.ensure_dir(os.path.dirname(path))
+        if self.content_store is not None:
+            result = self.content_store.save_stream(
+                chunks=chunks, pdf_path=path, create_dir=False
+            )
+        else:
+            result = file_utils.save_stream(
+                chunks=chunks, pdf_path=path, create_dir=False
+            )
+        file_index.add(path)
+        return result
+
+    def move(self, source_path: str, target_path: str) -> None:
+        file_index = self.get_file_index()
+        file_index.ensure_dir(os.path.dirname(target_path))
+        os.replace(source_path, target_path)
+        file_index.remove(source_path)
+        file_index.add(target_path)
+
+
+def scan_tar(archive_path: str) -> typing.Tuple[typing.Dict[str, int], int]:
+    """Sizes of the files in a tar archive and the end of the last complete member.
+    A member truncated by an interrupted write is ignored.
+    Returns:
+        Tuple[Dict[str, int], int]: size per name (the last member of a name wins),
+                                    offset the next member is written to
+    """
+    if not os.path.exists(archive_path):
+        return {}, 0
+
+    archive_size = os.path.getsize(archive_path)
+    sizes: typing.Dict[str, int] = {}
+    end = 0
+    try:
+        with tarfile.open(archive_path, "r:") as tar:
+            for member in tar:
+                member_end = member.offset_data + (
+                    -(-member.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                )
+                if member_end > archive_size:
+                    break
+                if member.isfile():
+                    sizes[member.name] = member.size
+                end = member_end
+    except tarfile.ReadError:
+        # empty or truncated within the first header, anything else isn't an archive
+        if archive_size >= tarfile.BLOCKSIZE:
+            raise
+    return sizes, end
+
+
+class TarStorage(StorageBackend):
+    """Append-only (uncompressed) tar archive, i.e. a single file instead of
+    one file per document. The members are appended to the end of the archive,
+    a member interrupted by a crash is overwritten by the next run.
+    The documents are buffered (see spool_stream), so concurrent downloads
+    don't block each other, only the appends are serialized.
+    Moving documents isn't supported (a ValueError is raised), i.e. the
+    content classification and the content store are rejected for archives."""
+
+    archive_path: str
+    spool_size: int = Field(default=8 * 1024 * 1024, ge=0)
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _sizes: typing.Dict[str, int] = PrivateAttr(default_factory=dict)
+    _file: typing.Optional[typing.BinaryIO] = PrivateAttr(default=None)
+    _tar: typing.Optional[tarfile.TarFile] = PrivateAttr(default=None)
+
+    def open(self) -> None:
+        with self._lock:
+            if self._tar is not None:
+                return
+
+            self._sizes, end = scan_tar(self.archive_path)
+            archive_file = open(
+                self.archive_path, "r+b" if os.path.exists(self.archive_path) else "w+b"
+            )
+            # drop the end of archive marker and interrupted members
+            archive_file.seek(end)
+            archive_file.truncate()
+            self._file = archive_file
+            self._tar = tarfile.open(
+                fileobj=archive_file, mode="w", format=tarfile.PAX_FORMAT
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._tar is None:
+                return
+
+            # writes the end of archive marker, the file is left open
+            self._tar.close()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._tar = None
+            self._file = None
+            self._sizes = {}
+
+    def contains(self, path: str) -> bool:
+        self.open()
+        return self.get_name(path) in self._sizes
+
+    def get_size(self, path: str) -> int:
+        self.open()
+        return self._sizes[self.get_name(path)]
+
+    def save_stream(
+        self, chunks: typing.Iterable[bytes], path: str
+    ) -> typing.Tuple[int, str]:
+        self.open()
+        spool, size, sha256 = spool_stream(chunks, self.spool_size)
+        with spool:
+            tarinfo = tarfile.TarInfo(self.get_name(path))
+            tarinfo.size = size
+            tarinfo.mtime = int(time.time())
+            tarinfo.mode = 0o644
+            with profile_stage("write"), self._lock:
+                self._tar.addfile(tarinfo, spool)
+                self._file.flush()
+                self._sizes[tarinfo.name] = size
+        return size, sha256
+
+    def move(self, source_path: str, target_path: str) -> None:
+        raise ValueError("Documents can't be moved within the append-only tar archive")
+
+
+class SqliteStorage(StorageBackend):
+    """SQLite database with one row (incl. the content as blob) per document,
+    i.e. a single file instead of one file per document.
+    The documents are buffered (see spool_stream) and written into the blob
+    incrementally, only the inserts are serialized."""
+
+    database_path: str
+    spool_size: int = Field(default=8 * 1024 * 1024, ge=0)
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _sizes: typing.Dict[str, int] = PrivateAttr(default_factory=dict)
+    _connection: typing.Optional[sqlite3.Connection] = PrivateAttr(default=None)
+
+    def open(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                return
+
+            # the documents are saved by the download workers
+            connection = sqlite3.connect(self.database_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    saved_at TEXT NOT NULL
+                )"""
+            )
+            connection.commit()
+            self._sizes = dict(connection.execute("SELECT name, size FROM files"))
+            self._connection = connection
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is None:
+                return
+
+            self._connection.close()
+            self._connection = None
+            self._sizes = {}
+
+    def contains(self, path: str) -> bool:
+        self.open()
+        return self.get_name(path) in self._sizes
+
+    def get_size(self, path: str) -> int:
+        self.open()
+        return self._sizes[self.get_name(path)]
+
+    def save_stream(
+        self, chunks: typing.Iterable[bytes], path: str
+    ) -> typing.Tuple[int, str]:
+        self.open()
+        name = self.get_name(path)
+        spool, size, sha256 = spool_stream(chunks, self.spool_size)
+        with spool, profile_stage("write"), self._lock:
+            if not hasattr(self._connection, "blobopen"):
+                # incremental blob I/O requires Python 3.11
+                content = sqlite3.Binary(spool.read())
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                    (name, size, sha256, content, datetime.datetime.now().isoformat()),
+                )
+            else:
+                cursor = self._connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, zeroblob(?), ?)",
+                    (name, size, sha256, size, datetime.datetime.now().isoformat()),
+                )
+                with self._connection.blobopen(
+                    "files", "content", cursor.lastrowid
+                ) as blob:
+                    shutil.copyfileobj(spool, blob, COPY_BUFFER_SIZE)
+            self._connection.commit()
+            self._sizes[name] = size
+        return size, sha256
+
+    def move(self, source_path: str, target_path: str) -> None:
+        self.open()
+        source_name = self.get_name(source_path)
+        target_name = self.get_name(target_path)
+        with self._lock:
+            self._connection.execute("DELETE FROM files WHERE name = ?", (target_name,))
+            self._connection.execute(
+                "UPDATE files SET name = ? WHERE name = ?", (target_name, source_name)
+            )
+            self._connection.commit()
+            self._sizes[target_name] = self._sizes.pop(source_name)
@@ -0,0 +1,282 @@
+from pydantic import BaseModel, Field, PrivateAttr, root_validator, validator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+import typing
+
+from src.ComdirectAPI import ComdirectAPI
+from src.data.config_types import Settings, apply_settings
+from src.handler.DocumentHandler import PostboxPage
+
+# backoff of failed session renewals in seconds, doubled per failure
+RENEW_BACKOFF_BASE = 30
+RENEW_BACKOFF_MAX = 60 * 60
+
+
+class SyncDaemon(BaseModel):
+    """Keeps the postbox synced in a long-running process.
+    The session is authenticated once and renewed via the refresh token before
+    it expires (also between the polls). Every poll only lists the newest
+    documents, new ones are downloaded right away; if all of them are new
+    (i.e. there might be more), the complete postbox is synced.
+    Optionally serves /health and /status (JSON) on a local HTTP port."""
+
+    # settings missing values are taken from, defaults to get_settings()
+    settings: typing.Optional[Settings] = Field(default=None)
+    comdirect_api: ComdirectAPI = Field(default=None)
+    poll_interval: float = Field(gt=0)
+    poll_jitter: float = Field(ge=0, lt=1)
+    poll_page_size: int = Field(ge=1)
+    health_host: str
+    health_port: typing.Optional[int] = Field(ge=0, le=65535)
+
+    _stop: threading.Event = PrivateAttr(default_factory=threading.Event)
+    _status_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _status: typing.Dict[str, typing.Any] = PrivateAttr(default_factory=dict)
+    # ids of the newest documents seen in the last poll
+    _seen_ids: typing.Set[str] = PrivateAttr(default_factory=set)
+    # consecutive failed session renewals
+    _renew_failures: int = PrivateAttr(default=0)
+    _health_server: typing.Optional[ThreadingHTTPServer] = PrivateAttr(default=None)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @root_validator(pre=True)
+    def defaults_from_settings(
+        cls, values: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        """Take missing values from the settings"""
+        return apply_settings(
+            values,
+            {
+                "poll_interval": lambda settings: settings.daemon_config.poll_interval,
+                "poll_jitter": lambda settings: settings.daemon_config.poll_jitter,
+                "poll_page_size": lambda settings: (
+                    settings.daemon_config.poll_page_size
+                ),
+                "health_host": lambda settings: settings.daemon_config.health_host,
+                "health_port": lambda settings: settings.daemon_config.health_port,
+            },
+        )
+
+    @validator("comdirect_api", pre=True, always=True)
+    def default_comdirect_api(
+        cls,
+        comdirect_api: typing.Optional[ComdirectAPI],
+        values: typing.Dict[str, typing.Any],
+    ) -> ComdirectAPI:
+        """Create a ComdirectAPI for the settings if none is given"""
+        if comdirect_api is None:
+            settings = values.get("settings")
+            comdirect_api = (
+                ComdirectAPI() if settings is None else ComdirectAPI(settings=settings)
+            )
+        return comdirect_api
+
+    def run(self) -> None:
+        """Sync the postbox, then poll it until stop() is called.
+        The ComdirectAPI is closed afterwards."""
+        self.start_health_server()
+        self.update_status(state="starting", started_at=now_isoformat(), polls=0)
+        try:
+            # the newest documents are known before the sync, i.e. documents
+            # added meanwhile are found by the next poll
+            self.poll(initial=True)
+            while not self._stop.is_set():
+                next_poll = time.monotonic() + self.get_poll_delay()
+                self.update_status(
+                    state="waiting",
+                    next_poll_at=(
+                        datetime.datetime.now()
+                        + datetime.timedelta(seconds=next_poll - time.monotonic())
+                    ).isoformat(timespec="seconds"),
+                )
+                self.wait_until(next_poll)
+                if not self._stop.is_set():
+                    self.poll()
+        finally:
+            self.update_status(state="stopped")
+            self.stop_health_server()
+            self.comdirect_api.close()
+
+    def stop(self) -> None:
+        """Stop the daemon after the current poll, thread-safe"""
+        self._stop.set()
+
+    def get_poll_delay(self) -> float:
+        """Poll interval randomized by the jitter,
+        so several instances don't poll the API at the same time"""
+        return self.poll_interval * random.uniform(
+            1 - self.poll_jitter, 1 + self.poll_jitter
+        )
+
+    def wait_until(self, deadline: float) -> None:
+        """Wait until the deadline (monotonic clock) or until stopped.
+        The access token is renewed meanwhile if it would expire,
+        i.e. the session stays alive between the polls."""
+        auth_handler = self.comdirect_api.document_handler.auth_handler
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            if auth_handler.expiration_datetime is not None:
+                refresh_in = (
+                    auth_handler.expiration_datetime
+                    - datetime.timedelta(seconds=auth_handler.get_refresh_margin())
+                    - datetime.datetime.now()
+                ).total_seconds()
+                if refresh_in < remaining:
+                    self._stop.wait(max(0.0, refresh_in))
+                    if not self._stop.is_set():
+                        self.renew_session()
+                    continue
+
+            self._stop.wait(remaining)
+
+    def renew_session(self) -> None:
+        """Renew the access token (refresh token or new authentication).
+        Transient errors of the refresh don't start a new authentication
+        (see AuthenticationHandler.refresh_access_token()), failures are
+        retried with an exponential backoff and reported as unhealthy."""
+        try:
+            self.comdirect_api.document_handler.auth_handler.get_access_token()
+        except Exception as exception:
+            self._renew_failures += 1
+            delay = min(
+                RENEW_BACKOFF_MAX,
+                RENEW_BACKOFF_BASE * 2 ** (self._renew_failures - 1),
+            )
+            logging.exception(f"Renewing the session failed, retrying in {delay} s")
+            self.update_status(
+                renew_failures=self._renew_failures,
+                last_error=str(exception),
+                last_error_at=now_isoformat(),
+            )
+            self._stop.wait(delay)
+            return
+
+        if self._renew_failures > 0:
+            self._renew_failures = 0
+            self.update_status(renew_failures=0)
+
+    def poll(self, initial: bool = False) -> None:
+        """Check the newest documents and download the new ones.
+        The complete postbox is synced initially and if all listed documents are new."""
+        self.update_status(state="polling", last_poll_at=now_isoformat())
+        try:
+            documents, matches = self.comdirect_api.document_handler.get_postbox_page(
+                paging_first=0, paging_count=self.poll_page_size
+            )
+            new_documents = [
+                doc for doc in documents if doc.document_id not in self._seen_ids
+            ]
+            sync_report = None
+            if initial or (
+                len(new_documents) == len(documents) and len(documents) < matches
+            ):
+                logging.info("Syncing the complete postbox")
+                sync_report = self.comdirect_api.process_postbox_documents()
+            elif len(new_documents) > 0:
+                logging.info(f"Found {len(new_documents)} new documents")
+                sync_report = self.comdirect_api.process_postbox_documents(
+                    pages=[PostboxPage(documents=new_documents, matches=matches)]
+                )
+            self._seen_ids = {doc.document_id for doc in documents}
+        except Exception as exception:
+            logging.exception("Polling the postbox failed")
+            self.update_status(
+                last_poll_succeeded=False,
+                last_error=str(exception),
+                last_error_at=now_isoformat(),
+            )
+            return
+
+        with self._status_lock:
+            self._status["last_poll_succeeded"] = True
+            self._status["polls"] = self._status.get("polls", 0) + 1
+            self._status["last_success_at"] = now_isoformat()
+            self._status["postbox_documents"] = matches
+            if sync_report is not None:
+                self._status["last_sync_at"] = now_isoformat()
+                self._status["saved_files"] = self._status.get("saved_files", 0) + len(
+                    sync_report.saved_files
+                )
+                self._status["unmatched_files"] = self._status.get(
+                    "unmatched_files", 0
+                ) + len(sync_report.unmatched_file_names)
+
+    def update_status(self, **values: typing.Any) -> None:
+        """Update the values reported by the status endpoint"""
+        with self._status_lock:
+            self._status.update(values)
+
+    def get_status(self) -> typing.Dict[str, typing.Any]:
+        """Current status, incl. whether the daemon is healthy,
+        i.e. the last poll and session renewal succeeded and the session is valid"""
+        auth_handler = self.comdirect_api.document_handler.auth_handler
+        with self._status_lock:
+            status = dict(self._status)
+        status["authenticated"] = auth_handler.is_authenticated()
+        status["healthy"] = (
+            status.get("state") not in ["stopped", None]
+            and status["authenticated"]
+            and status.get("last_poll_succeeded", True)
+            and status.get("renew_failures", 0) == 0
+        )
+        return status
+
+    def start_health_server(self) -> None:
+        """Serve /health and /status in a background thread, if a port is configured"""
+        if self.health_port is None:
+            return
+
+        daemon = self
+
+        class HealthRequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: typing.Any) -> None:
+                logging.debug(f"Health endpoint: {format % args}")
+
+            def do_GET(self) -> None:
+                status = daemon.get_status()
+                if self.path == "/health":
+                    body = {"healthy": status["healthy"]}
+                elif self.path == "/status":
+                    body = status
+                else:
+                    self.send_error(404)
+                    return
+
+                content = json.dumps(body).encode("UTF-8")
+                self.send_response(200 if status["healthy"] else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        self._health_server = ThreadingHTTPServer(
+            (self.health_host, self.health_port), HealthRequestHandler
+        )
+        self._health_server.daemon_threads = True
+        threading.Thread(target=self._health_server.serve_forever, daemon=True).start()
+        logging.info(
+            f"Serving /health and /status on http://{self.health_host}:"
+            + f"{self._health_server.server_address[1]}"
+        )
+
+    def stop_health_server(self) -> None:
+        """Stop serving the health endpoint"""
+        if self._health_server is not None:
+            self._health_server.shutdown()
+            self._health_server.server_close()
+            self._health_server = None
+
+
+def now_isoformat() -> str:
+    """Current time as ISO string (seconds)"""
+    return datetime.datetime.now().isoformat(timespec="seconds")
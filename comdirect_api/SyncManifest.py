@@ -0,0 +1,114 @@
+from pydantic import BaseModel, PrivateAttr
+import datetime
+import sqlite3
+import threading
+import typing
+
+from src.data.CompactDocument import AnyDocument
+from src.data.config_types import Settings
+
+
+class SyncManifest(BaseModel):
+    """Persistent record (SQLite) of the documents which have been synced already.
+    Known documents are skipped without touching the file system,
+    the watermark (newest creation date of the last complete sync)
+    allows to stop listing the postbox early."""
+
+    manifest_path: str
+
+    _connection: sqlite3.Connection = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _document_ids: typing.Set[str] = PrivateAttr(default_factory=set)
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    def __init__(self, **data: typing.Any) -> None:
+        super().__init__(**data)
+        # the manifest is shared by the download workers
+        self._connection = sqlite3.connect(self.manifest_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                document_id TEXT PRIMARY KEY,
+                date_creation TEXT NOT NULL,
+                wkn TEXT NOT NULL,
+                file_class TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER,
+                sha256 TEXT,
+                synced_at TEXT NOT NULL
+            )"""
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._connection.commit()
+
+        self._document_ids = {
+            row[0]
+            for row in self._connection.execute("SELECT document_id FROM documents")
+        }
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> typing.Optional["SyncManifest"]:
+        """Open the manifest configured in the settings.
+        Returns None if no manifest is configured."""
+        if settings.manifest_path is None:
+            return None
+
+        return SyncManifest(manifest_path=settings.manifest_path)
+
+    def contains(self, document_id: str) -> bool:
+        """Check if the document has been synced already (in-memory lookup)"""
+        return document_id in self._document_ids
+
+    def add(
+        self,
+        document: AnyDocument,
+        matched_wkn: str,
+        matched_file_class: str,
+        doc_path: str,
+        size: typing.Optional[int] = None,
+        sha256: typing.Optional[str] = None,
+    ) -> None:
+        """Record a synced document"""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    document.document_id,
+                    document.date_creation.isoformat(),
+                    matched_wkn,
+                    matched_file_class,
+                    doc_path,
+                    size,
+                    sha256,
+                    datetime.datetime.now().isoformat(),
+                ),
+            )
+            self._connection.commit()
+            self._document_ids.add(document.document_id)
+
+    def get_watermark(self) -> typing.Optional[datetime.date]:
+        """Newest creation date of the documents in the last complete sync"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM sync_state WHERE key = 'watermark'"
+            ).fetchone()
+
+        return None if row is None else datetime.date.fromisoformat(row[0])
+
+    def set_watermark(self, watermark: datetime.date) -> None:
+        """Set the watermark after a complete sync"""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES ('watermark', ?)",
+                (watermark.isoformat(),),
+            )
+            self._connection.commit()
+
+    def close(self) -> None:
+        """Close the connection to the manifest database"""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,314 @@
+from pydantic import BaseModel, Field, root_validator, validator
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import datetime
+import json
+import logging
+import sys
+import time
+import typing
+
+from src.AdaptiveConcurrencyLimiter import AdaptiveConcurrencyLimiter
+from src.ComdirectAPI import ComdirectAPI, SyncPlanEntry, SyncReport
+from src.HttpMetrics import HttpMetrics
+from src.StageProfiler import StageProfiler
+from src.data.config_types import (
+    AccountConfig,
+    Credentials,
+    Settings,
+    apply_settings,
+    get_settings,
+)
+from src.handler.AuthenticationHandler import AuthenticationHandler
+from src.handler.DocumentHandler import DocumentHandler
+from src.handler.TanConfirmation import PromptTanConfirmation
+from src import http_utils
+
+
+class AccountSyncResult(typing.NamedTuple):
+    """Result of the sync of an account"""
+
+    account: str
+    # None if the sync failed
+    sync_report: typing.Optional[SyncReport]
+    duration: float
+    error: typing.Optional[str] = None
+
+
+class SyncOrchestrator(BaseModel):
+    """Syncs the postboxes of multiple accounts.
+    The TAN challenges of all accounts are requested at once up front
+    (and confirmed by a single prompt or in parallel by polling),
+    afterwards the accounts are synced in parallel. Every account has its own
+    HTTP session and handlers, the listing, depot and download requests
+    of all accounts share one concurrency limiter capped at max_connections."""
+
+    # settings missing values are taken from, defaults to get_settings()
+    settings: typing.Optional[Settings] = Field(default=None)
+    accounts: typing.List[AccountConfig]
+    max_connections: int = Field(ge=1)
+    # shared by the requests of all accounts
+    concurrency_limiter: AdaptiveConcurrencyLimiter = Field(default=None)
+    # optional measurements of the requests of all accounts
+    http_metrics: typing.Optional[HttpMetrics]
+    metrics_path: typing.Optional[str]
+    # optional profiling of the stages of all accounts
+    profiler: typing.Optional[StageProfiler]
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @root_validator(pre=True)
+    def defaults_from_settings(
+        cls, values: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        """Take missing values from the settings,
+        the settings are the base of the account settings"""
+        if values.get("settings") is None:
+            values["settings"] = get_settings()
+        return apply_settings(
+            values,
+            {
+                "accounts": lambda settings: settings.accounts,
+                "max_connections": lambda settings: settings.max_connections,
+                "http_metrics": lambda settings: None
+                if settings.metrics_path is None
+                else HttpMetrics(),
+                "metrics_path": lambda settings: settings.metrics_path,
+                "profiler": StageProfiler.from_settings,
+            },
+        )
+
+    @validator("concurrency_limiter", pre=True, always=True)
+    def default_concurrency_limiter(
+        cls,
+        concurrency_limiter: typing.Optional[AdaptiveConcurrencyLimiter],
+        values: typing.Dict[str, typing.Any],
+    ) -> AdaptiveConcurrencyLimiter:
+        """Start with max_connections concurrent downloads if no limiter is given"""
+        if concurrency_limiter is None:
+            concurrency_limiter = AdaptiveConcurrencyLimiter(
+                max_limit=values.get("max_connections", 1)
+            )
+        return concurrency_limiter
+
+    def create_comdirect_api(self, account: AccountConfig) -> ComdirectAPI:
+        """Create an isolated ComdirectAPI (HTTP session, handlers, manifest)
+        for the account, prompts for the username and password of the account"""
+        settings = account.to_settings(self.settings)
+        http_session = http_utils.create_session(settings.transport_config)
+        if self.http_metrics is not None:
+            self.http_metrics.install(http_session)
+
+        auth_handler = AuthenticationHandler(
+            settings=settings,
+            http_session=http_session,
+            credentials=Credentials.get_credentials(
+                settings.get_credentials_path(), account_name=account.name
+            ),
+        )
+        return ComdirectAPI(
+            settings=settings,
+            http_session=http_session,
+            concurrency_limiter=self.concurrency_limiter,
+            document_handler=DocumentHandler(
+                settings=settings,
+                http_session=http_session,
+                auth_handler=auth_handler,
+                concurrency_limiter=self.concurrency_limiter,
+            ),
+            # the metrics of all accounts are exported once after the sync
+            http_metrics=None,
+            metrics_path=None,
+            profiler=None,
+            progress_description=f"[{account.name}] Process documents in postbox",
+            log_report=False,
+        )
+
+    def authenticate(
+        self, auth_handlers: typing.Dict[str, AuthenticationHandler]
+    ) -> None:
+        """Authenticate all accounts, the TAN challenges of all accounts
+        which can't reuse or refresh their session are requested at once."""
+        pending_accounts = [
+            account
+            for account, auth_handler in auth_handlers.items()
+            if not auth_handler.renew_without_tan()
+        ]
+        if len(pending_accounts) == 0:
+            return
+
+        for account in pending_accounts:
+            auth_handlers[account].start_authentication()
+
+        # the challenges which are confirmed by a prompt share a single prompt,
+        # the others (e.g. polled) are confirmed in parallel meanwhile
+        prompt_accounts = [
+            account
+            for account in pending_accounts
+            if isinstance(
+                auth_handlers[account].tan_confirmation, PromptTanConfirmation
+            )
+        ]
+        with ThreadPoolExecutor(max_workers=len(pending_accounts)) as executor:
+            confirmations = [
+                executor.submit(auth_handlers[account].confirm_tan_challenge)
+                for account in pending_accounts
+                if account not in prompt_accounts
+            ]
+            if len(prompt_accounts) > 0:
+                input(
+                    (
+                        f"{datetime.datetime.now().strftime(self.settings.time_format)}: "
+                        + "Activating the sessions. Confirm that the TAN challenges "
+                        + f"of the accounts {', '.join(prompt_accounts)} were solved with ENTER..."
+                    )
+                )
+            for confirmation in confirmations:
+                confirmation.result()
+
+        for account in pending_accounts:
+            auth_handlers[account].complete_authentication()
+            auth_handlers[account].save_session_cache()
+
+    def sync_account(
+        self, account: AccountConfig, comdirect_api: ComdirectAPI
+    ) -> AccountSyncResult:
+        """Sync the postbox of an account, errors are reported in the result"""
+        start = time.perf_counter()
+        try:
+            sync_report = comdirect_api.process_postbox_documents()
+        except Exception as exception:
+            logging.exception(f"Sync of the account {account.name} failed")
+            return AccountSyncResult(
+                account=account.name,
+                sync_report=None,
+                duration=time.perf_counter() - start,
+                error=str(exception),
+            )
+
+        return AccountSyncResult(
+            account=account.name,
+            sync_report=sync_report,
+            duration=time.perf_counter() - start,
+        )
+
+    def create_authenticated_apis(self) -> typing.Dict[str, ComdirectAPI]:
+        """ComdirectAPI per account name, all accounts are authenticated"""
+        comdirect_apis = {
+            account.name: self.create_comdirect_api(account)
+            for account in self.accounts
+        }
+        self.authenticate(
+            {
+                name: comdirect_api.document_handler.auth_handler
+                for name, comdirect_api in comdirect_apis.items()
+            }
+        )
+        return comdirect_apis
+
+    def plan(
+        self, plan_path: typing.Optional[str] = None
+    ) -> typing.Dict[str, typing.List[SyncPlanEntry]]:
+        """Compute the sync plans of all accounts (dry run),
+        see ComdirectAPI.plan_postbox_documents().
+
+        Args:
+            plan_path (str, optional): write the plans as JSON Lines to this path
+                                       (with the account name), "-" for stdout.
+                                       Defaults to None.
+
+        Returns:
+            Dict[str, List[SyncPlanEntry]]: plan per account name
+        """
+        comdirect_apis = self.create_authenticated_apis()
+        with close_apis(comdirect_apis), ThreadPoolExecutor(
+            max_workers=max(1, len(self.accounts))
+        ) as executor:
+            plans = dict(
+                zip(
+                    comdirect_apis,
+                    executor.map(
+                        lambda comdirect_api: comdirect_api.plan_postbox_documents(),
+                        comdirect_apis.values(),
+                    ),
+                )
+            )
+
+        lines = (
+            json.dumps({"account": account, **entry.to_dict()}, ensure_ascii=False)
+            + "\n"
+            for account, plan in plans.items()
+            for entry in plan
+        )
+        if plan_path == "-":
+            sys.stdout.writelines(lines)
+        elif plan_path is not None:
+            with open(plan_path, "w", encoding="UTF-8") as plan_file:
+                plan_file.writelines(lines)
+            logging.info(f"Saved sync plan to {plan_path}")
+
+        return plans
+
+    def sync(self) -> typing.List[AccountSyncResult]:
+        """Authenticate all accounts and sync them in parallel.
+
+        Returns:
+            List[AccountSyncResult]: results in the order of the accounts
+        """
+        with contextlib.nullcontext() if self.profiler is None else (
+            self.profiler.profile()
+        ):
+            comdirect_apis = self.create_authenticated_apis()
+
+            with close_apis(comdirect_apis), ThreadPoolExecutor(
+                max_workers=max(1, len(self.accounts))
+            ) as executor:
+                results = list(
+                    executor.map(
+                        lambda account: self.sync_account(
+                            account, comdirect_apis[account.name]
+                        ),
+                        self.accounts,
+                    )
+                )
+
+        log_summary(results)
+        if self.http_metrics is not None and self.metrics_path is not None:
+            self.http_metrics.write(self.metrics_path)
+            logging.info(f"Saved HTTP metrics to {self.metrics_path}")
+
+        return results
+
+
+@contextlib.contextmanager
+def close_apis(comdirect_apis: typing.Dict[str, ComdirectAPI]) -> typing.Iterator[None]:
+    """Close the ComdirectAPI's of the accounts when the context is left"""
+    try:
+        yield
+    finally:
+        for comdirect_api in comdirect_apis.values():
+            comdirect_api.close()
+
+
+def log_summary(results: typing.List[AccountSyncResult]) -> None:
+    """Log the combined report of the synced accounts"""
+    print("\n\n\n")
+    print("#########################################################")
+    logging.info("Summary:")
+    for result in results:
+        if result.sync_report is None:
+            logging.info(
+                f"{result.account}: failed after {result.duration:.1f} s ({result.error})"
+            )
+            continue
+
+        logging.info(
+            f"{result.account}: {len(result.sync_report.saved_files)} saved, "
+            + f"{len(result.sync_report.unmatched_file_names)} unmatched "
+            + f"in {result.duration:.1f} s"
+        )
+        for saved_file in result.sync_report.saved_files:
+            logging.info(f"    {saved_file}")
+        for unmatched_file_name in result.sync_report.unmatched_file_names:
+            logging.info(f"    unmatched: {unmatched_file_name}")
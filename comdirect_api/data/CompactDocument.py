@@ -0,0 +1,152 @@
+import datetime
+import sys
+import typing
+
+from src.data.Document import Document, DocumentMixin
+from src.data.DocumentMetaData import DocumentMetaData
+
+
+class CompactDocument(DocumentMixin):
+    """Lightweight, immutable counterpart of Document for postbox listings.
+    The API payload is trusted, i.e. not validated, the dates are parsed on first
+    access and the metadata is only turned into a DocumentMetaData on access.
+    Compared by the document id like Document."""
+
+    __slots__ = (
+        "document_id",
+        "name",
+        "mime_type",
+        "deleteable",
+        "advertisement",
+        "category_id",
+        # ISO date string until the first access, datetime.date afterwards
+        "_date_creation",
+        # (archived, already read, predocument exists, ISO date read)
+        "_metadata",
+    )
+
+    document_id: str
+    name: str
+    mime_type: str
+    deleteable: bool
+    advertisement: bool
+    category_id: int
+    _date_creation: typing.Union[str, datetime.date]
+    _metadata: typing.Tuple[bool, bool, bool, typing.Optional[str]]
+
+    def __init__(
+        self,
+        document_id: str,
+        name: str,
+        date_creation: typing.Union[str, datetime.date],
+        mime_type: str,
+        deleteable: bool,
+        advertisement: bool,
+        metadata: typing.Tuple[bool, bool, bool, typing.Optional[str]],
+        category_id: int,
+    ) -> None:
+        set_attribute = object.__setattr__
+        set_attribute(self, "document_id", document_id)
+        set_attribute(self, "name", name)
+        set_attribute(self, "_date_creation", date_creation)
+        # only a handful of distinct mime types, share the strings
+        set_attribute(self, "mime_type", sys.intern(mime_type))
+        set_attribute(self, "deleteable", deleteable)
+        set_attribute(self, "advertisement", advertisement)
+        set_attribute(self, "_metadata", metadata)
+        set_attribute(self, "category_id", category_id)
+
+    @classmethod
+    def from_dict(cls, input_dict: typing.Dict[str, typing.Any]) -> "CompactDocument":
+        """Create the document from an entry of the postbox listing without validation"""
+        metadata = input_dict["documentMetaData"]
+        return CompactDocument(
+            document_id=input_dict["documentId"],
+            name=input_dict["name"],
+            date_creation=input_dict["dateCreation"],
+            mime_type=input_dict["mimeType"],
+            deleteable=input_dict["deletable"],
+            advertisement=input_dict["advertisement"],
+            metadata=(
+                metadata["archived"],
+                metadata["alreadyRead"],
+                metadata["predocumentExists"],
+                metadata.get("dateRead"),
+            ),
+            category_id=input_dict["categoryId"],
+        )
+
+    @property
+    def date_creation(self) -> datetime.date:
+        """Creation date of the document, parsed on first access"""
+        date_creation = self._date_creation
+        if isinstance(date_creation, str):
+            date_creation = datetime.date.fromisoformat(date_creation)
+            object.__setattr__(self, "_date_creation", date_creation)
+        return date_creation
+
+    @property
+    def document_metadata(self) -> DocumentMetaData:
+        """Metadata of the document, see DocumentMetaData"""
+        archived, already_read, predocument_exists, date_read = self._metadata
+        return DocumentMetaData(
+            archived=archived,
+            date_read=None
+            if date_read is None
+            else datetime.date.fromisoformat(date_read),
+            already_read=already_read,
+            predocument_exists=predocument_exists,
+        )
+
+    def to_document(self) -> Document:
+        """Validated Document with the same values"""
+        return Document(
+            document_id=self.document_id,
+            name=self.name,
+            date_creation=self.date_creation,
+            mime_type=self.mime_type,
+            deleteable=self.deleteable,
+            advertisement=self.advertisement,
+            document_metadata=self.document_metadata,
+            category_id=self.category_id,
+        )
+
+    def __setattr__(self, name: str, value: typing.Any) -> None:
+        raise TypeError(f'"{type(self).__name__}" is immutable')
+
+    def __delattr__(self, name: str) -> None:
+        raise TypeError(f'"{type(self).__name__}" is immutable')
+
+    def __reduce__(self) -> typing.Tuple[typing.Any, ...]:
+        """Support pickling (e.g. for process pools) despite the immutability"""
+        return (
+            CompactDocument,
+            (
+                self.document_id,
+                self.name,
+                self._date_creation,
+                self.mime_type,
+                self.deleteable,
+                self.advertisement,
+                self._metadata,
+                self.category_id,
+            ),
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompactDocument):
+            return NotImplemented
+        return self.document_id == other.document_id
+
+    def __hash__(self) -> int:
+        return self.document_id.__hash__()
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactDocument(document_id={self.document_id!r}, name={self.name!r}, "
+            f"date_creation={self.date_creation!r}, mime_type={self.mime_type!r})"
+        )
+
+
+# documents as returned by the handlers, both provide the same interface
+AnyDocument = typing.Union[Document, CompactDocument]
@@ -1,13 +1,81 @@
 from pydantic import BaseModel
 import datetime
+import functools
+import os
+import re
 import typing
 
 from src.data.DocumentMetaData import DocumentMetaData
 from src import file_utils
 from src.data.config_types import DocumentClassificationConfig
+from src.data.DocumentClassifier import DocumentClassifier, compile_alternation
 
 
-class Document(BaseModel):
+@functools.lru_cache(maxsize=8)
+def compile_ignored_file_classes(
+    ignored_file_classes: typing.FrozenSet[str],
+) -> typing.Pattern[str]:
+    """Compiled regex matching any of the ignored file classes"""
+    return re.compile(compile_alternation(ignored_file_classes))
+
+
+class DocumentMixin:
+    """Functionality shared by Document and CompactDocument,
+    relies on the attributes name, mime_type and advertisement."""
+
+    __slots__ = ()
+
+    name: str
+    mime_type: str
+    advertisement: bool
+
+    def get_document_file_name(self) -> str:
+        """Get the document file name and replace invalid chars in it"""
+        return file_utils.replace_invalid_chars(
+            f"{self.name}.{self.get_file_extension()}"
+        )
+
+    def get_document_path(
+        self, output_dir: str, matched_wkn: str, matched_file_class: str
+    ) -> str:
+        """Get the path the document is saved to, i.e.
+        <output_dir>/<WKN>/<file class>/<document file name>"""
+        return file_utils.replace_invalid_chars(
+            os.path.join(
+                output_dir,
+                matched_wkn,
+                matched_file_class,
+                self.get_document_file_name(),
+            )
+        )
+
+    def get_file_extension(self) -> str:
+        """Get document extension from mime type"""
+        ext = self.mime_type.split("/")[1]
+        return ext
+
+    def classify(
+        self, document_classification_config: DocumentClassificationConfig
+    ) -> typing.Tuple[str, str]:
+        """Classify the file class and determine to which stock this document
+        belongs to by matching the WKN, see DocumentClassifier for the priority rules."""
+        result = DocumentClassifier.for_config(document_classification_config).classify(
+            self.name
+        )
+        return result.wkn, result.file_class
+
+    def skip_download(self, ignored_file_classes: typing.Set[str]) -> bool:
+        """Checks if document download should be skipped
+        (i.e. docment is an ad or belongs to an ignored file class)."""
+        return self.advertisement or (
+            compile_ignored_file_classes(frozenset(ignored_file_classes)).search(
+                self.name
+            )
+            is not None
+        )
+
+
+class Document(DocumentMixin, BaseModel):
     """Documents which can be retrieved from the comdirect postbox."""
 
     # comdirect description:
@@ -57,46 +125,5 @@ class Document(BaseModel):
             category_id=input_dict["categoryId"],
         )
 
-    def get_document_file_name(self) -> str:
-        """Get the document file name and replace invalid chars in it"""
-        return file_utils.replace_invalid_chars(
-            f"{self.name}.{self.get_file_extension()}"
-        )
-
-    def get_file_extension(self) -> str:
-        """Get document extension from mime type"""
-        ext = self.mime_type.split("/")[1]
-        return ext
-
-    def classify(
-        self, document_classification_config: DocumentClassificationConfig
-    ) -> typing.Tuple[str, str]:
-        """Classify the file class and determine to which stock this document
-        belongs to by matching the WKN."""
-
-        matched_wkn: str = document_classification_config.unknown_classification
-        for wkn in document_classification_config.known_depot_positions:
-            if wkn in self.name:
-                matched_wkn = wkn
-                break
-
-        matched_file_class: str = document_classification_config.unknown_classification
-        for known_file_class in document_classification_config.known_file_classes:
-            if known_file_class in self.name:
-                matched_file_class = known_file_class
-                break
-
-        return matched_wkn, matched_file_class
-
-    def skip_download(self, ignored_file_classes: typing.Set[str]) -> bool:
-        """Checks if document download should be skipped
-        (i.e. docment is an ad or belongs to an ignored file class)."""
-        return self.advertisement or any(
-            [
-                ignored_file_class in self.name
-                for ignored_file_class in ignored_file_classes
-            ]
-        )
-
     def __hash__(self) -> int:
         return self.document_id.__hash__()
@@ -0,0 +1,149 @@
+from pydantic import BaseModel, PrivateAttr
+import collections
+import re
+import threading
+import typing
+
+from src.data.config_types import DocumentClassificationConfig
+
+
+class ClassificationResult(typing.NamedTuple):
+    """Result of the classification of a document name"""
+
+    wkn: str
+    file_class: str
+    ignored: bool
+
+
+def compile_alternation(patterns: typing.Iterable[str]) -> str:
+    """Regex alternation of the given literal patterns, structured as a trie
+    (e.g. "Kauf", "Kosten" -> "K(?:auf|osten)"), so each position of the input
+    is checked against all patterns at once instead of one pattern after another.
+    The optional suffixes are greedy, i.e. at each position the longest pattern matches.
+    Never matches if no patterns are given."""
+    trie: typing.Dict[str, typing.Any] = {}
+    for pattern in patterns:
+        if len(pattern) == 0:
+            continue
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def compile_node(node: typing.Dict[str, typing.Any]) -> str:
+        branches = [
+            re.escape(char) + compile_node(child)
+            for char, child in sorted(node.items())
+            if char != ""
+        ]
+        if len(branches) == 0:
+            return ""
+        alternation = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # a pattern ends at this node, i.e. the longer patterns are optional
+        return f"(?:{alternation})?" if "" in node else alternation
+
+    if len(trie) == 0:
+        return "(?!)"
+    return compile_node(trie)
+
+
+class DocumentClassifier(BaseModel):
+    """Classifies document names with a single compiled regex,
+    i.e. in one pass over the name instead of one substring search per pattern.
+    Priority rules if several patterns of a kind match:
+    1. the longest pattern (e.g. "Verkauf" before "Kauf")
+    2. the earliest match in the name"""
+
+    document_classification_config: DocumentClassificationConfig
+
+    _regex: typing.Pattern[str] = PrivateAttr()
+
+    class Config:
+        copy_on_model_validation = "none"
+
+    def __init__(self, **data: typing.Any) -> None:
+        super().__init__(**data)
+        config = self.document_classification_config
+        # the leading lookahead only stops at positions where any pattern matches,
+        # the optional lookaheads capture the longest pattern of each kind there
+        self._regex = re.compile(
+            "(?=(?:{all}))(?=(?P<wkn>{wkn})?)(?=(?P<file_class>{file_class})?)"
+            "(?=(?P<ignored>{ignored})?)".format(
+                all=compile_alternation(
+                    [
+                        *config.known_depot_positions,
+                        *config.known_file_classes,
+                        *config.ignored_file_classes,
+                    ]
+                ),
+                wkn=compile_alternation(config.known_depot_positions),
+                file_class=compile_alternation(config.known_file_classes),
+                ignored=compile_alternation(config.ignored_file_classes),
+            )
+        )
+
+    @classmethod
+    def for_config(
+        cls, document_classification_config: DocumentClassificationConfig
+    ) -> "DocumentClassifier":
+        """Get the (cached) classifier for the given config"""
+        key = id(document_classification_config)
+        with _classifier_cache_lock:
+            if key in _classifier_cache:
+                _classifier_cache.move_to_end(key)
+                return _classifier_cache[key][1]
+
+        classifier = DocumentClassifier(
+            document_classification_config=document_classification_config
+        )
+        with _classifier_cache_lock:
+            # keep a reference to the config, so its id can't be reused meanwhile
+            _classifier_cache[key] = (document_classification_config, classifier)
+            if len(_classifier_cache) > CLASSIFIER_CACHE_SIZE:
+                _classifier_cache.popitem(last=False)
+
+        return classifier
+
+    def classify(self, name: str) -> ClassificationResult:
+        """Classify the file class, the WKN and whether the document is ignored
+        in a single pass over the document name."""
+        matched_wkn: typing.Optional[str] = None
+        matched_file_class: typing.Optional[str] = None
+        ignored = False
+
+        for match in self._regex.finditer(name):
+            wkn, file_class, ignored_file_class = match.group(
+                "wkn", "file_class", "ignored"
+            )
+            if wkn is not None and is_preferred(wkn, matched_wkn):
+                matched_wkn = wkn
+            if file_class is not None and is_preferred(file_class, matched_file_class):
+                matched_file_class = file_class
+            ignored = ignored or ignored_file_class is not None
+
+        unknown = self.document_classification_config.unknown_classification
+        return ClassificationResult(
+            wkn=unknown if matched_wkn is None else matched_wkn,
+            file_class=unknown if matched_file_class is None else matched_file_class,
+            ignored=ignored,
+        )
+
+    def classify_many(
+        self, names: typing.Iterable[str]
+    ) -> typing.List[ClassificationResult]:
+        """Classify many document names at once"""
+        return [self.classify(name) for name in names]
+
+
+def is_preferred(candidate: str, current: typing.Optional[str]) -> bool:
+    """Check if a later match is preferred over the current (earlier) match.
+    Longer patterns win, for patterns of equal length the earlier match is kept."""
+    return current is None or len(candidate) > len(current)
+
+
+# compiled classifiers per config (by id), i.e. each config is only compiled once
+CLASSIFIER_CACHE_SIZE = 8
+_classifier_cache: "collections.OrderedDict[int, typing.Tuple[DocumentClassificationConfig, DocumentClassifier]]" = (
+    collections.OrderedDict()
+)
+_classifier_cache_lock = threading.Lock()
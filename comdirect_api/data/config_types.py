@@ -1,11 +1,20 @@
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl, validator
 import json
 from getpass import getpass
 import typing
+import functools
+import logging
+import os
+import random
+import re
+import time
 from collections import Counter
 
 from src import file_utils
 
+TAN_CONFIRMATION_MODES = ["poll", "prompt"]
+STORAGE_BACKENDS = ["directory", "tar", "sqlite"]
+
 
 def ensure_no_duplicates(elements: typing.List[str]) -> None:
     duplicates: typing.List[str] = [k for k, v in Counter(elements).items() if v > 1]
@@ -28,19 +37,326 @@ class ApiConfig(BaseModel):
 
     @classmethod
     def from_config(cls) -> "ApiConfig":
-        """Load an API config from a json file
-        Args:
-            config_path (str): json file path
+        """Get the API config from the (cached) settings
         Returns:
             ApiConfig: Loaded ApiConfig
         """
-        config_json = file_utils.load_config()
+        return get_settings().api_config
 
+    @classmethod
+    def from_json(cls, config_json: typing.Dict[str, typing.Any]) -> "ApiConfig":
+        """Create an API config from the parsed config file
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            ApiConfig: Loaded ApiConfig
+        """
         return ApiConfig(
             api_url=config_json["api_url"], oauth_url=config_json["oauth_url"]
         )
 
 
+class TransportConfig(BaseModel):
+    """
+    Config of the HTTP transport shared by all handlers,
+    i.e. connection pool sizes and default timeouts.
+    """
+
+    # number of connection pools (one per host) which are cached
+    pool_connections: int = Field(default=2, ge=1)
+    # maximum number of keep-alive connections per host,
+    # should be at least the number of concurrent download workers
+    pool_maxsize: int = Field(default=8, ge=1)
+    # default timeouts in seconds
+    connect_timeout: float = Field(default=10, gt=0)
+    read_timeout: float = Field(default=60, gt=0)
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_config(cls) -> "TransportConfig":
+        """Get the transport config from the (cached) settings
+        Returns:
+            TransportConfig: Loaded TransportConfig
+        """
+        return get_settings().transport_config
+
+    @classmethod
+    def from_json(cls, config_json: typing.Dict[str, typing.Any]) -> "TransportConfig":
+        """Create the transport config from the parsed config file.
+        Missing values are replaced by their defaults.
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            TransportConfig: Loaded TransportConfig
+        """
+        return TransportConfig(**config_json.get("transport", {}))
+
+
+class RetryPolicy(BaseModel):
+    """
+    Retries of idempotent requests (GET) which failed temporarily,
+    i.e. throttled (HTTP 429), server errors (HTTP 5xx / 408) or connection errors.
+    """
+
+    # maximum number of retries per request, 0 disables retries
+    max_retries: int = Field(default=5, ge=0)
+    # backoff in seconds: random delay up to min(backoff_max, backoff_base * 2 ** attempt)
+    backoff_base: float = Field(default=0.5, ge=0)
+    backoff_max: float = Field(default=30, ge=0)
+    # wait for the delay requested via the Retry-After header instead of the backoff
+    respect_retry_after: bool = True
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_config(cls) -> "RetryPolicy":
+        """Get the retry policy from the (cached) settings
+        Returns:
+            RetryPolicy: Loaded RetryPolicy
+        """
+        return get_settings().retry_policy
+
+    @classmethod
+    def from_json(cls, config_json: typing.Dict[str, typing.Any]) -> "RetryPolicy":
+        """Create the retry policy from the parsed config file.
+        Missing values are replaced by their defaults.
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            RetryPolicy: Loaded RetryPolicy
+        """
+        return RetryPolicy(**config_json.get("retry", {}))
+
+    def get_backoff(
+        self, attempt: int, retry_after: typing.Optional[float] = None
+    ) -> float:
+        """Delay in seconds before the given retry (starting at 0),
+        exponential backoff with full jitter or the delay requested by the API.
+        Args:
+            attempt (int): number of the retry
+            retry_after (float, optional): delay requested by the API
+        Returns:
+            float: delay in seconds
+        """
+        if self.respect_retry_after and retry_after is not None:
+            # spread the retries of concurrent requests throttled at the same time
+            return retry_after + random.uniform(0, self.backoff_base)
+
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** min(attempt, 32))
+        )
+
+
+class TanConfirmationConfig(BaseModel):
+    """
+    How the solved TAN challenge is confirmed during the authentication,
+    mode "poll" checks the status of the challenge until it is approved
+    (falls back to the prompt if the challenge has no status),
+    mode "prompt" waits for ENTER.
+    """
+
+    mode: str = "poll"
+    # delay in seconds between the status checks, increased by the backoff factor
+    poll_interval: float = Field(default=1, gt=0)
+    poll_interval_max: float = Field(default=5, gt=0)
+    poll_backoff_factor: float = Field(default=1.5, ge=1)
+    # give up if the challenge isn't approved within this many seconds
+    timeout: float = Field(default=300, gt=0)
+
+    class Config:
+        allow_mutation = False
+
+    @validator("mode")
+    def check_mode(cls, mode: str) -> str:
+        """Ensure that the mode is known"""
+        if mode not in TAN_CONFIRMATION_MODES:
+            raise ValueError(f"mode must be one of {', '.join(TAN_CONFIRMATION_MODES)}")
+        return mode
+
+    @classmethod
+    def from_config(cls) -> "TanConfirmationConfig":
+        """Get the TAN confirmation config from the (cached) settings
+        Returns:
+            TanConfirmationConfig: Loaded TanConfirmationConfig
+        """
+        return get_settings().tan_confirmation_config
+
+    @classmethod
+    def from_json(
+        cls, config_json: typing.Dict[str, typing.Any]
+    ) -> "TanConfirmationConfig":
+        """Create the TAN confirmation config from the parsed config file.
+        Missing values are replaced by their defaults.
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            TanConfirmationConfig: Loaded TanConfirmationConfig
+        """
+        return TanConfirmationConfig(**config_json.get("tan_confirmation", {}))
+
+
+class ContentClassificationConfig(BaseModel):
+    """
+    Second classification stage for downloaded documents whose name lacks
+    the WKN or file class: the text of the PDF is matched instead.
+    Enabled if a cache_path (SQLite file with the extracted texts) is given.
+    """
+
+    cache_path: typing.Optional[str] = None
+    # number of processes extracting the texts, defaults to the number of CPUs
+    max_workers: typing.Optional[int] = Field(default=None, ge=1)
+    # only the first pages are extracted, the WKN is usually on the first page
+    max_pages: int = Field(default=2, ge=1)
+    # WKN per ISIN, for ISINs which don't contain the WKN (e.g. IE00B4L5Y983)
+    isin_to_wkn: typing.Dict[str, str] = Field(default_factory=dict)
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_config(cls) -> "ContentClassificationConfig":
+        """Get the content classification config from the (cached) settings
+        Returns:
+            ContentClassificationConfig: Loaded ContentClassificationConfig
+        """
+        return get_settings().content_classification_config
+
+    @classmethod
+    def from_json(
+        cls, config_json: typing.Dict[str, typing.Any]
+    ) -> "ContentClassificationConfig":
+        """Create the content classification config from the parsed config file.
+        Missing values are replaced by their defaults.
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            ContentClassificationConfig: Loaded ContentClassificationConfig
+        """
+        return ContentClassificationConfig(
+            **config_json.get("content_classification", {})
+        )
+
+
+class DaemonConfig(BaseModel):
+    """
+    Config of the daemon mode (SyncDaemon): polling of the postbox
+    and the local health endpoint.
+    """
+
+    # seconds between two polls, randomized by +/- poll_jitter (share)
+    poll_interval: float = Field(default=900, gt=0)
+    poll_jitter: float = Field(default=0.1, ge=0, lt=1)
+    # number of the newest documents checked per poll
+    poll_page_size: int = Field(default=20, ge=1)
+    # health and status endpoint (HTTP), disabled if no port is given
+    health_host: str = "127.0.0.1"
+    health_port: typing.Optional[int] = Field(default=None, ge=0, le=65535)
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_config(cls) -> "DaemonConfig":
+        """Get the daemon config from the (cached) settings
+        Returns:
+            DaemonConfig: Loaded DaemonConfig
+        """
+        return get_settings().daemon_config
+
+    @classmethod
+    def from_json(cls, config_json: typing.Dict[str, typing.Any]) -> "DaemonConfig":
+        """Create the daemon config from the parsed config file.
+        Missing values are replaced by their defaults.
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            DaemonConfig: Loaded DaemonConfig
+        """
+        return DaemonConfig(**config_json.get("daemon", {}))
+
+
+class StorageConfig(BaseModel):
+    """
+    Config of the storage of the downloaded documents (StorageBackend):
+    a directory tree (one file per document), an append-only tar archive
+    or a SQLite blob store.
+    """
+
+    backend: str = "directory"
+    # archive or database file, defaults to documents.tar / documents.sqlite
+    # in the output directory
+    path: typing.Optional[str] = None
+    # documents up to this size in bytes are buffered in memory before they
+    # are appended to an archive or database, larger ones in a temporary file
+    spool_size: int = Field(default=8 * 1024 * 1024, ge=0)
+
+    class Config:
+        allow_mutation = False
+
+    @validator("backend")
+    def check_backend(cls, backend: str) -> str:
+        """Ensure that the backend is known"""
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError(f"backend must be one of {', '.join(STORAGE_BACKENDS)}")
+        return backend
+
+    @classmethod
+    def from_config(cls) -> "StorageConfig":
+        """Get the storage config from the (cached) settings
+        Returns:
+            StorageConfig: Loaded StorageConfig
+        """
+        return get_settings().storage_config
+
+    @classmethod
+    def from_json(cls, config_json: typing.Dict[str, typing.Any]) -> "StorageConfig":
+        """Create the storage config from the parsed config file.
+        Missing values are replaced by their defaults.
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            StorageConfig: Loaded StorageConfig
+        """
+        return StorageConfig(**config_json.get("storage", {}))
+
+
+class DepotCacheConfig(BaseModel):
+    """
+    Config of the depot positions retrieved from the API (DepotPositionCache),
+    which complement the depot_positions of the config file.
+    Enabled if a cache_path (JSON file with the current and former positions) is given.
+    """
+
+    cache_path: typing.Optional[str] = None
+    # seconds until the positions are retrieved again
+    ttl: float = Field(default=24 * 60 * 60, ge=0)
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_config(cls) -> "DepotCacheConfig":
+        """Get the depot cache config from the (cached) settings
+        Returns:
+            DepotCacheConfig: Loaded DepotCacheConfig
+        """
+        return get_settings().depot_cache_config
+
+    @classmethod
+    def from_json(cls, config_json: typing.Dict[str, typing.Any]) -> "DepotCacheConfig":
+        """Create the depot cache config from the parsed config file.
+        Missing values are replaced by their defaults.
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            DepotCacheConfig: Loaded DepotCacheConfig
+        """
+        return DepotCacheConfig(**config_json.get("depot_cache", {}))
+
+
 class Credentials(BaseModel):
     """User credentials for the comdirect account."""
 
@@ -55,24 +371,45 @@ class Credentials(BaseModel):
 
     @classmethod
     def get_credentials(
-        cls, credentials_path: typing.Optional[str] = None
+        cls,
+        credentials_path: typing.Optional[str] = None,
+        account_name: typing.Optional[str] = None,
     ) -> "Credentials":
-        """Load credentials from json file"""
+        """Load credentials from json file. Username and password are taken from
+        the file, from the environment (COMDIRECT_USERNAME / COMDIRECT_PASSWORD,
+        COMDIRECT_<ACCOUNT>_USERNAME / ..._PASSWORD for an account)
+        or are prompted. The prompts name the account if given (multiple accounts)."""
         if credentials_path is None:
-            credentials_path = file_utils.get_credentials_path()
+            credentials_path = get_settings().get_credentials_path()
 
         with open(credentials_path, "r", encoding="UTF-8") as credentials_file:
             credentials_data = credentials_file.read()
         credentials_json = json.loads(credentials_data)
 
+        env_prefix = "COMDIRECT_"
+        if account_name is not None:
+            env_prefix += re.sub(r"[^0-9A-Z]", "_", account_name.upper()) + "_"
+        username = credentials_json.get("username") or os.environ.get(
+            f"{env_prefix}USERNAME"
+        )
+        password = credentials_json.get("password") or os.environ.get(
+            f"{env_prefix}PASSWORD"
+        )
+
+        prompt_prefix = "" if account_name is None else f"[{account_name}] "
+        if not username:
+            username = input(
+                prompt_prefix
+                + "Username (eight digit 'Zugangsnummer'/Benutzername from comdirect): "
+            )
+        if not password:
+            password = getpass(prompt_prefix + "Password: ")
         return Credentials(
             client_id=credentials_json["client_id"],
             client_secret=credentials_json["client_secret"],
             grant_type=credentials_json["grant_type"],
-            username=input(
-                "Username (eight digit 'Zugangsnummer'/Benutzername from comdirect): "
-            ),
-            password=getpass(),
+            username=username,
+            password=password,
         )
 
 
@@ -91,8 +428,20 @@ class DocumentClassificationConfig(BaseModel):
     def from_config(
         cls, config_path: typing.Optional[str] = None
     ) -> "DocumentClassificationConfig":
-        """Load document classification config from json file"""
-        config_json = file_utils.load_config(config_path)
+        """Load document classification config from json file.
+        If no path is given, the config is taken from the (cached) settings."""
+        if config_path is None:
+            return get_settings().document_classification_config
+
+        return DocumentClassificationConfig.from_json(
+            file_utils.load_config(config_path)
+        )
+
+    @classmethod
+    def from_json(
+        cls, config_json: typing.Dict[str, typing.Any]
+    ) -> "DocumentClassificationConfig":
+        """Create the document classification config from the parsed config file"""
         file_classes = config_json["file_classes"]
 
         # ensure there are no duplicates in the config to keep it short
@@ -117,3 +466,204 @@ class DocumentClassificationConfig(BaseModel):
             unknown_classification=file_classes["unknown"],
             known_depot_positions=set(config_json["depot_positions"]),
         )
+
+
+class AccountConfig(BaseModel):
+    """Config of an account synced by the SyncOrchestrator,
+    the values override the corresponding settings."""
+
+    # name used in the logs and the summary
+    name: str
+    credentials_path: str
+    output_dir: str
+    # WKN's of the depot positions, the global depot positions if not given
+    depot_positions: typing.Optional[typing.List[str]] = None
+    manifest_path: typing.Optional[str] = None
+    session_cache_path: typing.Optional[str] = None
+    catalog_path: typing.Optional[str] = None
+    # cache of the depot positions retrieved from the API
+    depot_cache_path: typing.Optional[str] = None
+    # the accounts are synced in parallel, i.e. they don't share the content store
+    # and the text cache of the content classification
+    content_store_dir: typing.Optional[str] = None
+    content_classification_cache_path: typing.Optional[str] = None
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_json(
+        cls, config_json: typing.Dict[str, typing.Any]
+    ) -> typing.List["AccountConfig"]:
+        """Create the account configs from the parsed config file.
+        Args:
+            config_json (Dict[str, Any]): parsed config file
+        Returns:
+            List[AccountConfig]: Loaded AccountConfigs, empty for a single account
+        """
+        accounts = [
+            AccountConfig(**account) for account in config_json.get("accounts", [])
+        ]
+        ensure_no_duplicates([account.name for account in accounts])
+        for account in accounts:
+            if account.depot_positions is not None:
+                ensure_no_duplicates(account.depot_positions)
+        return accounts
+
+    def to_settings(self, settings: "Settings") -> "Settings":
+        """Settings of the account, i.e. the given settings
+        with the values of the account config"""
+        document_classification_config = settings.document_classification_config
+        if self.depot_positions is not None:
+            document_classification_config = document_classification_config.copy(
+                update={"known_depot_positions": set(self.depot_positions)}
+            )
+
+        return settings.copy(
+            update={
+                "document_classification_config": document_classification_config,
+                "credentials_path": self.credentials_path,
+                "output_dir": self.output_dir,
+                "manifest_path": self.manifest_path,
+                "session_cache_path": self.session_cache_path,
+                "catalog_path": self.catalog_path,
+                "depot_cache_config": settings.depot_cache_config.copy(
+                    update={"cache_path": self.depot_cache_path}
+                ),
+                "content_store_dir": self.content_store_dir,
+                "content_classification_config": (
+                    settings.content_classification_config.copy(
+                        update={"cache_path": self.content_classification_cache_path}
+                    )
+                ),
+                # the archive or database is created in the account's output directory
+                "storage_config": settings.storage_config.copy(update={"path": None}),
+                # the sync of all accounts is profiled by the SyncOrchestrator
+                "profile_path": None,
+                "accounts": [],
+            }
+        )
+
+
+class Settings(BaseModel):
+    """All settings from the config file, parsed and validated once.
+    Pass the settings to the ComdirectAPI / handlers or use get_settings()
+    for the settings from the default config file."""
+
+    api_config: ApiConfig
+    transport_config: TransportConfig = Field(default_factory=TransportConfig)
+    retry_policy: RetryPolicy = Field(default_factory=RetryPolicy)
+    tan_confirmation_config: TanConfirmationConfig = Field(
+        default_factory=TanConfirmationConfig
+    )
+    document_classification_config: DocumentClassificationConfig
+    content_classification_config: ContentClassificationConfig = Field(
+        default_factory=ContentClassificationConfig
+    )
+    daemon_config: DaemonConfig = Field(default_factory=DaemonConfig)
+    storage_config: StorageConfig = Field(default_factory=StorageConfig)
+    depot_cache_config: DepotCacheConfig = Field(default_factory=DepotCacheConfig)
+    credentials_path: str
+    output_dir: str
+    time_format: str
+    max_download_workers: int = Field(default=4, ge=1)
+    manifest_path: typing.Optional[str] = None
+    session_cache_path: typing.Optional[str] = None
+    token_refresh_margin: int = Field(default=60, ge=0)
+    metrics_path: typing.Optional[str] = None
+    content_store_dir: typing.Optional[str] = None
+    link_mode: str = "hardlink"
+    # SQLite catalog of the metadata of all listed documents
+    catalog_path: typing.Optional[str] = None
+    # cProfile dump of the stages of a sync (StageProfiler)
+    profile_path: typing.Optional[str] = None
+    # accounts synced by the SyncOrchestrator
+    accounts: typing.List[AccountConfig] = Field(default_factory=list)
+    # maximum number of concurrent downloads over all accounts
+    max_connections: int = Field(default=8, ge=1)
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_config(cls, config_path: typing.Optional[str] = None) -> "Settings":
+        """Load the settings from the config file.
+        If no path is given, load the config from the default path in the project directory."""
+        config_json = file_utils.load_config(config_path)
+
+        optional_settings = {
+            key: config_json[key]
+            for key in [
+                "max_download_workers",
+                "manifest_path",
+                "session_cache_path",
+                "token_refresh_margin",
+                "metrics_path",
+                "content_store_dir",
+                "link_mode",
+                "catalog_path",
+                "profile_path",
+                "max_connections",
+            ]
+            if key in config_json
+        }
+        return Settings(
+            api_config=ApiConfig.from_json(config_json),
+            transport_config=TransportConfig.from_json(config_json),
+            retry_policy=RetryPolicy.from_json(config_json),
+            tan_confirmation_config=TanConfirmationConfig.from_json(config_json),
+            document_classification_config=DocumentClassificationConfig.from_json(
+                config_json
+            ),
+            content_classification_config=ContentClassificationConfig.from_json(
+                config_json
+            ),
+            daemon_config=DaemonConfig.from_json(config_json),
+            storage_config=StorageConfig.from_json(config_json),
+            depot_cache_config=DepotCacheConfig.from_json(config_json),
+            credentials_path=config_json["credentials_path"],
+            output_dir=config_json["output_dir"],
+            time_format=config_json["time_format"],
+            accounts=AccountConfig.from_json(config_json),
+            **optional_settings,
+        )
+
+    def get_credentials_path(self) -> str:
+        """Path to the file with credentials, ensures that the file exists"""
+        return file_utils.check_credentials_path(self.credentials_path)
+
+    def get_output_dir(self) -> str:
+        """Output directory, ensures that the directory exists"""
+        return file_utils.check_output_dir(self.output_dir)
+
+
+def apply_settings(
+    values: typing.Dict[str, typing.Any],
+    defaults: typing.Dict[str, typing.Callable[[Settings], typing.Any]],
+) -> typing.Dict[str, typing.Any]:
+    """Fill the missing values of a model from the given settings
+    (value "settings"). Falls back to the default settings,
+    i.e. the config file is only loaded if any value is missing.
+    Args:
+        values (Dict[str, Any]): values passed to the model
+        defaults (Dict[str, Callable[[Settings], Any]]): default value per field
+    Returns:
+        Dict[str, Any]: values including the defaults
+    """
+    missing_fields = [field for field in defaults if field not in values]
+    if len(missing_fields) > 0:
+        if values.get("settings") is None:
+            values["settings"] = get_settings()
+        for field in missing_fields:
+            values[field] = defaults[field](values["settings"])
+
+    return values
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Settings from the default config file, loaded on first use only"""
+    start = time.perf_counter()
+    settings = Settings.from_config()
+    logging.debug(f"Loaded settings in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return settings
@@ -1,6 +1,24 @@
 import typing
 import os
 import json
+import hashlib
+import shutil
+import tempfile
+import uuid
+
+from src.StageProfiler import profile_stage
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# ioctl request to clone a file (reflink) on Linux, i.e. share the data blocks
+# until one of the files is modified (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# ways to create a file from an existing one, ordered by preference
+LINK_MODES = ["hardlink", "reflink", "copy"]
 
 
 def get_project_dir() -> str:
@@ -22,33 +40,26 @@ def load_config(config_path: typing.Optional[str] = None):
     return json.loads(config_data)
 
 
-def get_credentials_path() -> str:
-    """Retrieve path to file with credentials from config file"""
-    config_json = load_config()
-
-    if not os.path.exists(config_json["credentials_path"]):
+def check_credentials_path(credentials_path: str) -> str:
+    """Ensure that the file with credentials from the config file exists"""
+    if not os.path.exists(credentials_path):
         raise RuntimeError(
             """Credentials file with path in config file doesn't exist.
             Please reconfigure path to the credentials file
             and run the script again."""
         )
-    return config_json["credentials_path"]
-
+    return credentials_path
 
-def get_output_dir() -> str:
-    """Retrieve output directory from config file"""
-    config_json = load_config()
 
-    if not (
-        os.path.exists(config_json["output_dir"])
-        and os.path.isdir(config_json["output_dir"])
-    ):
+def check_output_dir(output_dir: str) -> str:
+    """Ensure that the output directory from the config file exists"""
+    if not (os.path.exists(output_dir) and os.path.isdir(output_dir)):
         raise RuntimeError(
             """Output directory in config file doesn't exist.
             Please reconfigure path to the output directy
             and run the script again."""
         )
-    return config_json["output_dir"]
+    return output_dir
 
 
 def replace_invalid_chars(pdf_path_input: str) -> str:
@@ -70,19 +81,114 @@ def replace_invalid_chars(pdf_path_input: str) -> str:
     return pdf_path_output
 
 
-def save_pdf(content: bytes, pdf_path: str) -> None:
+def save_stream(
+    chunks: typing.Iterable[bytes], pdf_path: str, create_dir: bool = True
+) -> typing.Tuple[int, str]:
+    """
+    Save a stream of chunks atomically as file.
+    The chunks are written to a temporary file in the target directory,
+    which is synced to disk and renamed to the target path afterwards.
+    I.e. the target file is either complete or doesn't exist at all.
+    Args:
+        chunks (Iterable[bytes]): file content as stream of chunks
+        pdf_path (str): path of the file
+        create_dir (bool, optional): create the directory of the file if missing,
+                                     disable if it is known to exist. Defaults to True.
+    Returns:
+        Tuple[int, str]: size of the file, sha256 hex digest of the content
+    """
+    pdf_dir = os.path.dirname(pdf_path)
+    if create_dir:
+        os.makedirs(pdf_dir, exist_ok=True)
+
+    size = 0
+    sha256 = hashlib.sha256()
+    with profile_stage("write"):
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=pdf_dir, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(tmp_fd, "wb") as tmp_file:
+            # the chunks are received while iterating, i.e. only the writes are recorded
+            for chunk in chunks:
+                with profile_stage("write"):
+                    tmp_file.write(chunk)
+                    sha256.update(chunk)
+                size += len(chunk)
+            with profile_stage("write"):
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+        with profile_stage("write"):
+            os.replace(tmp_path, pdf_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    return size, sha256.hexdigest()
+
+
+def save_pdf(content: bytes, pdf_path: str, create_dir: bool = True) -> None:
     """
     Save bytestream as pdf file
     Args:
         content (bytes): pdf file as bytestream
         pdf_path (str): path of pdf file
+        create_dir (bool, optional): see save_stream(). Defaults to True.
     """
-    os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    save_stream([content], pdf_path, create_dir)
+
+
+def reflink_file(source_path: str, target_path: str) -> None:
+    """Clone a file (copy on write), raises OSError if the file system
+    doesn't support it"""
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform")
 
-    with open(pdf_path, "wb") as pdf_file:
-        pdf_file.write(content)
+    with open(source_path, "rb") as source_file, open(target_path, "wb") as target_file:
+        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
 
 
-def get_time_format() -> str:
-    """Time format for logging outputs"""
-    return load_config()["time_format"]
+def link_file(
+    source_path: str,
+    target_path: str,
+    link_mode: str = "hardlink",
+    create_dir: bool = True,
+) -> str:
+    """
+    Create the target path atomically as hardlink, reflink or copy of the source.
+    Falls back to the next mode in LINK_MODES if the preferred one isn't supported,
+    e.g. hardlinks across file systems.
+    Args:
+        source_path (str): existing file
+        target_path (str): path of the new file, replaced if it exists
+        link_mode (str, optional): preferred mode. Defaults to "hardlink".
+        create_dir (bool, optional): see save_stream(). Defaults to True.
+    Returns:
+        str: mode used to create the target path
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode: {link_mode}")
+
+    target_dir = os.path.dirname(target_path)
+    if create_dir:
+        os.makedirs(target_dir, exist_ok=True)
+    tmp_path = os.path.join(target_dir, f".{uuid.uuid4().hex}.part")
+
+    for mode in LINK_MODES[LINK_MODES.index(link_mode) : -1]:
+        try:
+            if mode == "hardlink":
+                os.link(source_path, tmp_path)
+            else:
+                reflink_file(source_path, tmp_path)
+            os.replace(tmp_path, target_path)
+            return mode
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    try:
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return "copy"
@@ -1,11 +1,12 @@
 from abc import ABC
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, root_validator
+import requests
 import typing
 import time
 import uuid
 
 from src.data import config_types
-from src import file_utils
+from src import http_utils
 
 
 def get_session_id() -> str:
@@ -17,13 +18,41 @@ class AbstractHandler(BaseModel, ABC):
     """Abstract handler with functionality which is
     shared by all handlers for the comdirect API."""
 
-    api_config: config_types.ApiConfig = Field(
-        default_factory=config_types.ApiConfig.from_config
-    )
-    time_format: str = file_utils.get_time_format()
+    # settings missing values are taken from, defaults to get_settings()
+    settings: typing.Optional[config_types.Settings] = Field(default=None)
+    api_config: config_types.ApiConfig
+    time_format: str
 
     session_id: typing.Optional[str] = Field(default_factory=get_session_id)
 
+    # pooled HTTP session, share it between handlers to reuse the connections
+    http_session: requests.Session
+
+    # retries of idempotent requests which failed temporarily
+    retry_policy: config_types.RetryPolicy
+
+    class Config:
+        arbitrary_types_allowed = True
+        # handlers are stateful (tokens, sessions), i.e. share instead of copying them
+        copy_on_model_validation = "none"
+
+    @root_validator(pre=True)
+    def defaults_from_settings(
+        cls, values: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        """Take missing values from the settings"""
+        return config_types.apply_settings(
+            values,
+            {
+                "api_config": lambda settings: settings.api_config,
+                "time_format": lambda settings: settings.time_format,
+                "retry_policy": lambda settings: settings.retry_policy,
+                "http_session": lambda settings: http_utils.create_session(
+                    settings.transport_config
+                ),
+            },
+        )
+
     @classmethod
     def generate_request_id(cls) -> str:
         """Returns a request id with 9 characters."""
@@ -0,0 +1,117 @@
+import json
+import typing
+
+
+def parse_response_info(response_info: typing.Optional[str]) -> typing.Dict[str, str]:
+    """Parse the first message of the x-http-response-info header.
+    Falls back to a generic message if the header is missing or malformed."""
+    try:
+        msg_dict = json.loads(response_info)["messages"][0]
+        return {
+            "severity": str(msg_dict["severity"]),
+            "key": str(msg_dict["key"]),
+            "message": str(msg_dict["message"]),
+            **msg_dict,
+        }
+    except (TypeError, ValueError, KeyError, IndexError):
+        return {
+            "severity": "ERROR",
+            "key": "unknown",
+            "message": "No response info provided by the comdirect API",
+        }
+
+
+def create_response_info(key: str, message: str, severity: str = "ERROR") -> str:
+    """Create an x-http-response-info header value,
+    used for failures detected by the client itself"""
+    return json.dumps(
+        {"messages": [{"severity": severity, "key": key, "message": message}]}
+    )
+
+
+def parse_retry_after(retry_after: typing.Optional[str]) -> typing.Optional[float]:
+    """Parse the Retry-After header (only delays in seconds are supported)"""
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        return None
+
+
+class ApiException(Exception):
+    """Exception raised if a request against the comdirect API fails."""
+
+    def __init__(
+        self,
+        response_info: typing.Optional[str],
+        status_code: typing.Optional[int] = None,
+        retry_after: typing.Optional[float] = None,
+    ) -> None:
+        """Initialize the ApiException with severity, key and message info
+        retrieved from the comdirect API.
+
+        Args:
+            response_info (str, optional): Info retrieved from the comdirect API
+                (x-http-response-info header).
+            status_code (int, optional): HTTP status code of the response.
+            retry_after (float, optional): Delay in seconds requested by the API.
+        """
+        msg_dict = parse_response_info(response_info)
+        self.severity: str = msg_dict["severity"]
+        self.key: str = msg_dict["key"]
+        self.msg: str = msg_dict["message"]
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+        self.msg_dict = msg_dict
+        super().__init__(self.severity, self.key, self.msg)
+
+    def __str__(self) -> str:
+        """Return string representation of the ApiException."""
+        status = "" if self.status_code is None else f" (HTTP {self.status_code})"
+        return f"[{self.severity}] {self.key}: {self.msg}{status}"
+
+
+class RateLimitException(ApiException):
+    """Exception raised if the comdirect API throttles the requests (HTTP 429)."""
+
+
+class TransientApiException(ApiException):
+    """Exception raised for temporary failures of the comdirect API (HTTP 5xx / 408),
+    the request might succeed if it is repeated."""
+
+
+class PermanentApiException(ApiException):
+    """Exception raised for failures which won't be resolved by repeating the request."""
+
+
+def raise_for_status(status_code: int, headers: typing.Mapping[str, str]) -> None:
+    """Raise the exception matching the status code of a response:
+    AuthenticationException (401, 403), RateLimitException (429),
+    TransientApiException (408, 5xx) or PermanentApiException (other 4xx).
+    Successful responses (2xx) pass.
+
+    Args:
+        status_code (int): HTTP status code of the response
+        headers (Mapping[str, str]): headers of the response
+    """
+    if 200 <= status_code < 300:
+        return
+
+    # imported here, AuthenticationException is derived from ApiException
+    from src.handler.AuthenticationException import AuthenticationException
+
+    response_info = headers.get("x-http-response-info")
+    retry_after = parse_retry_after(headers.get("Retry-After"))
+    exception_type: typing.Type[ApiException] = PermanentApiException
+    if status_code in (401, 403):
+        exception_type = AuthenticationException
+    elif status_code == 429:
+        exception_type = RateLimitException
+    elif status_code == 408 or status_code >= 500:
+        exception_type = TransientApiException
+
+    raise exception_type(
+        response_info, status_code=status_code, retry_after=retry_after
+    )
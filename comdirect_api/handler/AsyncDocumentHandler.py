@@ -0,0 +1,235 @@
+import typing
+import asyncio
+import json
+import logging
+import aiohttp
+from pydantic import Field
+
+from src import http_utils
+from src.handler.AuthenticatedAbstractHandler import AuthenticatedAbstractHandler
+from src.handler.ApiException import raise_for_status
+from src.data.Document import Document
+from src.data.CompactDocument import AnyDocument, CompactDocument
+
+
+class AsyncDocumentHandler(AuthenticatedAbstractHandler):
+    """Retrieves documents from the comdirect postbox without blocking the event loop.
+    All requests are sent via the given aiohttp.ClientSession,
+    the (interactive) authentication is performed in an executor."""
+
+    # number of documents requested per page of the postbox listing
+    page_size: int = Field(default=1000, ge=1)
+    # parse the listing into CompactDocuments instead of validated Documents
+    compact_documents: bool = True
+
+    retryable_errors: typing.ClassVar[typing.Tuple[typing.Type[Exception], ...]] = (
+        aiohttp.ClientConnectionError,
+        aiohttp.ClientPayloadError,
+        asyncio.TimeoutError,
+    )
+
+    async def get_general_headers_async(self) -> typing.Dict[str, typing.Any]:
+        """General headers for a API request.
+        The token is retrieved in an executor if that would block,
+        i.e. the authentication (or a refresh) is renewed or running.
+        Returns:
+            Dict[str, Any]: general headers
+        """
+        if self.auth_handler.is_renewal_pending():
+            access_token = await asyncio.get_running_loop().run_in_executor(
+                None, self.auth_handler.get_access_token
+            )
+        else:
+            access_token = self.auth_handler.access_token
+
+        return self.get_general_headers(access_token=access_token)
+
+    async def send_get_request(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        payload: typing.Dict[str, typing.Any],
+        accept: typing.Optional[str] = None,
+    ) -> typing.Tuple[str, bytes]:
+        """Send a get request against the comdirect API,
+        see AuthenticatedAbstractHandler.send_get_request().
+        Args:
+            session (aiohttp.ClientSession): session used for the request
+            url (str): api url
+            payload (Dict[str, Any]): payload of the request
+            accept (str, optional): accepted mime type, defaults to JSON
+        Raises:
+            AuthenticationException: Raised if the authentication fails
+            ApiException: Raised if the request fails (after all retries)
+        Returns:
+            Tuple[str, bytes]: mime type of the response, content of the response
+        """
+        attempt = 0
+        while True:
+            headers = await self.get_general_headers_async()
+            if accept is not None:
+                headers["Accept"] = accept
+
+            retry_attempt_token = http_utils.retry_attempt.set(attempt)
+            try:
+                async with session.get(
+                    url, params=payload, headers=headers
+                ) as response:
+                    raise_for_status(response.status, response.headers)
+                    content_type: str = response.headers["content-type"]
+                    content: bytes = await response.read()
+            except Exception as exception:
+                delay = self.get_retry_delay(exception, attempt)
+                if delay is None:
+                    raise
+                logging.warning(
+                    f"Request failed ({exception}), retrying in {delay:.1f} s"
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            finally:
+                http_utils.retry_attempt.reset(retry_attempt_token)
+
+            self.on_request_success()
+            return content_type, content
+
+    async def general_get_request(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        payload: typing.Dict[str, typing.Any],
+    ) -> typing.Dict[str, typing.Any]:
+        """General get request against the comdirect API.
+        Args:
+            session (aiohttp.ClientSession): session used for the request
+            url (str): api url
+            payload (Dict[str, Any]): payload of the request
+        Raises:
+            AuthenticationException: Raised if the authentication fails
+            ApiException: Raised if the request fails (after all retries)
+        Returns:
+            Dict[str, Any]: json representation of the API response.
+        """
+        _, content = await self.send_get_request(
+            session=session, url=url, payload=payload
+        )
+        return json.loads(content)
+
+    def document_from_dict(
+        self, input_dict: typing.Dict[str, typing.Any]
+    ) -> AnyDocument:
+        """Create a document from an entry of the postbox listing"""
+        if self.compact_documents:
+            return CompactDocument.from_dict(input_dict)
+        return Document.from_dict(input_dict)
+
+    async def get_postbox_content_list(
+        self, session: aiohttp.ClientSession, query_params: str = ""
+    ) -> typing.Set[AnyDocument]:
+        """Get list with documents and corresponding metadata in the PostBox,
+        see DocumentHandler.get_postbox_content_list().
+
+        Args:
+            session (aiohttp.ClientSession): session used for the request
+            query_params (str, optional): Optional query params,
+                see postman collection for further details. Defaults to "".
+
+        Returns:
+            Set[Document]: retrieved documents
+        """
+        url = f"{self.api_config.api_url}/messages/clients/user/v2/documents/{query_params}"
+        response_json = await self.general_get_request(
+            session=session, url=url, payload={}
+        )
+
+        return set([self.document_from_dict(v) for v in response_json["values"]])
+
+    async def get_postbox_page(
+        self, session: aiohttp.ClientSession, paging_first: int, paging_count: int
+    ) -> typing.Tuple[typing.List[AnyDocument], int]:
+        """Get one page of the documents in the PostBox,
+        see DocumentHandler.get_postbox_page().
+
+        Args:
+            session (aiohttp.ClientSession): session used for the request
+            paging_first (int): index of the first document of the page
+            paging_count (int): maximum number of documents of the page
+
+        Returns:
+            Tuple[List[Document], int]: retrieved documents,
+                                        total number of documents in the postbox
+        """
+        url = f"{self.api_config.api_url}/messages/clients/user/v2/documents/"
+        response_json = await self.general_get_request(
+            session=session,
+            url=url,
+            payload={"paging-first": paging_first, "paging-count": paging_count},
+        )
+
+        documents = [self.document_from_dict(v) for v in response_json["values"]]
+        return documents, int(response_json["paging"]["matches"])
+
+    async def get_all_postbox_contents(
+        self, session: aiohttp.ClientSession, max_concurrency: int = 1
+    ) -> typing.Set[AnyDocument]:
+        """Load all available documents in postbox,
+        see DocumentHandler.get_all_postbox_contents().
+
+        Args:
+            session (aiohttp.ClientSession): session used for the requests
+            max_concurrency (int, optional): maximum number of concurrent page requests.
+                Defaults to 1.
+
+        Returns:
+            Set[Document]: all documents in the postbox, de-duplicated by document id
+        """
+        first_page, matches = await self.get_postbox_page(
+            session=session, paging_first=0, paging_count=self.page_size
+        )
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def get_page(offset: int) -> typing.List[AnyDocument]:
+            async with semaphore:
+                page, _ = await self.get_postbox_page(
+                    session=session, paging_first=offset, paging_count=self.page_size
+                )
+            return page
+
+        remaining_pages = await asyncio.gather(
+            *[
+                get_page(offset)
+                for offset in range(self.page_size, matches, self.page_size)
+            ]
+        )
+
+        # documents might be listed on multiple pages if the postbox changes meanwhile
+        result: typing.Dict[str, AnyDocument] = {}
+        for page in [first_page, *remaining_pages]:
+            for doc in page:
+                result.setdefault(doc.document_id, doc)
+
+        return set(result.values())
+
+    async def get_document(
+        self,
+        session: aiohttp.ClientSession,
+        document_id: str,
+        document_mime_type: str,
+    ) -> typing.Tuple[str, bytes]:
+        """Get specific document, see DocumentHandler.get_document().
+
+        Args:
+            session (aiohttp.ClientSession): session used for the request
+            document_id (str): Document ID
+            document_mime_type (str): Mime type of the requested document
+
+        Returns:
+            Tuple[str, bytes]: mime type of the retrieved document,
+                               document in bytes representation
+        """
+        url = f"{self.api_config.api_url}/messages/v2/documents/{document_id}"
+        return await self.send_get_request(
+            session=session, url=url, payload={}, accept=document_mime_type
+        )
@@ -1,10 +1,19 @@
-from pydantic import Field
+from pydantic import Field, validator
+import contextlib
+import logging
 import requests
+import time
 import typing
 
+from src import http_utils
+from src.AdaptiveConcurrencyLimiter import AdaptiveConcurrencyLimiter
 from src.handler.AbstractHandler import AbstractHandler
 from src.handler.AuthenticationHandler import AuthenticationHandler
-from src.handler.AuthenticationException import AuthenticationException
+from src.handler.ApiException import (
+    RateLimitException,
+    TransientApiException,
+    raise_for_status,
+)
 
 
 class AuthenticatedAbstractHandler(AbstractHandler):
@@ -12,17 +21,51 @@ class AuthenticatedAbstractHandler(AbstractHandler):
     handlers which access parts of the API requiring authentication
     """
 
-    auth_handler: AuthenticationHandler = Field(default_factory=AuthenticationHandler)
+    auth_handler: AuthenticationHandler = Field(default=None)
 
-    def get_general_headers(self) -> typing.Dict[str, typing.Any]:
+    # adapts the number of concurrent downloads to the throttling of the API
+    concurrency_limiter: typing.Optional[AdaptiveConcurrencyLimiter] = None
+
+    # errors of the transport which are retried like transient API errors
+    retryable_errors: typing.ClassVar[typing.Tuple[typing.Type[Exception], ...]] = (
+        requests.ConnectionError,
+        requests.Timeout,
+    )
+
+    @validator("auth_handler", pre=True, always=True)
+    def default_auth_handler(
+        cls,
+        auth_handler: typing.Optional[AuthenticationHandler],
+        values: typing.Dict[str, typing.Any],
+    ) -> AuthenticationHandler:
+        """Create an authentication handler sharing the settings
+        and the HTTP session if none is given"""
+        if auth_handler is None:
+            auth_handler = AuthenticationHandler(
+                **{
+                    field: values[field]
+                    for field in ["settings", "http_session"]
+                    if values.get(field) is not None
+                }
+            )
+        return auth_handler
+
+    def get_general_headers(
+        self, access_token: typing.Optional[str] = None
+    ) -> typing.Dict[str, typing.Any]:
         """General headers for a API request.
+        Args:
+            access_token (str, optional): token retrieved already,
+                                          defaults to the token of the auth handler
         Returns:
             Dict[str, Any]: general headers
         """
+        if access_token is None:
+            access_token = self.auth_handler.get_access_token()
         return {
             "Accept": "application/json",
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.auth_handler.get_access_token()}",
+            "Authorization": f"Bearer {access_token}",
             "x-http-request-info": str(
                 {
                     "clientRequestId": {
@@ -33,24 +76,107 @@ class AuthenticatedAbstractHandler(AbstractHandler):
             ),
         }
 
+    def get_retry_delay(
+        self, exception: Exception, attempt: int
+    ) -> typing.Optional[float]:
+        """Delay before the next attempt of a failed idempotent request.
+        Throttling is reported to the concurrency limiter.
+        Args:
+            exception (Exception): error of the failed attempt
+            attempt (int): number of the failed attempt (starting at 0)
+        Returns:
+            Optional[float]: delay in seconds, None if the request must not be retried
+        """
+        if isinstance(exception, RateLimitException):
+            if self.concurrency_limiter is not None:
+                self.concurrency_limiter.on_throttle()
+        elif not isinstance(exception, (TransientApiException, *self.retryable_errors)):
+            return None
+
+        if attempt >= self.retry_policy.max_retries:
+            return None
+
+        return self.retry_policy.get_backoff(
+            attempt, retry_after=getattr(exception, "retry_after", None)
+        )
+
+    def on_request_success(self) -> None:
+        """Report a successful request to the concurrency limiter"""
+        if self.concurrency_limiter is not None:
+            self.concurrency_limiter.on_success()
+
+    def send_get_request(
+        self,
+        url: str,
+        payload: typing.Dict[str, typing.Any],
+        accept: typing.Optional[str] = None,
+        stream: bool = False,
+    ) -> requests.Response:
+        """Send a get request against the comdirect API.
+        Throttled requests (HTTP 429), server errors (HTTP 5xx / 408) and connection
+        errors are retried with a jittered exponential backoff, see RetryPolicy.
+        Args:
+            url (str): api url
+            payload (Dict[str, Any]): payload of the request
+            accept (str, optional): accepted mime type, defaults to JSON
+            stream (bool, optional): don't load the content of the response at once
+        Raises:
+            AuthenticationException: Raised if the authentication fails
+            ApiException: Raised if the request fails (after all retries)
+        Returns:
+            requests.Response: successful response
+        """
+        attempt = 0
+        while True:
+            headers = self.get_general_headers()
+            if accept is not None:
+                headers["Accept"] = accept
+
+            retry_attempt_token = http_utils.retry_attempt.set(attempt)
+            try:
+                response = self.http_session.get(
+                    url, params=payload, headers=headers, stream=stream
+                )
+                try:
+                    raise_for_status(response.status_code, response.headers)
+                except Exception:
+                    response.close()
+                    raise
+            except Exception as exception:
+                delay = self.get_retry_delay(exception, attempt)
+                if delay is None:
+                    raise
+                logging.warning(
+                    f"Request failed ({exception}), retrying in {delay:.1f} s"
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            finally:
+                http_utils.retry_attempt.reset(retry_attempt_token)
+
+            self.on_request_success()
+            return response
+
     def general_get_request(
         self,
         url: str,
         payload: typing.Dict[str, typing.Any],
     ) -> typing.Dict[str, typing.Any]:
         """General get request against the comdirect API.
+        Occupies a slot of the concurrency limiter (if any) like the downloads,
+        i.e. the listing counts against the same connection limit.
         Args:
             url (str): api url
             payload (Dict[str, Any]): payload of the request
         Raises:
             AuthenticationException: Raised if the authentication fails
+            ApiException: Raised if the request fails (after all retries)
         Returns:
             Dict[str, Any]: json representation of the API response.
         """
-        headers = self.get_general_headers()
-        response = requests.get(url, params=payload, headers=headers)
-
-        if response.status_code != 200:
-            raise AuthenticationException(response.headers["x-http-response-info"])
-
-        return response.json()
+        with contextlib.nullcontext() if self.concurrency_limiter is None else (
+            self.concurrency_limiter.slot()
+        ):
+            response = self.send_get_request(url=url, payload=payload)
+            return response.json()
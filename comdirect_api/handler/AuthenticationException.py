@@ -1,24 +1,24 @@
-import json
+import typing
 
+from src.handler.ApiException import ApiException
 
-class AuthenticationException(Exception):
+
+class AuthenticationException(ApiException):
     """Exception raised if the authentication fails."""
 
-    def __init__(self, response_info: str) -> None:
+    def __init__(
+        self,
+        response_info: typing.Optional[str],
+        status_code: typing.Optional[int] = None,
+        retry_after: typing.Optional[float] = None,
+    ) -> None:
         """Initialize the AuthenticationException with severity, key and message info
         retrieved from the comdirect API.
 
         Args:
-            response_info (str): Info retrieved from the comdirect API.
+            response_info (str, optional): Info retrieved from the comdirect API.
+                A generic message is used if the info is missing.
+            status_code (int, optional): HTTP status code of the response.
+            retry_after (float, optional): Delay in seconds requested by the API.
         """
-        msg_dict = json.loads(response_info)["messages"][0]
-        self.severity: str = msg_dict["severity"]
-        self.key: str = msg_dict["key"]
-        self.msg: str = msg_dict["message"]
-
-        self.msg_dict = msg_dict
-        super().__init__(self.severity, self.key, self.msg)
-
-    def __str__(self) -> str:
-        """Return string representation of the AuthenticationException."""
-        return f"[{self.severity}] {self.key}: {self.msg}"
+        super().__init__(response_info, status_code, retry_after)
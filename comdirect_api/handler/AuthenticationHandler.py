@@ -1,13 +1,25 @@
 import typing
-from pydantic import Field
-import requests
+from pydantic import Field, PrivateAttr, root_validator
 import json
 import datetime
 import logging
+import requests
+import threading
+import time
+from urllib.parse import urljoin, urlparse
 
 from src.handler.AbstractHandler import AbstractHandler
-from src.data.config_types import Credentials
+from src.data.config_types import Credentials, apply_settings
+from src.handler.ApiException import (
+    PermanentApiException,
+    RateLimitException,
+    TransientApiException,
+    raise_for_status,
+)
 from src.handler.AuthenticationException import AuthenticationException
+from src.handler.SessionCache import SessionCache
+from src.handler.TanConfirmation import TanChallenge, TanConfirmation
+from src.StageProfiler import profile_stage
 
 
 class AuthenticationHandler(AbstractHandler):
@@ -15,19 +27,67 @@ class AuthenticationHandler(AbstractHandler):
 
     access_token: typing.Optional[str] = Field(default=None)
     refresh_token: typing.Optional[str] = Field(default=None)
-    credentials: Credentials = Field(default_factory=Credentials.get_credentials)
+    credentials: Credentials
     session_identifier: typing.Optional[str] = Field(default=None)
     challenge_id: typing.Optional[str] = Field(default=None)
+    tan_challenge: typing.Optional[TanChallenge] = Field(default=None)
     expiration_datetime: typing.Optional[datetime.datetime] = Field(default=None)
 
+    # renew the access token this many seconds before it expires
+    token_refresh_margin: int = Field(ge=0)
+    # optional encrypted cache to reuse a session in a new process
+    session_cache: typing.Optional[SessionCache]
+    # waits until the TAN challenge was solved (poll, prompt, callback, ...)
+    tan_confirmation: TanConfirmation
+
+    # ensures that only one authentication is performed at a time,
+    # even if the handler is shared by multiple download workers
+    _auth_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _session_cache_loaded: bool = PrivateAttr(default=False)
+    # lifetime of the access token (expires_in), None if restored from the cache
+    _token_lifetime: typing.Optional[int] = PrivateAttr(default=None)
+
+    @root_validator(pre=True)
+    def authentication_defaults_from_settings(
+        cls, values: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        """Take missing values from the settings"""
+        return apply_settings(
+            values,
+            {
+                "credentials": lambda settings: Credentials.get_credentials(
+                    settings.get_credentials_path()
+                ),
+                "token_refresh_margin": lambda settings: settings.token_refresh_margin,
+                "session_cache": SessionCache.from_settings,
+                "tan_confirmation": TanConfirmation.from_settings,
+            },
+        )
+
     def get_access_token(self) -> str:
         """Get the access token required to access the protected API endpoints.
-        If required performa the authentication first in order to retrieve the access token."""
-        if not self.is_authenticated():
-            self.authenticate()
+        If required performa the authentication first in order to retrieve the access token.
+        The access token is renewed via the refresh token shortly before it expires.
+        Thread-safe: concurrent callers wait for a running authentication to finish."""
+        # the tokens are already set during the authentication process,
+        # i.e. wait for a running authentication before using them
+        if self.is_renewal_pending():
+            with self._auth_lock:
+                # another worker might have authenticated while waiting for the lock
+                if not self.is_authenticated() or self.needs_refresh():
+                    self.renew_authentication()
 
         return self.access_token
 
+    def is_renewal_pending(self) -> bool:
+        """Check if get_access_token() blocks, i.e. renews the authentication
+        or waits for a running renewal"""
+        return (
+            self._auth_lock.locked()
+            or not self.is_authenticated()
+            or self.needs_refresh()
+        )
+
     def is_authenticated(self) -> bool:
         """Check if the authentication is valid"""
         valid_token = (
@@ -36,21 +96,109 @@ class AuthenticationHandler(AbstractHandler):
         )
         return self.access_token is not None and valid_token
 
+    def get_refresh_margin(self) -> float:
+        """Seconds before the expiration the access token is renewed:
+        token_refresh_margin, at most half of the token lifetime,
+        otherwise every request would renew the token"""
+        if self._token_lifetime is None:
+            return self.token_refresh_margin
+        return min(self.token_refresh_margin, self._token_lifetime / 2)
+
+    def needs_refresh(self) -> bool:
+        """Check if the access token expires within the refresh margin"""
+        return self.expiration_datetime is None or (
+            self.expiration_datetime
+            - datetime.timedelta(seconds=self.get_refresh_margin())
+            <= datetime.datetime.now()
+        )
+
+    def renew_authentication(self) -> None:
+        """Renew the authentication with as little effort as possible:
+        reuse a cached session, refresh the access token
+        or perform the complete authentication process (incl. the TAN challenge)."""
+        with profile_stage("auth"):
+            if self.renew_without_tan():
+                return
+
+            self.authenticate()
+            self.save_session_cache()
+
+    def renew_without_tan(self) -> bool:
+        """Reuse a cached session or refresh the access token.
+        Returns:
+            bool: False if the complete authentication (incl. the TAN challenge)
+                  is required
+        """
+        if not self._session_cache_loaded:
+            self._session_cache_loaded = True
+            self.load_session_cache()
+            if self.is_authenticated() and not self.needs_refresh():
+                logging.info("Reusing cached session")
+                return True
+
+        if self.refresh_token is not None and self.session_identifier is not None:
+            try:
+                self.refresh_access_token()
+                self.save_session_cache()
+                return True
+            except AuthenticationException as exception:
+                logging.warning(f"Refreshing the access token failed: {exception}")
+
+        return False
+
     def authenticate(self) -> None:
         """Authenticate against the comdirect API"""
+        self.start_authentication()
+        self.confirm_tan_challenge()
+        self.complete_authentication()
+
+    def start_authentication(self) -> None:
+        """First part of the authentication up to the TAN challenge,
+        which has to be solved before calling complete_authentication()"""
         self.retrieve_oauth2_token()
         self.retrieve_session_object()
         self.request_tan()
 
-        # Wait until user has verified that the TAN challenge has been solved.
-        # If the TAN challenge has not been solved the authentication process fails.
-        input(
-            (
-                f"{datetime.datetime.now().strftime(self.time_format)}: "
-                + "Activating the session. Confirm that the TAN challenge was solved with ENTER..."
-            )
-        )
+    def confirm_tan_challenge(self) -> None:
+        """Wait until the TAN challenge was solved, see TanConfirmation.
+        If the TAN challenge has not been solved the authentication process fails."""
+        self.tan_confirmation.confirm(self.tan_challenge, self.get_tan_challenge_status)
+
+    def get_tan_challenge_status(self) -> str:
+        """Request the status of the TAN challenge, e.g. PENDING or AUTHENTICATED
+        Raises:
+            ApiException: Raised if the request fails.
+        """
+        headers = {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {self.access_token}",
+            "x-http-request-info": str(
+                {
+                    "clientRequestId": {
+                        "sessionId": self.session_id,
+                        "requestId": AbstractHandler.generate_request_id(),
+                    }
+                }
+            ),
+        }
 
+        response = self.http_session.get(
+            url=self.tan_challenge.status_url, headers=headers
+        )
+        raise_for_status(response.status_code, response.headers)
+        return response.json()["status"]
+
+    def get_tan_challenge_status_url(self, href: str) -> str:
+        """Absolute URL of the challenge status link,
+        the link is relative to the API URL or to its host"""
+        api_url = str(self.api_config.api_url)
+        api_path = urlparse(api_url).path.rstrip("/")
+        if urlparse(href).netloc != "" or href.startswith(f"{api_path}/"):
+            return urljoin(api_url, href)
+        return f"{api_url.rstrip('/')}/{href.lstrip('/')}"
+
+    def complete_authentication(self) -> None:
+        """Second part of the authentication after the TAN challenge was solved"""
         self.activate_session_tan()
         self.oauth2_cd_secondary_flow()
 
@@ -70,9 +218,11 @@ class AuthenticationHandler(AbstractHandler):
         }
         payload = self.credentials.dict()
 
-        response = requests.post(url=oauth2_url, headers=headers, data=payload)
+        response = self.http_session.post(url=oauth2_url, headers=headers, data=payload)
         if response.status_code != 200:
-            raise AuthenticationException(response.headers["x-http-response-info"])
+            raise AuthenticationException(
+                response.headers.get("x-http-response-info"), response.status_code
+            )
 
         self.set_tokens(response_json=response.json())
         logging.info("Retrieved oauth2 token")
@@ -99,9 +249,11 @@ class AuthenticationHandler(AbstractHandler):
             ),
         }
 
-        response = requests.get(url=session_url, headers=headers, data={})
+        response = self.http_session.get(url=session_url, headers=headers, data={})
         if response.status_code != 200:
-            raise AuthenticationException(response.headers["x-http-response-info"])
+            raise AuthenticationException(
+                response.headers.get("x-http-response-info"), response.status_code
+            )
 
         response_json = response.json()[0]
         self.session_identifier = response_json["identifier"]
@@ -136,12 +288,22 @@ class AuthenticationHandler(AbstractHandler):
             }
         )
 
-        response = requests.post(url=tan_url, headers=headers, data=payload)
+        response = self.http_session.post(url=tan_url, headers=headers, data=payload)
         if response.status_code != 201:
-            raise AuthenticationException(response.headers["x-http-response-info"])
+            raise AuthenticationException(
+                response.headers.get("x-http-response-info"), response.status_code
+            )
 
         response_json = json.loads(response.headers["x-once-authentication-info"])
         self.challenge_id = response_json["id"]
+        status_link = response_json.get("link", {}).get("href")
+        self.tan_challenge = TanChallenge(
+            challenge_id=self.challenge_id,
+            tan_type=response_json.get("typ"),
+            status_url=None
+            if status_link is None
+            else self.get_tan_challenge_status_url(status_link),
+        )
         logging.info("Requested tan challenge")
 
     def activate_session_tan(self) -> None:
@@ -173,9 +335,13 @@ class AuthenticationHandler(AbstractHandler):
             }
         )
 
-        response = requests.patch(url=activation_url, headers=headers, data=payload)
+        response = self.http_session.patch(
+            url=activation_url, headers=headers, data=payload
+        )
         if response.status_code != 200:
-            raise AuthenticationException(response.headers["x-http-response-info"])
+            raise AuthenticationException(
+                response.headers.get("x-http-response-info"), response.status_code
+            )
 
         logging.info("Activated TAN session")
 
@@ -202,9 +368,11 @@ class AuthenticationHandler(AbstractHandler):
             "token": self.access_token,
         }
 
-        response = requests.post(url=url, headers=headers, data=payload)
+        response = self.http_session.post(url=url, headers=headers, data=payload)
         if response.status_code != 200:
-            raise AuthenticationException(response.headers["x-http-response-info"])
+            raise AuthenticationException(
+                response.headers.get("x-http-response-info"), response.status_code
+            )
 
         self.set_tokens(response_json=response.json())
 
@@ -212,10 +380,132 @@ class AuthenticationHandler(AbstractHandler):
             "Performed the comdirect specific OAuth2 authentication flow 'cd_secondary'"
         )
 
+    def refresh_access_token(self) -> None:
+        """Renew the access token with the refresh token (OAuth2 "refresh_token" grant),
+        i.e. without another TAN challenge. Throttled requests (HTTP 429),
+        server errors (HTTP 5xx / 408) and connection errors are retried
+        (see RetryPolicy) and raised if they persist.
+        Raises:
+            AuthenticationException: Raised if the refresh token is rejected
+                (HTTP 400 / 401, e.g. invalid_grant), i.e. a new TAN is required.
+            ApiException: Raised if the refresh fails otherwise.
+            requests.RequestException: Raised if the API isn't reachable.
+        """
+        url = f"{self.api_config.oauth_url}/oauth/token"
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+        }
+        payload = {
+            "client_id": self.credentials.client_id,
+            "client_secret": self.credentials.client_secret,
+            "grant_type": "refresh_token",
+            "refresh_token": self.refresh_token,
+        }
+
+        attempt = 0
+        while True:
+            try:
+                response = self.http_session.post(
+                    url=url, headers=headers, data=payload
+                )
+                if response.status_code in (400, 401):
+                    raise AuthenticationException(
+                        response.headers.get("x-http-response-info"),
+                        response.status_code,
+                    )
+                if response.status_code == 403:
+                    # not a matter of the refresh token, i.e. a TAN doesn't help
+                    raise PermanentApiException(
+                        response.headers.get("x-http-response-info"),
+                        status_code=response.status_code,
+                    )
+                raise_for_status(response.status_code, response.headers)
+            except (
+                RateLimitException,
+                TransientApiException,
+                requests.RequestException,
+            ) as exception:
+                if attempt >= self.retry_policy.max_retries:
+                    raise
+                delay = self.retry_policy.get_backoff(
+                    attempt, retry_after=getattr(exception, "retry_after", None)
+                )
+                logging.warning(
+                    f"Refreshing the access token failed ({exception}), "
+                    + f"retrying in {delay:.1f} s"
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            break
+
+        self.set_tokens(response_json=response.json())
+        logging.info("Refreshed access token")
+
+    def get_session_cache_secret(self) -> str:
+        """Secret the session cache is encrypted with"""
+        return (
+            f"{self.credentials.username}:{self.credentials.password}"
+            + f":{self.credentials.client_secret}"
+        )
+
+    def load_session_cache(self) -> None:
+        """Restore the session from the session cache, if configured"""
+        if self.session_cache is None:
+            return
+
+        session_state = self.session_cache.load(self.get_session_cache_secret())
+        if session_state is None:
+            return
+
+        try:
+            expiration_datetime = datetime.datetime.fromisoformat(
+                session_state["expiration_datetime"]
+            )
+            access_token = session_state["access_token"]
+            refresh_token = session_state["refresh_token"]
+            session_identifier = session_state["session_identifier"]
+            session_id = session_state["session_id"]
+        except (KeyError, TypeError, ValueError) as exception:
+            logging.warning(f"Session cache is incomplete ({exception}), it is ignored")
+            return
+
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.session_identifier = session_identifier
+        self.session_id = session_id
+        self.expiration_datetime = expiration_datetime
+
+    def save_session_cache(self) -> None:
+        """Save the current session to the session cache, if configured"""
+        if self.session_cache is None:
+            return
+
+        self.session_cache.save(
+            {
+                "access_token": self.access_token,
+                "refresh_token": self.refresh_token,
+                "session_identifier": self.session_identifier,
+                "session_id": self.session_id,
+                "expiration_datetime": self.expiration_datetime.isoformat(),
+            },
+            self.get_session_cache_secret(),
+        )
+
     def set_tokens(self, response_json: typing.Dict[str, typing.Any]) -> None:
         """Set the retrieved access and refresh token"""
         self.access_token = response_json["access_token"]
         self.refresh_token = response_json["refresh_token"]
+        expires_in = int(response_json["expires_in"])
         self.expiration_datetime = datetime.datetime.now() + datetime.timedelta(
-            seconds=int(response_json["expires_in"])
+            seconds=expires_in
         )
+        if self._token_lifetime != expires_in and (
+            self.token_refresh_margin > expires_in / 2
+        ):
+            logging.warning(
+                f"token_refresh_margin ({self.token_refresh_margin} s) exceeds half "
+                + f"of the token lifetime ({expires_in} s), using {expires_in / 2} s"
+            )
+        self._token_lifetime = expires_in
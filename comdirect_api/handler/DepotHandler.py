@@ -0,0 +1,65 @@
+import typing
+
+from src.handler.AuthenticatedAbstractHandler import AuthenticatedAbstractHandler
+
+
+class DepotPosition(typing.NamedTuple):
+    """Position of a depot, i.e. the security held"""
+
+    depot_id: str
+    wkn: str
+    # None if the instrument isn't part of the response
+    isin: typing.Optional[str]
+    name: typing.Optional[str]
+
+
+class DepotHandler(AuthenticatedAbstractHandler):
+    """Retrieves the depots and their positions from the comdirect brokerage API"""
+
+    def get_depot_ids(self) -> typing.List[str]:
+        """Get the ids of the depots of the user.
+        Described in section 5.1.1 in the comdirect API documentation.
+
+        Returns:
+            List[str]: depot ids
+        """
+        url = f"{self.api_config.api_url}/brokerage/clientId/user/v3/depots"
+        response_json = self.general_get_request(url=url, payload={})
+
+        return [depot["depotId"] for depot in response_json["values"]]
+
+    def get_depot_positions(self, depot_id: str) -> typing.List[DepotPosition]:
+        """Get the positions of a depot incl. their instruments (WKN, ISIN, name).
+        Described in section 5.1.2 in the comdirect API documentation.
+
+        Args:
+            depot_id (str): Depot ID
+
+        Returns:
+            List[DepotPosition]: positions of the depot
+        """
+        url = f"{self.api_config.api_url}/brokerage/v3/depots/{depot_id}/positions"
+        response_json = self.general_get_request(
+            url=url, payload={"with-attr": "instrument"}
+        )
+
+        positions = []
+        for position in response_json["values"]:
+            instrument = position.get("instrument") or {}
+            positions.append(
+                DepotPosition(
+                    depot_id=depot_id,
+                    wkn=position.get("wkn") or instrument["wkn"],
+                    isin=instrument.get("isin"),
+                    name=instrument.get("name"),
+                )
+            )
+        return positions
+
+    def get_all_depot_positions(self) -> typing.List[DepotPosition]:
+        """Get the positions of all depots of the user"""
+        return [
+            position
+            for depot_id in self.get_depot_ids()
+            for position in self.get_depot_positions(depot_id)
+        ]
@@ -1,14 +1,55 @@
 import typing
-import requests
+import collections
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from pydantic import Field
 
 from src.handler.AuthenticatedAbstractHandler import AuthenticatedAbstractHandler
 from src.data.Document import Document
+from src.data.CompactDocument import AnyDocument, CompactDocument
+from src.ContentStore import ContentStore
+from src.StorageBackend import StorageBackend
+from src.StageProfiler import profile_stage
+from src import file_utils
+
+
+class PostboxPage(typing.NamedTuple):
+    """Page of the postbox listing"""
+
+    # documents of the page which haven't been listed on a previous page
+    documents: typing.List[AnyDocument]
+    # total number of documents in the postbox
+    matches: int
 
 
 class DocumentHandler(AuthenticatedAbstractHandler):
     """Retrieves documents from the comdirect postbox"""
 
-    def get_postbox_content_list(self, query_params: str = "") -> typing.Set[Document]:
+    # number of documents requested per page of the postbox listing
+    page_size: int = Field(default=1000, ge=1)
+    # parse the listing into CompactDocuments instead of validated Documents
+    compact_documents: bool = True
+    # size of the chunks in bytes when streaming documents
+    download_chunk_size: int = Field(default=64 * 1024, ge=1)
+
+    def document_from_dict(
+        self, input_dict: typing.Dict[str, typing.Any]
+    ) -> AnyDocument:
+        """Create a document from an entry of the postbox listing"""
+        if self.compact_documents:
+            return CompactDocument.from_dict(input_dict)
+        return Document.from_dict(input_dict)
+
+    def documents_from_dicts(
+        self, input_dicts: typing.List[typing.Dict[str, typing.Any]]
+    ) -> typing.List[AnyDocument]:
+        """Create the documents of a page of the postbox listing"""
+        with profile_stage("parsing"):
+            return [self.document_from_dict(v) for v in input_dicts]
+
+    def get_postbox_content_list(
+        self, query_params: str = ""
+    ) -> typing.Set[AnyDocument]:
         """Get list with documents and corresponding metadata in the PostBox.
         To download a document use the function DocumentHandler.get_document().
         Described in section 9.1.1 in the comdirect API documentation.
@@ -21,31 +62,150 @@ class DocumentHandler(AuthenticatedAbstractHandler):
             List[Document]: retrieved documents
         """
         url = f"{self.api_config.api_url}/messages/clients/user/v2/documents/{query_params}"
-        response_json = self.general_get_request(url=url, payload={})
+        with profile_stage("listing"):
+            response_json = self.general_get_request(url=url, payload={})
+
+        return set(self.documents_from_dicts(response_json["values"]))
+
+    def get_postbox_page(
+        self, paging_first: int, paging_count: int
+    ) -> typing.Tuple[typing.List[AnyDocument], int]:
+        """Get one page of the documents in the PostBox.
+
+        Args:
+            paging_first (int): index of the first document of the page
+            paging_count (int): maximum number of documents of the page
+
+        Returns:
+            Tuple[List[Document], int]: retrieved documents,
+                                        total number of documents in the postbox
+        """
+        url = f"{self.api_config.api_url}/messages/clients/user/v2/documents/"
+        with profile_stage("listing"):
+            response_json = self.general_get_request(
+                url=url,
+                payload={"paging-first": paging_first, "paging-count": paging_count},
+            )
+
+        documents = self.documents_from_dicts(response_json["values"])
+        return documents, int(response_json["paging"]["matches"])
+
+    def iter_postbox_pages(
+        self,
+        max_workers: int = 1,
+        stop_condition: typing.Optional[
+            typing.Callable[[typing.List[AnyDocument]], bool]
+        ] = None,
+    ) -> typing.Iterator[PostboxPage]:
+        """Iterate over the pages of the postbox, newest documents first.
+        The first page reveals the total number of documents,
+        the remaining pages are fetched concurrently by up to max_workers workers.
+        At most max_workers pages are requested ahead of the consumer,
+        i.e. a slow consumer slows down the listing instead of buffering the postbox.
+        If a stop condition is given the pages are fetched one after another
+        until the condition is met for a page.
+
+        Args:
+            max_workers (int, optional): maximum number of concurrent page requests.
+                Defaults to 1.
+            stop_condition (Callable[[List[Document]], bool], optional):
+                stop listing after the first page for which the condition is met,
+                evaluated before the page is yielded. Defaults to None.
 
-        return set([Document.from_dict(v) for v in response_json["values"]])
+        Yields:
+            PostboxPage: documents of the page which haven't been listed before,
+                         total number of documents in the postbox
+        """
+        # documents might be listed on multiple pages if the postbox changes meanwhile
+        listed_ids: typing.Set[str] = set()
 
-    def get_all_postbox_contents(self) -> typing.Set[Document]:
-        """Load all available documents in postbox"""
-        result: typing.Set[Document] = set()
+        def get_new_documents(
+            page: typing.List[AnyDocument],
+        ) -> typing.List[AnyDocument]:
+            new_documents = []
+            for doc in page:
+                if doc.document_id not in listed_ids:
+                    listed_ids.add(doc.document_id)
+                    new_documents.append(doc)
+            return new_documents
 
-        new_documents = True
-        iteration = 0
-        while new_documents:
-            # retrieve next 1000 documents from the postbox
-            tmp_documents = self.get_postbox_content_list(
-                query_params=f"?paging-first={iteration}&paging-count=1000"
+        def get_page(offset: int) -> typing.List[AnyDocument]:
+            page, _ = self.get_postbox_page(
+                paging_first=offset, paging_count=self.page_size
             )
+            return page
+
+        first_page, matches = self.get_postbox_page(
+            paging_first=0, paging_count=self.page_size
+        )
+        offsets = range(self.page_size, matches, self.page_size)
+
+        if stop_condition is not None:
+            # evaluated before the consumer processes the page
+            stop = stop_condition(first_page)
+            yield PostboxPage(get_new_documents(first_page), matches)
+            for offset in offsets:
+                if stop:
+                    return
+                page = get_page(offset)
+                stop = stop_condition(page)
+                yield PostboxPage(get_new_documents(page), matches)
+            return
+
+        yield PostboxPage(get_new_documents(first_page), matches)
+        if len(offsets) == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending_pages: typing.Deque[Future] = collections.deque()
+            for offset in offsets:
+                pending_pages.append(executor.submit(get_page, offset))
+                if len(pending_pages) >= max_workers:
+                    page = pending_pages.popleft().result()
+                    yield PostboxPage(get_new_documents(page), matches)
+            while len(pending_pages) > 0:
+                page = pending_pages.popleft().result()
+                yield PostboxPage(get_new_documents(page), matches)
+
+    def iter_postbox_contents(
+        self,
+        max_workers: int = 1,
+        stop_condition: typing.Optional[
+            typing.Callable[[typing.List[AnyDocument]], bool]
+        ] = None,
+    ) -> typing.Iterator[AnyDocument]:
+        """Iterate over all documents in the postbox, de-duplicated by document id,
+        see DocumentHandler.iter_postbox_pages()."""
+        for page in self.iter_postbox_pages(
+            max_workers=max_workers, stop_condition=stop_condition
+        ):
+            yield from page.documents
 
-            # check if any documents are new, some documents are retrieved multiple times
-            new_documents = len([doc for doc in tmp_documents if doc not in result]) > 0
+    def get_all_postbox_contents(
+        self,
+        max_workers: int = 1,
+        stop_condition: typing.Optional[
+            typing.Callable[[typing.List[AnyDocument]], bool]
+        ] = None,
+    ) -> typing.Set[AnyDocument]:
+        """Load all available documents in postbox,
+        see DocumentHandler.iter_postbox_pages().
 
-            if new_documents:
-                # new documents found, i.e. check next page for new documents too
-                iteration += 1
-                result.update(tmp_documents)
+        Args:
+            max_workers (int, optional): maximum number of concurrent page requests.
+                Defaults to 1.
+            stop_condition (Callable[[List[Document]], bool], optional):
+                stop listing after the first page for which the condition is met.
+                Defaults to None.
 
-        return result
+        Returns:
+            Set[Document]: all documents in the postbox, de-duplicated by document id
+        """
+        return set(
+            self.iter_postbox_contents(
+                max_workers=max_workers, stop_condition=stop_condition
+            )
+        )
 
     def get_document(
         self, document_id: str, document_mime_type: str
@@ -59,16 +219,83 @@ class DocumentHandler(AuthenticatedAbstractHandler):
             document_id (str): Document ID
             document_mime_type (str): Mime type of the requested document
 
+        Raises:
+            ApiException: Raised if the request fails (after all retries)
+
         Returns:
             Tuple[str, bytes]: mime type of the retrieved document,
                                document in bytes representation
         """
         url = f"{self.api_config.api_url}/messages/v2/documents/{document_id}"
-        headers = self.get_general_headers()
-        headers["Accept"] = document_mime_type
-        response = requests.get(url, params={}, headers=headers)
+        response = self.send_get_request(url=url, payload={}, accept=document_mime_type)
 
         content_type: str = response.headers["content-type"]
         content: bytes = response.content
 
         return content_type, content
+
+    @contextlib.contextmanager
+    def stream_document(
+        self, document_id: str, document_mime_type: str
+    ) -> typing.Iterator[typing.Tuple[str, typing.Iterator[bytes]]]:
+        """Stream specific document instead of loading it into memory at once,
+        see DocumentHandler.get_document().
+        The connection is released when the context is left.
+        Only the request is retried, not an interrupted transfer.
+
+        Args:
+            document_id (str): Document ID
+            document_mime_type (str): Mime type of the requested document
+
+        Yields:
+            Tuple[str, Iterator[bytes]]: mime type of the retrieved document,
+                                         document content as chunks
+        """
+        url = f"{self.api_config.api_url}/messages/v2/documents/{document_id}"
+        with self.send_get_request(
+            url=url, payload={}, accept=document_mime_type, stream=True
+        ) as response:
+            content_type: str = response.headers["content-type"]
+            yield content_type, response.iter_content(
+                chunk_size=self.download_chunk_size
+            )
+
+    def download_document(
+        self,
+        document_id: str,
+        document_mime_type: str,
+        document_path: str,
+        content_store: typing.Optional[ContentStore] = None,
+        create_dir: bool = True,
+        storage: typing.Optional[StorageBackend] = None,
+    ) -> typing.Tuple[int, str]:
+        """Download specific document and save it atomically,
+        the memory footprint is bounded by the chunk size.
+
+        Args:
+            document_id (str): Document ID
+            document_mime_type (str): Mime type of the requested document
+            document_path (str): path the document is saved to
+            content_store (ContentStore, optional): store the content once
+                and link it to the path instead. Defaults to None.
+            create_dir (bool, optional): create the directory of the path if missing,
+                disable if it is known to exist. Defaults to True.
+            storage (StorageBackend, optional): save the document in the storage
+                instead (incl. its content store). Defaults to None.
+
+        Returns:
+            Tuple[int, str]: size of the document, sha256 hex digest of the document
+        """
+        # the writing of the chunks is recorded as separate stage
+        with profile_stage("download"), self.stream_document(
+            document_id=document_id, document_mime_type=document_mime_type
+        ) as (_, chunks):
+            if storage is not None:
+                return storage.save_stream(chunks=chunks, path=document_path)
+            if content_store is not None:
+                return content_store.save_stream(
+                    chunks=chunks, pdf_path=document_path, create_dir=create_dir
+                )
+            return file_utils.save_stream(
+                chunks=chunks, pdf_path=document_path, create_dir=create_dir
+            )
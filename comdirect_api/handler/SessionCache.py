@@ -0,0 +1,94 @@
+from pydantic import BaseModel
+import base64
+import json
+import os
+import typing
+import logging
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from src.data.config_types import Settings
+
+
+class SessionCache(BaseModel):
+    """Encrypted on-disk cache of an authenticated session,
+    which allows a new process to reuse a still valid session.
+    The key is derived from a secret (i.e. the user credentials),
+    so the cache can only be read with the same credentials."""
+
+    cache_path: str
+    kdf_iterations: int = 390000
+
+    class Config:
+        allow_mutation = False
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> typing.Optional["SessionCache"]:
+        """Create the session cache configured in the settings.
+        Returns None if no session cache is configured."""
+        if settings.session_cache_path is None:
+            return None
+
+        return SessionCache(cache_path=settings.session_cache_path)
+
+    def derive_key(self, secret: str, salt: bytes) -> bytes:
+        """Derive the encryption key from the secret"""
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=self.kdf_iterations,
+        )
+        return base64.urlsafe_b64encode(kdf.derive(secret.encode("UTF-8")))
+
+    def save(self, session_state: typing.Dict[str, typing.Any], secret: str) -> None:
+        """Encrypt and save the session state, readable by the owner only"""
+        salt = os.urandom(16)
+        token = Fernet(self.derive_key(secret, salt)).encrypt(
+            json.dumps(session_state).encode("UTF-8")
+        )
+        cache_data = json.dumps(
+            {
+                "salt": base64.b64encode(salt).decode("ascii"),
+                "token": token.decode("ascii"),
+            }
+        )
+
+        tmp_path = f"{self.cache_path}.tmp"
+        tmp_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(tmp_fd, "w", encoding="UTF-8") as cache_file:
+            cache_file.write(cache_data)
+        os.replace(tmp_path, self.cache_path)
+
+    def load(self, secret: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        """Load and decrypt the session state.
+        Returns None if there's no cache or it is corrupt
+        or can't be decrypted with the secret."""
+        if not os.path.exists(self.cache_path):
+            return None
+
+        try:
+            with open(self.cache_path, "r", encoding="UTF-8") as cache_file:
+                cache_json = json.loads(cache_file.read())
+            session_data = Fernet(
+                self.derive_key(secret, base64.b64decode(cache_json["salt"]))
+            ).decrypt(cache_json["token"].encode("ascii"))
+            session_state = json.loads(session_data)
+        except InvalidToken:
+            logging.warning("Session cache can't be decrypted, it is ignored")
+            return None
+        except (ValueError, TypeError, KeyError, AttributeError) as exception:
+            # e.g. truncated or not written by this version
+            logging.warning(f"Session cache is corrupt ({exception}), it is ignored")
+            return None
+
+        if not isinstance(session_state, dict):
+            logging.warning("Session cache is corrupt, it is ignored")
+            return None
+        return session_state
+
+    def clear(self) -> None:
+        """Remove the cached session"""
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
@@ -0,0 +1,209 @@
+from pydantic import BaseModel, Field
+from abc import ABC, abstractmethod
+import datetime
+import logging
+import threading
+import time
+import typing
+
+import requests
+
+from src.data.config_types import Settings
+from src.handler.ApiException import (
+    PermanentApiException,
+    RateLimitException,
+    TransientApiException,
+    create_response_info,
+)
+from src.handler.AuthenticationException import AuthenticationException
+
+# status of a TAN challenge as reported by the comdirect API
+TAN_STATUS_PENDING = "PENDING"
+TAN_STATUS_AUTHENTICATED = "AUTHENTICATED"
+
+
+class TanChallenge(typing.NamedTuple):
+    """TAN challenge requested for a session (x-once-authentication-info header)"""
+
+    challenge_id: str
+    # e.g. P_TAN_PUSH, P_TAN or M_TAN
+    tan_type: typing.Optional[str]
+    # URL of the challenge status, None if the API didn't provide one
+    status_url: typing.Optional[str]
+
+
+class TanConfirmation(BaseModel, ABC):
+    """Waits until a TAN challenge was solved, i.e. before the session is activated.
+    Raises an AuthenticationException if the challenge wasn't solved."""
+
+    class Config:
+        arbitrary_types_allowed = True
+        copy_on_model_validation = "none"
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "TanConfirmation":
+        """TAN confirmation configured in the settings"""
+        prompt = PromptTanConfirmation(time_format=settings.time_format)
+        config = settings.tan_confirmation_config
+        if config.mode == "prompt":
+            return prompt
+
+        return PollingTanConfirmation(
+            poll_interval=config.poll_interval,
+            poll_interval_max=config.poll_interval_max,
+            poll_backoff_factor=config.poll_backoff_factor,
+            timeout=config.timeout,
+            fallback=prompt,
+        )
+
+    @abstractmethod
+    def confirm(
+        self, challenge: TanChallenge, get_status: typing.Callable[[], str]
+    ) -> None:
+        """Wait until the TAN challenge was solved.
+        Args:
+            challenge (TanChallenge): challenge to wait for
+            get_status (Callable[[], str]): requests the current challenge status
+        """
+
+
+class PromptTanConfirmation(TanConfirmation):
+    """Waits until the user confirms with ENTER that the TAN challenge was solved.
+    If the challenge wasn't solved, the activation of the session fails."""
+
+    time_format: str
+
+    def confirm(
+        self, challenge: TanChallenge, get_status: typing.Callable[[], str]
+    ) -> None:
+        input(
+            (
+                f"{datetime.datetime.now().strftime(self.time_format)}: "
+                + "Activating the session. Confirm that the TAN challenge was solved with ENTER..."
+            )
+        )
+
+
+class PollingTanConfirmation(TanConfirmation):
+    """Polls the status of the TAN challenge with backoff until it is approved,
+    e.g. in the app for push-TANs. Unattended runs are possible this way."""
+
+    poll_interval: float = Field(default=1, gt=0)
+    poll_interval_max: float = Field(default=5, gt=0)
+    poll_backoff_factor: float = Field(default=1.5, ge=1)
+    timeout: float = Field(default=300, gt=0)
+    # used if the status of the challenge can't be polled
+    fallback: typing.Optional[TanConfirmation]
+
+    def confirm(
+        self, challenge: TanChallenge, get_status: typing.Callable[[], str]
+    ) -> None:
+        if challenge.status_url is None:
+            self.confirm_with_fallback(
+                challenge, get_status, "the challenge has no status"
+            )
+            return
+
+        logging.info(
+            f"Waiting for the approval of the TAN challenge {challenge.challenge_id}"
+        )
+        deadline = time.monotonic() + self.timeout
+        poll_interval = self.poll_interval
+        while True:
+            try:
+                status = get_status()
+            except PermanentApiException as exception:
+                # e.g. the endpoint isn't supported for the TAN type
+                self.confirm_with_fallback(challenge, get_status, str(exception))
+                return
+            except (
+                RateLimitException,
+                TransientApiException,
+                requests.ConnectionError,
+                requests.Timeout,
+            ) as exception:
+                logging.debug(f"Polling the TAN challenge status failed: {exception}")
+                status = TAN_STATUS_PENDING
+
+            if status == TAN_STATUS_AUTHENTICATED:
+                logging.info("TAN challenge approved")
+                return
+            if status != TAN_STATUS_PENDING:
+                raise AuthenticationException(
+                    create_response_info(
+                        "tan_challenge_failed", f"TAN challenge status {status}"
+                    )
+                )
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AuthenticationException(
+                    create_response_info(
+                        "tan_challenge_timeout",
+                        f"TAN challenge not approved within {self.timeout:g} s",
+                    )
+                )
+            time.sleep(min(poll_interval, remaining))
+            poll_interval = min(
+                self.poll_interval_max, poll_interval * self.poll_backoff_factor
+            )
+
+    def confirm_with_fallback(
+        self,
+        challenge: TanChallenge,
+        get_status: typing.Callable[[], str],
+        reason: str,
+    ) -> None:
+        """Confirm the challenge with the fallback, if any"""
+        if self.fallback is None:
+            raise AuthenticationException(
+                create_response_info(
+                    "tan_challenge_not_pollable",
+                    f"Can't poll the TAN challenge: {reason}",
+                )
+            )
+
+        logging.info(f"Can't poll the TAN challenge ({reason}), using the fallback")
+        self.fallback.confirm(challenge, get_status)
+
+
+class CallbackTanConfirmation(TanConfirmation):
+    """Calls the given function, which returns once the TAN challenge was solved,
+    e.g. to notify the user via a GUI or a chat bot.
+    The function returns False if the challenge was rejected."""
+
+    callback: typing.Callable[[TanChallenge], bool]
+
+    def confirm(
+        self, challenge: TanChallenge, get_status: typing.Callable[[], str]
+    ) -> None:
+        if not self.callback(challenge):
+            raise AuthenticationException(
+                create_response_info(
+                    "tan_challenge_rejected", "TAN challenge rejected by the callback"
+                )
+            )
+
+
+class EventTanConfirmation(TanConfirmation):
+    """Waits until the event is set by another thread (external signal),
+    the event is cleared afterwards for the next challenge."""
+
+    event: threading.Event = Field(default_factory=threading.Event)
+    # seconds to wait for the event, None waits forever
+    timeout: typing.Optional[float] = Field(default=None, gt=0)
+
+    def confirm(
+        self, challenge: TanChallenge, get_status: typing.Callable[[], str]
+    ) -> None:
+        logging.info(
+            f"Waiting for the confirmation of the TAN challenge {challenge.challenge_id}"
+        )
+        if not self.event.wait(self.timeout):
+            raise AuthenticationException(
+                create_response_info(
+                    "tan_challenge_timeout",
+                    f"TAN challenge not confirmed within {self.timeout:g} s",
+                )
+            )
+        self.event.clear()
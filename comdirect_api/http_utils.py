@@ -0,0 +1,59 @@
+import contextvars
+import typing
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.data.config_types import TransportConfig
+
+# number of the current retry of a request (0 for the first attempt),
+# set by the handlers so the retries are visible to the response hooks
+retry_attempt: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "retry_attempt", default=0
+)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter which applies a default timeout to all requests
+    which don't specify a timeout explicitly."""
+
+    def __init__(
+        self,
+        timeout: typing.Tuple[float, float],
+        *args: typing.Any,
+        **kwargs: typing.Any
+    ) -> None:
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(
+    transport_config: typing.Optional[TransportConfig] = None,
+) -> requests.Session:
+    """Create a pooled HTTP session with keep-alive connections.
+    The session is meant to be shared by all handlers of a ComdirectAPI instance,
+    so the TCP and TLS handshakes are only performed once per connection.
+    Args:
+        transport_config (TransportConfig, optional): pool sizes and timeouts.
+            Loaded from the config file if not given.
+    Returns:
+        requests.Session: configured session
+    """
+    if transport_config is None:
+        transport_config = TransportConfig.from_config()
+
+    adapter = TimeoutHTTPAdapter(
+        timeout=(transport_config.connect_timeout, transport_config.read_timeout),
+        pool_connections=transport_config.pool_connections,
+        pool_maxsize=transport_config.pool_maxsize,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
@@ -1,18 +1,130 @@
+import argparse
+import contextlib
+import datetime
 import logging
+import signal
 
-from comdirect_api import file_utils
+from comdirect_api.data.config_types import Settings, get_settings
 from comdirect_api.ComdirectAPI import ComdirectAPI
+from comdirect_api.DocumentCatalog import DocumentCatalog
+from comdirect_api.StageProfiler import StageProfiler
+from comdirect_api.SyncDaemon import SyncDaemon
+from comdirect_api.SyncOrchestrator import SyncOrchestrator
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Download the documents in the comdirect postbox"
+    )
+    parser.add_argument(
+        "--plan",
+        metavar="PATH",
+        help="dry run: write the sync plan as JSON Lines to PATH ('-' for stdout) "
+        + "instead of downloading any documents",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running and poll the postbox for new documents "
+        + "(see the daemon section of the config)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="profile the stages of the run: write a cProfile dump to PATH "
+        + "and the time and allocations per stage next to it (.txt)",
+    )
+    export_group = parser.add_argument_group(
+        "catalog export", "export the document catalog without accessing the API"
+    )
+    export_group.add_argument(
+        "--export", metavar="PATH", help="export to PATH (.csv or .parquet)"
+    )
+    export_group.add_argument(
+        "--account", help="name of the account whose catalog is exported"
+    )
+    export_group.add_argument("--wkn")
+    export_group.add_argument("--file-class")
+    export_group.add_argument(
+        "--since", type=datetime.date.fromisoformat, help="YYYY-MM-DD"
+    )
+    export_group.add_argument(
+        "--until", type=datetime.date.fromisoformat, help="YYYY-MM-DD"
+    )
+    args = parser.parse_args()
+
+    settings = get_settings()
     logging.basicConfig(
         format="%(asctime)s %(levelname)-8s %(message)s",
         level=logging.INFO,
-        datefmt=file_utils.get_time_format(),
+        datefmt=settings.time_format,
     )
 
-    comdirect_api = ComdirectAPI()
-    comdirect_api.process_postbox_documents()
+    if args.export is not None:
+        export_catalog(args)
+        return
+
+    with contextlib.nullcontext() if args.profile is None else (
+        StageProfiler(profile_path=args.profile).profile()
+    ):
+        run(args, settings)
+
+
+def run(args: argparse.Namespace, settings: Settings) -> None:
+    """Sync, plan or poll the postbox as requested by the arguments"""
+    if args.daemon:
+        run_daemon(settings)
+        return
+
+    if len(settings.accounts) > 0:
+        sync_orchestrator = SyncOrchestrator(settings=settings)
+        if args.plan is not None:
+            sync_orchestrator.plan(args.plan)
+        else:
+            sync_orchestrator.sync()
+        return
+
+    with ComdirectAPI(settings=settings) as comdirect_api:
+        if args.plan is not None:
+            comdirect_api.plan_postbox_documents(args.plan)
+        else:
+            comdirect_api.process_postbox_documents()
+
+
+def run_daemon(settings: Settings) -> None:
+    """Poll the postbox until SIGINT or SIGTERM"""
+    if len(settings.accounts) > 0:
+        raise RuntimeError("The daemon mode supports a single account only")
+
+    daemon = SyncDaemon(settings=settings)
+    for signal_number in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signal_number, lambda signal_number, frame: daemon.stop())
+    daemon.run()
+
+
+def export_catalog(args: argparse.Namespace) -> None:
+    """Export the catalog of the configured (or the given) account"""
+    settings = get_settings()
+    if args.account is not None:
+        accounts = [
+            account for account in settings.accounts if account.name == args.account
+        ]
+        if len(accounts) == 0:
+            raise RuntimeError(f"Unknown account: {args.account}")
+        settings = accounts[0].to_settings(settings)
+
+    catalog = DocumentCatalog.from_settings(settings)
+    if catalog is None:
+        raise RuntimeError("No catalog_path configured")
+
+    count = catalog.export(
+        args.export,
+        wkn=args.wkn,
+        file_class=args.file_class,
+        date_from=args.since,
+        date_to=args.until,
+    )
+    logging.info(f"Exported {count} documents to {args.export}")
 
 
 if __name__ == "__main__":